@@ -0,0 +1,57 @@
+"""
+Call-count check for the organ classifier modules.
+
+Runs every *_Disease_Classifier on one report against FakeLM and compares the number of
+LLM calls with the pinned EXPECTED_CALLS. Exits non-zero on any mismatch, so a change that
+silently adds calls per report (e.g. calling a classifier twice) is caught.
+
+Usage: python -m metric.benchmark.call_count
+(tests/test_call_count.py enforces the same counts, plus the organ builder calls, under pytest)
+"""
+import sys
+
+import dspy
+
+from ..prompt.lung_prompt import Lung_Disease_Classifier
+from ..prompt.large_airway_prompt import Large_Airway_Disease_Classifier
+from ..prompt.mediastinum_prompt import Mediastinum_Disease_Classifier
+from ..prompt.heart_and_vessel_prompt import Heart_and_Vessel_Disease_Classifier
+from ..prompt.abdomen_prompt import Abdomen_Disease_Classifier
+from ..prompt.osseous_structure_prompt import Osseous_Structure_Disease_Classifier
+from .fake_lm import FakeLM
+
+# Organ -> (classifier module, LLM calls per report)
+EXPECTED_CALLS = {
+    'lung': (Lung_Disease_Classifier, 12),
+    'large_airway': (Large_Airway_Disease_Classifier, 3),
+    'mediastinum': (Mediastinum_Disease_Classifier, 4),
+    'heart_and_vessel': (Heart_and_Vessel_Disease_Classifier, 10),
+    'abdomen': (Abdomen_Disease_Classifier, 6),
+    'osseous_structure': (Osseous_Structure_Disease_Classifier, 2),
+}
+
+REPORT = 'No significant abnormality.'
+
+
+def count_calls(classifier, lm):
+    lm.reset()
+    classifier()(report=REPORT)
+    return lm.calls
+
+
+def main():
+    lm = FakeLM()
+    dspy.configure(lm=lm)
+
+    failed = False
+    for organ, (classifier, expected) in EXPECTED_CALLS.items():
+        calls = count_calls(classifier, lm)
+        status = 'ok' if calls == expected else 'FAIL'
+        print(f"{organ:20s} {calls:3d} calls/report (expected {expected}) {status}")
+        failed |= calls != expected
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Local fake of the OpenAI Files + Batch API, for testing --batch-mode without network access.
+
+Serves the endpoints the openai client uses for batches (upload file, create / retrieve batch,
+download file content) and answers every chat completion request of a batch with the canned
+ChatAdapter output of FakeLM. A batch reports 'in_progress' for `polls` status checks before
+it completes.
+
+Usage: python -m metric.benchmark.fake_batch_server [--port 8765]
+       python -m metric --exp x --batch-mode --batch-base-url http://127.0.0.1:8765/v1 --batch-poll-interval 0.1
+"""
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .fake_lm import fake_content, fake_usage
+
+
+class FakeBatchAPI:
+    def __init__(self, value='0', polls=1):
+        self.value = value
+        self.polls = polls
+        self.files = {}
+        self.batches = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}-{next(self._ids)}"
+
+    def add_file(self, content, filename='batch.jsonl', purpose='batch'):
+        file_id = self.new_id('file')
+        self.files[file_id] = content
+        return {
+            'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+            'filename': filename, 'purpose': purpose, 'status': 'processed',
+        }
+
+    def answer(self, line):
+        request = json.loads(line)
+        messages = request['body']['messages']
+        content = fake_content(messages, self.value)
+        body = {
+            'id': self.new_id('chatcmpl'), 'object': 'chat.completion', 'created': int(time.time()),
+            'model': request['body']['model'],
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': fake_usage(messages, content),
+        }
+        return {'id': self.new_id('batch_req'), 'custom_id': request['custom_id'], 'response': {'status_code': 200, 'body': body}, 'error': None}
+
+    def create_batch(self, request):
+        lines = [line for line in self.files[request['input_file_id']].decode('utf-8').splitlines() if line.strip()]
+        output = ''.join(json.dumps(self.answer(line)) + '\n' for line in lines).encode('utf-8')
+        batch = {
+            'id': self.new_id('batch'), 'object': 'batch', 'endpoint': request['endpoint'],
+            'input_file_id': request['input_file_id'], 'completion_window': request['completion_window'],
+            'created_at': int(time.time()), 'status': 'in_progress', 'output_file_id': None,
+            'request_counts': {'total': len(lines), 'completed': 0, 'failed': 0},
+            '_output': output, '_polls': 0,
+        }
+        self.batches[batch['id']] = batch
+        return self.public(batch)
+
+    def retrieve_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        batch['_polls'] += 1
+        if batch['status'] == 'in_progress' and batch['_polls'] >= self.polls:
+            batch['status'] = 'completed'
+            batch['output_file_id'] = self.add_file(batch['_output'], filename='output.jsonl', purpose='batch_output')['id']
+            batch['request_counts']['completed'] = batch['request_counts']['total']
+        return self.public(batch)
+
+    @staticmethod
+    def public(batch):
+        return {k: v for k, v in batch.items() if not k.startswith('_')}
+
+
+def upload(headers, body):
+    """(content, filename) of the 'file' part of a multipart/form-data upload"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode('utf-8') + body
+    )
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == 'file':
+            return part.get_payload(decode=True), part.get_filename() or 'batch.jsonl'
+    raise ValueError('no file part in upload')
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path.endswith('/files'):
+                content, filename = upload(self.headers, body)
+                self.send_json(api.add_file(content, filename))
+            elif self.path.endswith('/batches'):
+                self.send_json(api.create_batch(json.loads(body)))
+            else:
+                self.send_json({'error': {'message': f'unknown path {self.path}'}}, status=404)
+
+        def do_GET(self):
+            parts = self.path.rstrip('/').split('/')
+            if parts[-2] == 'batches' and parts[-1] in api.batches:
+                self.send_json(api.retrieve_batch(parts[-1]))
+            elif parts[-1] == 'content' and parts[-2] in api.files:
+                data = api.files[parts[-2]]
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self.send_json({'error': {'message': f'unknown path {self.path}'}}, status=404)
+
+    return Handler
+
+
+def serve(port=8765, value='0', polls=1, background=False):
+    """Start the fake endpoint on 127.0.0.1:port; base URL for the openai client is http://127.0.0.1:port/v1"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(FakeBatchAPI(value=value, polls=polls)))
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    print(f"Fake batch API on http://127.0.0.1:{port}/v1")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--value', type=str, default='0', help='Answer of every typed (e.g. int) output field')
+    parser.add_argument('--polls', type=int, default=1, help='Status checks before a batch completes')
+    args = parser.parse_args()
+    serve(args.port, value=args.value, polls=args.polls)
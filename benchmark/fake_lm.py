@@ -0,0 +1,252 @@
+"""
+Offline stand-in for the OpenAI LM, for benchmarks and call-count checks.
+
+FakeLM answers every dspy ChatAdapter request without network access: text fields get a
+short placeholder and the other fields (int, ...) get `value`. Every call is counted.
+
+With signature_aware=True it reads the reports written by synthetic_reports instead: formatting
+returns the sentences of each section, classifiers find their keyword, locators / counters / onset
+find their location, count and onset phrases, so the conditional branches run as for real reports.
+Latency and injected 429 errors simulate the API.
+"""
+import collections
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+import dspy
+import httpx
+import litellm
+from litellm import ModelResponse
+
+from ..prompt.lung_prompt import LUNG_LOCATIONS
+from ..signature_names import SignatureNames
+from .synthetic_reports import FINDINGS, NORMAL_SENTENCES
+
+FIELD_PATTERN = re.compile(r"\[\[ ## (\w+) ## \]\]`?( \(must be formatted as a valid Python (\w+)\))?")
+
+
+def output_fields(messages):
+    """(name, type name or None) of the output fields requested by the last user message"""
+    content = messages[-1]['content']
+    content = content.split('Respond with the corresponding output fields')[-1]
+    return [(name, type_name or None) for name, _, type_name in FIELD_PATTERN.findall(content) if name != 'completed']
+
+
+# Untyped output fields that hold text; the other untyped fields (abnormality_presence, new, ...) are read as int
+TEXT_FIELDS = {'reasoning', 'lesion_sentence'}
+
+
+def fake_content(messages, value='0'):
+    """ChatAdapter-formatted answer to messages: a placeholder for text fields, value for the other fields"""
+    content = ''
+    for name, type_name in output_fields(messages):
+        answer = f'fake {name}' if type_name == 'str' or name in TEXT_FIELDS else value
+        content += f"[[ ## {name} ## ]]\n{answer}\n\n"
+    return content + "[[ ## completed ## ]]"
+
+
+INPUT_PATTERN = re.compile(r"\[\[ ## (\w+) ## \]\]\n(.*?)(?=\n\n\[\[ ## |\Z)", re.S)
+
+
+def input_fields(messages):
+    """{name: value} of the inputs in the last user message"""
+    content = messages[-1]['content'].split('Respond with the corresponding output fields')[0]
+    return {name: value.strip() for name, value in INPUT_PATTERN.findall(content)}
+
+
+# Formatting signature / Extract_AllSections field -> organ
+SECTIONS = {
+    'Extract_LungParenchyma': 'lung', 'lung_parenchyma': 'lung',
+    'Extract_Airways': 'large_airway', 'airways': 'large_airway',
+    'Extract_Mediastinum': 'mediastinum', 'mediastinum': 'mediastinum',
+    'Extract_HeartAndGreatVessels': 'heart_and_vessel', 'heart_and_great_vessels': 'heart_and_vessel',
+    'Extract_Abdomen': 'abdomen', 'abdomen': 'abdomen',
+    'Extract_OsseousStructures': 'osseous_structure', 'osseous_structures': 'osseous_structure',
+}
+# Keyword of every disease classifier
+CLASSIFIER_KEYWORDS = {classifier: keyword for findings in FINDINGS.values() for _, classifier, keyword, _, _ in findings}
+# Keyword -> organ, longest first so 'mediastinal mass' is not read as a lung 'mass'
+KEYWORD_ORGANS = sorted(((keyword, organ) for organ, findings in FINDINGS.items() for _, _, keyword, _, _ in findings), key=lambda item: -len(item[0]))
+NORMAL_ORGANS = {sentence: organ for organ, sentence in NORMAL_SENTENCES.items()}
+
+# Output field -> phrase that makes it 1; other fields use their name with spaces
+ORDINALS = {1: '1st', 2: '2nd', 3: '3rd'}
+FIELD_PHRASES = {
+    'left_main': 'left main bronchus', 'right_main': 'right main bronchus', 'main': 'main pulmonary trunk',
+    'new': 'acute', 'old_healed': 'healed', 'right_lung': 'right', 'left_lung': 'left',
+    'multiple': 'multiple', 'mass_count_multiple': 'multiple',
+}
+for side in ['right', 'left']:
+    for n in range(1, 13):
+        FIELD_PHRASES[f'{side}{n}'] = f'{side} {ORDINALS.get(n, f"{n}th")} rib'
+# 1 when a lesion is present but its multiple-counterpart is not
+SINGLE_FIELDS = {'single': 'multiple', 'mass_count_single': 'mass_count_multiple'}
+
+
+def split_sentences(text):
+    return [sentence.strip() + '.' for sentence in text.split('.') if sentence.strip()]
+
+
+def sentence_organ(sentence):
+    if sentence in NORMAL_ORGANS:
+        return NORMAL_ORGANS[sentence]
+    lowered = re.sub(r'^(multiple |acute |healed )+', '', sentence.lower())
+    for keyword, organ in KEYWORD_ORGANS:
+        if lowered.startswith(keyword):
+            return organ
+    return None
+
+
+def contains(text, phrase):
+    # Plural keywords count too ('Multiple nodules')
+    return re.search(rf'\b{re.escape(phrase.lower())}s?\b', text.lower()) is not None
+
+
+def rib_onset(sentences, location):
+    text = ' '.join(sentence for sentence in sentences if contains(sentence, location)) or ' '.join(sentences)
+    for onset in ['new', 'old_healed']:
+        if contains(text, FIELD_PHRASES[onset]):
+            return onset
+    return 'unspecified'
+
+
+def signature_answers(signature, inputs, fields):
+    """{field: answer} of a signature for a synthetic report"""
+    text = ' '.join(inputs.values())
+    sentences = split_sentences(inputs.get('report') or inputs.get('lesion_sentence') or inputs.get('sentence') or '')
+    # Locators and counters get the whole section plus the finding they are asked about
+    for key in ['abnormality_class', 'location']:
+        if inputs.get(key):
+            relevant = [sentence for sentence in sentences if contains(sentence, inputs[key].replace('_', ' '))]
+            sentences = relevant or sentences
+    text = ' '.join(sentences) or text
+
+    answers = {}
+    for name, type_name in fields:
+        if name == 'reasoning':
+            answers[name] = 'fake reasoning'
+        elif name in SECTIONS or name == 'sentences':
+            organ = SECTIONS.get(name, SECTIONS.get(signature))
+            # Like the formatting prompts ask for an organ without findings
+            findings = [sentence for sentence in sentences if sentence_organ(sentence) == organ and sentence not in NORMAL_ORGANS]
+            answers[name] = ' '.join(findings) or 'No relevant findings.'
+        elif name == 'lesion_sentence':
+            keyword = CLASSIFIER_KEYWORDS.get(signature, '')
+            answers[name] = ' '.join(sentence for sentence in sentences if keyword and contains(sentence, keyword))
+        elif name == 'abnormality_presence':
+            answers[name] = '1' if answers.get('lesion_sentence') else '0'
+        elif name == 'onsets':
+            # Batched rib onset: the onset phrase of the sentence naming each location
+            locations = json.loads(inputs.get('locations') or '[]')
+            answers[name] = json.dumps({location: rib_onset(sentences, location) for location in locations})
+        elif name == 'locations':
+            # Fused lung locator of all findings: the labels each finding gets on its own
+            located = {}
+            for finding in json.loads(inputs.get('findings') or '{}'):
+                flags = signature_answers(signature, {'report': inputs.get('report', ''), 'abnormality_class': finding},
+                                          [(field, 'int') for field in LUNG_LOCATIONS])
+                located[finding] = [field for field, value in flags.items() if value == '1']
+            answers[name] = json.dumps(located)
+        elif type_name == 'str':
+            answers[name] = f'fake {name}'
+        elif name in SINGLE_FIELDS:
+            answers[name] = '0' if contains(text, FIELD_PHRASES[SINGLE_FIELDS[name]]) else '1'
+        elif name != 'unspecified':
+            answers[name] = '1' if contains(text, FIELD_PHRASES.get(name, name.replace('_', ' '))) else '0'
+
+    if any(name == 'unspecified' for name, _ in fields):
+        # Nothing more specific was found
+        answers['unspecified'] = '0' if '1' in (value for key, value in answers.items() if key not in ['abnormality_presence']) else '1'
+    return answers
+
+
+def lognormal_latency(median, sigma=0.5, seed=0):
+    """Latency sampler: lognormal seconds around median (heavy right tail, like API latency)"""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    def sample():
+        with lock:
+            return rng.lognormvariate(0, sigma) * median
+    return sample
+
+
+def constant_latency(seconds):
+    return lambda: seconds
+
+
+def rate_limit_error(model):
+    response = httpx.Response(429, headers={'retry-after-ms': '10'}, request=httpx.Request('POST', 'http://fake-lm'))
+    return litellm.RateLimitError('Injected rate limit', llm_provider='openai', model=model, response=response)
+
+
+def fake_usage(messages, content):
+    prompt_tokens = sum(len(str(message['content'])) for message in messages) // 4
+    completion_tokens = len(content) // 4
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+
+
+class FakeLM(dspy.BaseLM):
+    """
+    Args:
+        value: Answer of the non-text fields when not signature_aware
+        signature_aware: Answer from the synthetic report text (see module docstring)
+        latency: Callable returning the seconds each call takes (e.g. lognormal_latency(0.5))
+        rate_limit_rate: Fraction of calls that raise a 429 RateLimitError
+    """
+    def __init__(self, value='0', signature_aware=False, latency=None, rate_limit_rate=0.0, seed=0):
+        super().__init__(model='fake/fake-lm', cache=False)
+        self.value = value
+        self.signature_aware = signature_aware
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.calls = 0
+        self.rate_limited = 0
+        self.calls_by_signature = collections.Counter()
+        self._signature_names = SignatureNames()
+        self._signatures = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.rate_limited = 0
+            self.calls_by_signature.clear()
+
+    def signature(self, messages):
+        """Name of the signature that rendered messages, found by its instructions in the system message"""
+        system = messages[0]['content'] if messages[0]['role'] == 'system' else ''
+        key = hashlib.sha1(system.encode('utf-8')).hexdigest()
+        if key not in self._signatures:
+            text = ' '.join(system.split())
+            self._signatures[key] = self._signature_names.find(text)
+        return self._signatures[key]
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{'role': 'user', 'content': prompt}]
+        signature = self.signature(messages) if self.signature_aware else None
+        with self._lock:
+            self.calls += 1
+            self.calls_by_signature[signature] += 1
+            rate_limited = self._rng.random() < self.rate_limit_rate
+            self.rate_limited += rate_limited
+
+        if self.latency is not None:
+            time.sleep(self.latency())
+        if rate_limited:
+            raise rate_limit_error(self.model)
+
+        if self.signature_aware:
+            answers = signature_answers(signature, input_fields(messages), output_fields(messages))
+            content = ''.join(f"[[ ## {name} ## ]]\n{answer}\n\n" for name, answer in answers.items()) + "[[ ## completed ## ]]"
+        else:
+            content = fake_content(messages, self.value)
+        return ModelResponse(
+            model=self.model,
+            choices=[{'message': {'role': 'assistant', 'content': content}}],
+            usage=fake_usage(messages, content),
+        )
@@ -0,0 +1,111 @@
+"""
+Microbenchmark of organ CSV assembly cost.
+
+Compares the old per-cell `result_df.loc[result_df['id']==id, col] = 1` writes with
+per-row dicts and the shared LabelBuilder on synthetic rows shaped like osseous_structure.csv.
+
+Usage: python -m metric.benchmark.label_assembly [--sizes 10000,100000,1000000]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from ..create_csv.label_builder import LabelBuilder
+
+
+def synthetic_positives(n_rows, n_labels, positives_per_row, seed=0):
+    """Random (row, label) positions, about positives_per_row per report"""
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(positives_per_row, size=n_rows)
+    return [rng.choice(n_labels, size=min(count, n_labels), replace=False) for count in counts]
+
+
+def assemble_loc(columns, positives):
+    # Old create_csv code path: preallocate, then one boolean-mask scan per positive label
+    result_df = pd.DataFrame(columns=columns)
+    result_df['id'] = range(len(positives))
+    result_df['report'] = ''
+    for col in columns[2:]:
+        result_df[col] = 0
+    for id, label_positions in enumerate(positives):
+        for i in label_positions:
+            result_df.loc[result_df['id']==id, columns[2 + i]] = 1
+    return result_df
+
+
+def assemble_dicts(columns, positives):
+    rows = []
+    for id, label_positions in enumerate(positives):
+        labels = dict.fromkeys(columns, 0)
+        labels['id'] = id
+        labels['report'] = ''
+        for i in label_positions:
+            labels[columns[2 + i]] = 1
+        rows.append(labels)
+    return pd.DataFrame(rows, columns=columns)
+
+
+def assemble_builder(columns, positives):
+    builder = LabelBuilder(columns)
+    for id, label_positions in enumerate(positives):
+        labels = builder.add_row(id, '')
+        for i in label_positions:
+            labels[columns[2 + i]] = 1
+    return builder.to_frame()
+
+
+STRATEGIES = {
+    'loc': assemble_loc,
+    'dicts': assemble_dicts,
+    'label_builder': assemble_builder,
+}
+
+# Largest size each strategy is run on: .loc is quadratic, per-row dicts need ~5 GB at 1M rows
+MAX_ROWS = {
+    'loc': 10000,
+    'dicts': 100000,
+}
+
+
+def run(sizes, n_labels=120, positives_per_row=3):
+    columns = ['id', 'report'] + [f'label_{i}' for i in range(n_labels)]
+    results = []
+    for n_rows in sizes:
+        positives = synthetic_positives(n_rows, n_labels, positives_per_row)
+        for name, assemble in STRATEGIES.items():
+            if n_rows > MAX_ROWS.get(name, n_rows):
+                continue
+            start = time.perf_counter()
+            assemble(columns, positives)
+            seconds = time.perf_counter() - start
+            results.append({
+                'strategy': name,
+                'rows': n_rows,
+                'seconds': seconds,
+                'us_per_row': seconds / n_rows * 1e6,
+            })
+            print(f"{name:>14} {n_rows:>9} rows: {seconds:8.2f} s ({seconds / n_rows * 1e6:8.1f} us/row)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=str, default='10000,100000,1000000', help='Comma separated row counts')
+    parser.add_argument('--labels', type=int, default=120, help='Number of label columns')
+    parser.add_argument('--positives', type=float, default=3, help='Mean positive labels per row')
+    parser.add_argument('--output', type=str, default=None, help='Optional JSON file for the results')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.labels, args.positives)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+End-to-end offline benchmark: formatting, the six organ builders and evaluation on synthetic reports,
+with FakeLM(signature_aware=True) behind the same wrapper chain as a real run (gate, rate control, retries).
+
+Per size it records throughput, calls per report per organ, DataFrame assembly time and evaluation time,
+and writes them as JSON so runs can be compared for regressions.
+
+Usage: python -m metric.benchmark.run [--sizes 1000,10000,100000] [--latency 0.05] [--rate-limit-rate 0.01] --output bench.json
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import tempfile
+import time
+
+import dspy
+import pandas as pd
+
+from ..create_csv.label_builder import LabelBuilder
+from ..f1_calculator import calculate_organ_f1
+from ..formatting.formatting_report import format_csv
+from ..journal import Journal
+from ..llm_client import create_lm
+from ..main import ORGAN_CSV
+from ..prompt.parallel import configure_executor
+from ..usage_ledger import UsageLedger
+from .fake_lm import FakeLM, lognormal_latency, constant_latency
+from .synthetic_reports import write as write_synthetic
+
+
+def assembly_seconds(output_dir):
+    """Time to rebuild every organ DataFrame from its journal and write the CSV (the builders' final step)"""
+    start = time.perf_counter()
+    for organ in ORGAN_CSV:
+        columns = list(pd.read_csv(f"{output_dir}/{organ}.csv", nrows=0).columns)
+        builder = LabelBuilder(columns)
+        for record in Journal(f"{output_dir}/{organ}.jsonl").load().values():
+            builder.add_record(record)
+        builder.to_frame().to_csv(f"{output_dir}/{organ}_assembly.csv", index=False)
+    return time.perf_counter() - start
+
+
+def run_size(n_reports, work_dir, args):
+    input_path, gt_dir = write_synthetic(work_dir, n_reports, rate=args.positive_rate, seed=args.seed)
+    report_df = pd.read_csv(input_path)
+    output_dir = os.path.join(work_dir, 'output')
+    os.makedirs(output_dir, exist_ok=True)
+
+    latency = lognormal_latency(args.latency, args.latency_sigma, args.seed) if args.latency_sigma > 0 else constant_latency(args.latency)
+    backend = FakeLM(signature_aware=True, latency=latency, rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    ledger = UsageLedger(os.path.join(output_dir, 'usage.jsonl'))
+    lm = create_lm(max_inflight=args.max_inflight, initial_inflight=args.max_inflight, adaptive=False, ledger=ledger, backend=backend)
+    dspy.configure(lm=lm, disable_history=True)
+    configure_executor(args.max_inflight)
+
+    start = time.perf_counter()
+    format_df = format_csv(os.path.join(work_dir, 'format.csv'), report_df, max_workers=args.max_inflight, lm=lm)
+    format_seconds = time.perf_counter() - start
+
+    organ_start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ORGAN_CSV)) as executor:
+        futures = [executor.submit(func, f"{output_dir}/{organ}.csv", format_df, False, args.csv_workers) for organ, func in ORGAN_CSV.items()]
+        for future in futures:
+            future.result()
+    organ_seconds = time.perf_counter() - organ_start
+    total_seconds = time.perf_counter() - start
+
+    assembly = assembly_seconds(output_dir)
+
+    start = time.perf_counter()
+    metrics = calculate_organ_f1(output_dir, gt_dir, os.path.join(output_dir, 'metrics.json'))
+    eval_seconds = time.perf_counter() - start
+
+    ledger.close()
+    usage = ledger.summary()
+    calls_per_report = {'format': usage['by_stage'].get('format', {}).get('calls', 0) / n_reports}
+    for organ, totals in usage['by_organ'].items():
+        if organ != 'None':
+            calls_per_report[organ] = totals['calls'] / n_reports
+    return {
+        'reports': n_reports,
+        'seconds': total_seconds,
+        'reports_per_second': n_reports / total_seconds,
+        'format_seconds': format_seconds,
+        'organ_seconds': organ_seconds,
+        'assembly_seconds': assembly,
+        'eval_seconds': eval_seconds,
+        'calls': usage['total']['calls'],
+        'calls_per_report': calls_per_report,
+        'rate_limited': backend.rate_limited,
+        'f1': (metrics or {}).get('Total', {}).get('f1_score'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=str, default='1000,10000,100000', help='Comma separated report counts')
+    parser.add_argument('--latency', type=float, default=0.0, help='Median seconds per fake LLM call')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, dest='latency_sigma', help='Lognormal sigma of the latency (0 for constant)')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, dest='rate_limit_rate', help='Fraction of calls answered with a 429')
+    parser.add_argument('--positive-rate', type=float, default=0.1, dest='positive_rate', help='Positive rate of every synthetic finding')
+    parser.add_argument('--max_inflight', type=int, default=32, help='Concurrent LLM calls')
+    parser.add_argument('--csv_workers', type=int, default=6, help='Reports processed concurrently per organ')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of reports, latency and 429s')
+    parser.add_argument('--work-dir', type=str, default=None, dest='work_dir', help='Directory for the synthetic data and outputs (default: a temporary directory)')
+    parser.add_argument('--output', type=str, default=None, help='JSON file for the results')
+    args = parser.parse_args()
+
+    results = []
+    for n_reports in [int(size) for size in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+            result = run_size(n_reports, work_dir, args)
+        results.append(result)
+        print(f"{n_reports:>7} reports: {result['seconds']:8.1f} s ({result['reports_per_second']:.1f} reports/s), "
+              f"{result['calls']} calls, assembly {result['assembly_seconds']:.2f} s, evaluation {result['eval_seconds']:.2f} s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Synthetic chest CT reports with known findings, for offline benchmarks.
+
+Every finding is written as one sentence built from fixed phrases (keyword, location, count, onset),
+so FakeLM(signature_aware=True) can answer the classifier / locator / counter / onset signatures from
+the text alone and drive the same branches as real positive reports. The ground-truth CSVs match
+the layout of result/ground_truth/template.
+
+Usage: python -m metric.benchmark.synthetic_reports --reports 1000 --output /tmp/synthetic [--rate 0.1]
+"""
+import argparse
+import os
+import random
+
+import pandas as pd
+
+LUNG_LOBES = [('right upper lobe', ['rul']), ('right middle lobe', ['rml']), ('right lower lobe', ['rll']),
+              ('left upper lobe', ['lul']), ('left lower lobe', ['lll'])]
+LUNG_DISEASES = [
+    ('Nodule', 'Disease_Classifier_Nodule'),
+    ('Mass', 'Disease_Classifier_Mass'),
+    ('Pleural Effusion', 'Disease_Classifier_Pleural_Effusion'),
+    ('Consolidation', 'Disease_Classifier_Consolidation'),
+    ('Atelectasis', 'Disease_Classifier_Atelectasis'),
+    ('Pneumothorax', 'Disease_Classifier_Pneumothorax'),
+    ('Ground Glass Opacity', 'Disease_Classifier_Ground_Glass_Opacity'),
+    ('Emphysema', 'Disease_Classifier_Emphysema'),
+    ('Mosaic Attenuation', 'Disease_Classifier_Mosaic_Attenuation'),
+    ('Bronchiectasis', 'Disease_Classifier_Bronchiectasis'),
+    ('Interlobular Septal Thickening', 'Disease_Classifier_InterlobularSeptalThickening'),
+]
+RIBS = [(f'{side} {n}{"st" if n == 1 else "nd" if n == 2 else "rd" if n == 3 else "th"} rib', f'{side}_{n}')
+        for side in ['right', 'left'] for n in range(1, 13)]
+VERTEBRAE = ['C7'] + [f'T{n}' for n in range(1, 13)] + ['L1', 'L2', 'L3']
+
+# organ -> [(label, classifier signature, keyword, [(location phrase, [ground-truth column suffixes])], counted)]
+FINDINGS = {
+    'lung': [(label, classifier, label.lower(), LUNG_LOBES, label in ['Nodule', 'Mass']) for label, classifier in LUNG_DISEASES],
+    'large_airway': [
+        ('Tracheal_Stenosis', 'Disease_Classifier_Tracheal_Stenosis', 'tracheal stenosis', [], False),
+        ('Endotracheal_Mass', 'Disease_Classifier_Endotracheal_Mass', 'endotracheal mass', [], True),
+        ('Endobronchial_Mass', 'Disease_Classifier_Endobronchial_Mass', 'endobronchial mass',
+         [('left main bronchus', ['left']), ('right main bronchus', ['right'])], True),
+    ],
+    'mediastinum': [
+        ('Mediastinal_Mass', 'Disease_Classifier_Mediastinal_Mass', 'mediastinal mass',
+         [('anterior mediastinum', ['anterior']), ('middle mediastinum', ['middle']), ('posterior mediastinum', ['posterior'])], False),
+        ('Lymphadenopathy', 'Disease_Classifier_Lymphadenopathy', 'lymphadenopathy',
+         [('subcarinal region', ['subcarinal']), ('hilar region', ['hilar']), ('prevascular region', ['prevascular']), ('upper paratracheal region', ['upper_paratracheal'])], False),
+        ('Esophageal_Mass', 'Disease_Classifier_Esophageal_Mass', 'esophageal mass', [], True),
+        ('Pneumomediastinum', 'Disease_Classifier_Pneumomediastinum', 'pneumomediastinum', [], False),
+    ],
+    'heart_and_vessel': [
+        ('Aortic_Aneurysm', 'Disease_Classifier_Aortic_Aneurysm', 'aortic aneurysm', [], False),
+        ('Aortic_Dilatation', 'Disease_Classifier_Aortic_Dilatation', 'aortic dilatation', [], False),
+        ('Aortic_Dissection', 'Disease_Classifier_Aortic_Dissection', 'aortic dissection', [], False),
+        ('Pulmonary_Artery_Enlargement', 'Disease_Classifier_Pulmonary_Artery_Enlargement', 'pulmonary artery enlargement', [], False),
+        ('Pulmonary_Embolism', 'Disease_Classifier_Pulmonary_Embolism', 'pulmonary embolism',
+         [('right pulmonary artery', ['right']), ('left pulmonary artery', ['left']), ('main pulmonary trunk', ['main'])], False),
+        ('Cardiomegaly', 'Disease_Classifier_Cardiomegaly', 'cardiomegaly', [], False),
+        ('Pericardial_Effusion', 'Disease_Classifier_Pericardial_Effusion', 'pericardial effusion', [], False),
+        ('Cardiac_Mass', 'Disease_Classifier_Cardiac_Mass', 'cardiac mass', [], False),
+        ('Coronary_Artery_Wall_Calcification', 'Disease_Classifier_Coronary_Artery_Wall_Calcification', 'coronary artery wall calcification', [], False),
+        ('Arterial_Calcification', 'Disease_Classifier_Arterial_Calcification', 'arterial calcification', [], False),
+    ],
+    'abdomen': [
+        ('Kidney_Cyst', 'Disease_Classifier_KidneyCyst', 'kidney cyst', [('right kidney', ['right']), ('left kidney', ['left'])], True),
+        ('Adrenal_Mass', 'Disease_Classifier_AdrenalMass', 'adrenal mass', [('right adrenal gland', ['right']), ('left adrenal gland', ['left'])], False),
+        ('Liver_Cyst', 'Disease_Classifier_LiverCyst', 'liver cyst', [], True),
+        ('Gallstone', 'Disease_Classifier_Gallstone', 'gallstone', [], False),
+        ('Hiatal_Hernia', 'Disease_Classifier_HiatalHernia', 'hiatal hernia', [], False),
+        ('Pneumoperitoneum', 'Disease_Classifier_Pneumoperitoneum', 'pneumoperitoneum', [], False),
+    ],
+    'osseous_structure': [
+        ('Rib_Fracture', 'Disease_Classifier_Rib_Fracture', 'rib fracture', [(phrase, [f'{rib}_presence']) for phrase, rib in RIBS], False),
+        ('Vertebrae_Fracture', 'Disease_Classifier_Vertebrae_Fracture', 'vertebral fracture', [(vertebra, [vertebra]) for vertebra in VERTEBRAE], False),
+    ],
+}
+
+# Sentence of an organ without findings
+NORMAL_SENTENCES = {
+    'lung': 'The lung parenchyma is clear.',
+    'large_airway': 'The central airways are patent.',
+    'mediastinum': 'The mediastinum is unremarkable.',
+    'heart_and_vessel': 'Heart size is normal.',
+    'abdomen': 'The visualized upper abdomen is unremarkable.',
+    'osseous_structure': 'No acute osseous abnormality.',
+}
+
+# The template capitalizes these, the mediastinum builder writes them in lower case
+COLUMN_RENAMES = {
+    'Lymphadenopathy_Upper_paratracheal': 'Lymphadenopathy_upper_paratracheal',
+    'Lymphadenopathy_Lower_paratracheal': 'Lymphadenopathy_lower_paratracheal',
+}
+
+# Rib fracture onset phrase -> ground-truth suffix
+ONSETS = [('acute', 'new'), ('healed', 'old_healed'), ('', 'unspecified')]
+
+
+def finding_sentence(keyword, location, multiple, onset):
+    sentence = f"{'Multiple ' if multiple else ''}{onset + ' ' if onset else ''}{keyword}{'s' if multiple else ''}"
+    sentence = sentence[0].upper() + sentence[1:]
+    return f"{sentence} in the {location}." if location else f"{sentence}."
+
+
+def generate(n_reports, rate=0.1, rates=None, multiple_rate=0.3, seed=0, template_dir=None):
+    """
+    Return (report_df with id/report, {organ: ground-truth DataFrame}).
+
+    rate is the positive rate of every finding, rates overrides it per label (e.g. {'Rib_Fracture': 0.3}).
+    """
+    rng = random.Random(seed)
+    rates = rates or {}
+    template_dir = template_dir or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'result', 'ground_truth', 'template')
+    columns = {}
+    for organ in FINDINGS:
+        template = pd.read_csv(os.path.join(template_dir, f'{organ}_gt_template.csv'), nrows=0)
+        columns[organ] = [COLUMN_RENAMES.get(column, column) for column in template.columns]
+
+    reports = []
+    gt_rows = {organ: [] for organ in FINDINGS}
+    for id in range(n_reports):
+        report_sentences = []
+        for organ, findings in FINDINGS.items():
+            sentences = []
+            labels = {}
+            for label, _, keyword, locations, counted in findings:
+                if rng.random() >= rates.get(label, rate):
+                    continue
+                labels[f'{label}_presence'] = 1
+                location, suffixes = rng.choice(locations) if locations else ('', [])
+                for suffix in suffixes:
+                    labels[f'{label}_{suffix}'] = 1
+                multiple = counted and rng.random() < multiple_rate
+                if counted:
+                    labels[f"{label}_{'multiple' if multiple else 'single'}"] = 1
+                onset = ''
+                if label == 'Rib_Fracture':
+                    onset, onset_suffix = rng.choice(ONSETS)
+                    labels[f"{label}_{suffixes[0].replace('_presence', '')}_{onset_suffix}"] = 1
+                sentences.append(finding_sentence(keyword, location, multiple, onset))
+            report_sentences += sentences or [NORMAL_SENTENCES[organ]]
+            gt_rows[organ].append({'id': id, f'{organ}_report': ' '.join(sentences or [NORMAL_SENTENCES[organ]]), **labels})
+        reports.append({'id': id, 'report': ' '.join(report_sentences)})
+
+    gt = {}
+    for organ, rows in gt_rows.items():
+        gt[organ] = pd.DataFrame(rows, columns=columns[organ]).fillna(0)
+        label_columns = columns[organ][2:]
+        gt[organ][label_columns] = gt[organ][label_columns].astype(int)
+    return pd.DataFrame(reports), gt
+
+
+def write(output_dir, n_reports, **kwargs):
+    """Write input.csv and ground_truth/{organ}_gt.csv under output_dir, return their paths"""
+    report_df, gt = generate(n_reports, **kwargs)
+    gt_dir = os.path.join(output_dir, 'ground_truth')
+    os.makedirs(gt_dir, exist_ok=True)
+    input_path = os.path.join(output_dir, 'input.csv')
+    report_df.to_csv(input_path, index=False)
+    for organ, gt_df in gt.items():
+        gt_df.to_csv(os.path.join(gt_dir, f'{organ}_gt.csv'), index=False)
+    return input_path, gt_dir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reports', type=int, default=1000, help='Number of reports')
+    parser.add_argument('--output', type=str, required=True, help='Output directory')
+    parser.add_argument('--rate', type=float, default=0.1, help='Positive rate of every finding')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    input_path, gt_dir = write(args.output, args.reports, rate=args.rate, seed=args.seed)
+    print(f"Wrote {args.reports} reports to {input_path} and the ground truth to {gt_dir}")
+
+
+if __name__ == '__main__':
+    main()
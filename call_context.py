@@ -0,0 +1,32 @@
+import contextlib
+import contextvars
+
+# What the current LLM call belongs to: stage, organ, report_id and depth in the report's dependency chain.
+# Threads start with an empty context, so work submitted to a pool must be run in a copy (see run_classifiers).
+_call = contextvars.ContextVar('llm_call', default={})
+
+
+@contextlib.contextmanager
+def call_context(**fields):
+    """Attach fields to every LLM call made inside the block"""
+    token = _call.set({**_call.get(), **fields})
+    try:
+        yield
+    finally:
+        _call.reset(token)
+
+
+def current_call():
+    return _call.get()
+
+
+def current_stage():
+    """'format', 'organ' (organ builders only set the organ) or None"""
+    call = _call.get()
+    return call.get('stage', 'organ' if 'organ' in call else None)
+
+
+def advance_chain():
+    """Mark the following calls of the current report as one step deeper in its classifier -> locator -> counter chain"""
+    call = _call.get()
+    _call.set({**call, 'depth': call.get('depth', 0) + 1})
@@ -1,17 +1,21 @@
 import pandas as pd
 import dspy
 import os
-from tqdm import tqdm
 
+from ..pipeline import process_reports
+from ..journal import start_journal, open_dead_letter
+from .label_builder import LabelBuilder
+from ..negative_sections import skip_negative
+from ..rule_locator import rule_locator, parse_abdomen_sides
 from ..prompt.abdomen_prompt import *
 
-def abdomen_csv(save_path, report_df):
+def abdomen_csv(save_path, report_df, resume=False, workers=1):
     # Disease classifier
     abdomen_disease_classifier = Abdomen_Disease_Classifier()
 
     # Locator
-    kidney_locator = dspy.ChainOfThought(Locator_Kidney_RL)
-    adrenal_locator = dspy.ChainOfThought(Locator_adrenal_RL)
+    kidney_locator = rule_locator(dspy.ChainOfThought(Locator_Kidney_RL), parse_abdomen_sides)
+    adrenal_locator = rule_locator(dspy.ChainOfThought(Locator_adrenal_RL), parse_abdomen_sides)
 
     # Counter
     kidney_count = dspy.ChainOfThought(Counter_Kidneycyst)
@@ -30,19 +34,25 @@ def abdomen_csv(save_path, report_df):
         'Gallstone_presence', 'Hiatal_Hernia_presence', 'Pneumoperitoneum_presence'
     ]
 
-    result_df = pd.DataFrame(columns=columns)
-    result_df['id'] = report_df['id']
-    result_df['abdomen_report'] = report_df['abdomen_report']
-
-    # 모든 값을 0으로 초기화
-    for col in columns:
-        if col != 'id' and col != 'abdomen_report':  # id, report 열은 건너뛰기
-            result_df[col] = 0
+    # 완료된 report는 journal에 바로 기록 (resume 시 건너뛰기)
+    journal, done = start_journal(os.path.splitext(save_path)[0] + '.jsonl', resume)
+    dead_letter = open_dead_letter(journal, resume, done)
+    builder = LabelBuilder(columns)
+    for record in done.values():
+        builder.add_record(record)
     
     # Csv 생성      
-    for idx, row in tqdm(report_df.iterrows()):
+    # report 단위로 workers개씩 동시에 처리 (builder, journal은 thread-safe)
+    def process_row(row):
         id = row['id']
         report = row['abdomen_report']
+        
+        labels = builder.add_row(id, report)  # 모든 값을 0으로 초기화
+
+        # "No relevant findings." / 빈 section은 classifier 호출 없이 0으로 기록
+        if skip_negative('abdomen', report, abdomen_disease_classifier):
+            journal.append(labels.record())
+            return
 
         disease_classifier_result = abdomen_disease_classifier(report=report)
 
@@ -53,20 +63,20 @@ def abdomen_csv(save_path, report_df):
             counter_kidney_cyst_result = kidney_count(lesion_sentence=kidney_cyst_sentence)
             
             # Presence
-            result_df.loc[result_df['id']==id, "Kidney_Cyst_presence"] = 1
+            labels["Kidney_Cyst_presence"] = 1
             
             # Locator
             if int(locator_kidney_cyst_result.right) == 1:
-                result_df.loc[result_df['id']==id, 'Kidney_Cyst_right'] = 1
+                labels['Kidney_Cyst_right'] = 1
             if int(locator_kidney_cyst_result.left) == 1:
-                result_df.loc[result_df['id']==id, 'Kidney_Cyst_left'] = 1
+                labels['Kidney_Cyst_left'] = 1
             if int(locator_kidney_cyst_result.unspecified) == 1:
-                result_df.loc[result_df['id']==id, 'Kidney_Cyst_unspecified'] = 1
+                labels['Kidney_Cyst_unspecified'] = 1
             
             if int(counter_kidney_cyst_result.single) == 1:
-                result_df.loc[result_df['id']==id, 'Kidney_Cyst_single'] = 1
+                labels['Kidney_Cyst_single'] = 1
             if int(counter_kidney_cyst_result.multiple) == 1:
-                result_df.loc[result_df['id']==id, 'Kidney_Cyst_multiple'] = 1
+                labels['Kidney_Cyst_multiple'] = 1
             
         # Adrenal Mass
         if int(disease_classifier_result['adrenal_mass'].abnormality_presence) == 1:
@@ -74,15 +84,15 @@ def abdomen_csv(save_path, report_df):
             locator_adrenal_result = adrenal_locator(report=adrenal_mass_sentence, abnormality_class="adrenal_mass")
             
             # Presence
-            result_df.loc[result_df['id']==id, "Adrenal_Mass_presence"] = 1
+            labels["Adrenal_Mass_presence"] = 1
             
             # Locator
             if int(locator_adrenal_result.right) == 1:
-                result_df.loc[result_df['id']==id, 'Adrenal_Mass_right'] = 1
+                labels['Adrenal_Mass_right'] = 1
             if int(locator_adrenal_result.left) == 1:
-                result_df.loc[result_df['id']==id, 'Adrenal_Mass_left'] = 1
+                labels['Adrenal_Mass_left'] = 1
             if int(locator_adrenal_result.unspecified) == 1:
-                result_df.loc[result_df['id']==id, 'Adrenal_Mass_unspecified'] = 1
+                labels['Adrenal_Mass_unspecified'] = 1
         
         # Liver Cyst
         if int(disease_classifier_result['liver_cyst'].abnormality_presence) == 1:
@@ -90,22 +100,29 @@ def abdomen_csv(save_path, report_df):
             counter_liver_cyst_result = Liver_count(lesion_sentence=liver_cyst_sentence)
             
             # Presence
-            result_df.loc[result_df['id']==id, "Liver_Cyst_presence"] = 1
+            labels["Liver_Cyst_presence"] = 1
             
             if int(counter_liver_cyst_result.single) == 1:
-                result_df.loc[result_df['id']==id, 'Liver_Cyst_single'] = 1
+                labels['Liver_Cyst_single'] = 1
             if int(counter_liver_cyst_result.multiple) == 1:
-                result_df.loc[result_df['id']==id, 'Liver_Cyst_multiple'] = 1
+                labels['Liver_Cyst_multiple'] = 1
         
         # Gall stone
         if int(disease_classifier_result['gallstone'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Gallstone_presence"] = 1
+            labels["Gallstone_presence"] = 1
         # Hiatal Hernia
         if int(disease_classifier_result['hiatal_hernia'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Hiatal_Hernia_presence"] = 1
+            labels["Hiatal_Hernia_presence"] = 1
         # Pneumoperitoneum
         if int(disease_classifier_result['pneumoperitoneum'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Pneumoperitoneum_presence"] = 1
+            labels["Pneumoperitoneum_presence"] = 1
+        
+        journal.append(labels.record())
+
+    # 실패한 report는 dead letter로, batch 응답을 기다리는 report는 다음 round로 (빈 row를 CSV에 남기지 않음)
+    unfinished = process_reports(process_row, report_df, workers=workers, done=done, dead_letter=dead_letter, organ='abdomen')
+
+    result_df = builder.to_frame(exclude=unfinished)
     
     # Sort df
     result_df = result_df.sort_values(by='id')
@@ -1,12 +1,15 @@
 import pandas as pd
 import os
 import dspy
-from tqdm import tqdm
 
+from ..pipeline import process_reports
+from ..journal import start_journal, open_dead_letter
+from .label_builder import LabelBuilder
+from ..negative_sections import skip_negative
 from ..prompt.heart_and_vessel_prompt import *
 
 
-def heart_and_vessel_csv(save_path, report_df):
+def heart_and_vessel_csv(save_path, report_df, resume=False, workers=1):
     # Disease classifier
     heart_and_vessel_disease_classifier = Heart_and_Vessel_Disease_Classifier()
     
@@ -20,37 +23,43 @@ def heart_and_vessel_csv(save_path, report_df):
         'Cardiomegaly_presence', 'Pericardial_Effusion_presence', 'Cardiac_Mass_presence', 'Coronary_Artery_Wall_Calcification_presence', 'Arterial_Calcification_presence'
     ] #dilation -> dilatation
     
-    result_df = pd.DataFrame(columns=columns)
-    result_df['id'] = report_df['id']
-    result_df['heart_and_vessel_report'] = report_df['heart_and_vessel_report']
-    
-    # 모든 값을 0으로 초기화
-    for col in columns:
-        if col != 'id' and col != 'heart_and_vessel_report':  # id, report 열은 건너뛰기
-            result_df[col] = 0
+    # 완료된 report는 journal에 바로 기록 (resume 시 건너뛰기)
+    journal, done = start_journal(os.path.splitext(save_path)[0] + '.jsonl', resume)
+    dead_letter = open_dead_letter(journal, resume, done)
+    builder = LabelBuilder(columns)
+    for record in done.values():
+        builder.add_record(record)
             
     # Csv 생성
-    for idx, row in tqdm(report_df.iterrows()):
+    # report 단위로 workers개씩 동시에 처리 (builder, journal은 thread-safe)
+    def process_row(row):
         id = row['id']
         report = row['heart_and_vessel_report']
         
+        labels = builder.add_row(id, report)  # 모든 값을 0으로 초기화
+
+        # "No relevant findings." / 빈 section은 classifier 호출 없이 0으로 기록
+        if skip_negative('heart_and_vessel', report, heart_and_vessel_disease_classifier):
+            journal.append(labels.record())
+            return
+        
         disease_classifier_result = heart_and_vessel_disease_classifier(report=report)
         
         # Aortic Aneurysm
         if int(disease_classifier_result['Aortic_Aneurysm'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Aortic_Aneurysm_presence"] = 1
+            labels["Aortic_Aneurysm_presence"] = 1
         
         # Aortic Dilatation
         if int(disease_classifier_result['Aortic_Dilatation'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Aortic_Dilatation_presence"] = 1
+            labels["Aortic_Dilatation_presence"] = 1
         
         # Aortic Dissection
         if int(disease_classifier_result['Aortic_Dissection'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Aortic_Dissection_presence"] = 1
+            labels["Aortic_Dissection_presence"] = 1
         
         # Pulmonary Artery Enlargement
         if int(disease_classifier_result['Pulmonary_Artery_Enlargement'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Pulmonary_Artery_Enlargement_presence"] = 1
+            labels["Pulmonary_Artery_Enlargement_presence"] = 1
         
         # Pulmonary Embolism
         if int(disease_classifier_result['Pulmonary_Embolism'].abnormality_presence) == 1:
@@ -58,37 +67,44 @@ def heart_and_vessel_csv(save_path, report_df):
             pe_locator_result = pe_loctor(sentence=pulmonary_embolism_sentence, abnormality_class="Pulmonary_Embolism") #report -> sentence
             
             # Presence
-            result_df.loc[result_df['id']==id, "Pulmonary_Embolism_presence"] = 1
+            labels["Pulmonary_Embolism_presence"] = 1
             
             # Locator
             if int(pe_locator_result.right) == 1:
-                result_df.loc[result_df['id']==id, 'Pulmonary_Embolism_right'] = 1
+                labels['Pulmonary_Embolism_right'] = 1
             if int(pe_locator_result.left) == 1:
-                result_df.loc[result_df['id']==id, 'Pulmonary_Embolism_left'] = 1
+                labels['Pulmonary_Embolism_left'] = 1
             if int(pe_locator_result.main) == 1:
-                result_df.loc[result_df['id']==id, 'Pulmonary_Embolism_main'] = 1
+                labels['Pulmonary_Embolism_main'] = 1
             if int(pe_locator_result.unspecified) == 1:
-                result_df.loc[result_df['id']==id, 'Pulmonary_Embolism_unspecified'] = 1
+                labels['Pulmonary_Embolism_unspecified'] = 1
             
         # Cardiomegaly
         if int(disease_classifier_result['Cardiomegaly'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Cardiomegaly_presence"] = 1
+            labels["Cardiomegaly_presence"] = 1
         
         # Pericardial Effusion
         if int(disease_classifier_result['Pericardial_Effusion'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Pericardial_Effusion_presence"] = 1
+            labels["Pericardial_Effusion_presence"] = 1
         
         # Cardiac Mass
         if int(disease_classifier_result['Cardiac_Mass'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Cardiac_Mass_presence"] = 1
+            labels["Cardiac_Mass_presence"] = 1
         
         # Coronary Artery Wall Calcification
         if int(disease_classifier_result['Coronary_Artery_Wall_Calcification'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Coronary_Artery_Wall_Calcification_presence"] = 1
+            labels["Coronary_Artery_Wall_Calcification_presence"] = 1
         
         # Arterial Calcification
         if int(disease_classifier_result['Arterial_Calcification'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Arterial_Calcification_presence"] = 1
+            labels["Arterial_Calcification_presence"] = 1
+        
+        journal.append(labels.record())
+
+    # 실패한 report는 dead letter로, batch 응답을 기다리는 report는 다음 round로 (빈 row를 CSV에 남기지 않음)
+    unfinished = process_reports(process_row, report_df, workers=workers, done=done, dead_letter=dead_letter, organ='heart_and_vessel')
+
+    result_df = builder.to_frame(exclude=unfinished)
     
     # Sort df
     result_df = result_df.sort_values(by='id')
@@ -0,0 +1,85 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class RowLabels:
+    """Write access to one report's labels inside a LabelBuilder"""
+    def __init__(self, builder, position):
+        self._builder = builder
+        self.position = position
+
+    def __setitem__(self, column, value):
+        self._builder.set(self.position, column, value)
+
+    def __getitem__(self, column):
+        return self._builder.get(self.position, column)
+
+    def record(self):
+        """The row as a {column: value} dict (e.g. for the journal)"""
+        return self._builder.record(self.position)
+
+
+class LabelBuilder:
+    """
+    Accumulates the label rows of one organ CSV and builds the DataFrame once at the end.
+
+    columns follows the organ CSV layout: 'id', the report column, then the 0/1 label columns.
+    Labels live in a uint8 matrix indexed by row position (doubled when full), so setting a
+    label is O(1) instead of a boolean-mask scan over the whole DataFrame.
+    """
+    def __init__(self, columns, capacity=1024):
+        self.columns = list(columns)
+        self.label_columns = self.columns[2:]
+        self._column_index = {column: i for i, column in enumerate(self.label_columns)}
+
+        self._ids = []
+        self._reports = []
+        self._labels = np.zeros((max(capacity, 1), len(self.label_columns)), dtype=np.uint8)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add_row(self, id, report):
+        """Append an all-zero row and return its RowLabels"""
+        with self._lock:
+            position = len(self._ids)
+            if position == self._labels.shape[0]:
+                grown = np.zeros((self._labels.shape[0] * 2, self._labels.shape[1]), dtype=np.uint8)
+                grown[:position] = self._labels
+                self._labels = grown
+            self._ids.append(id)
+            self._reports.append(report)
+        return RowLabels(self, position)
+
+    def add_record(self, record):
+        """Append a row given as a {column: value} dict (e.g. loaded from the journal)"""
+        labels = self.add_row(record['id'], record[self.columns[1]])
+        for column in self.label_columns:
+            if record.get(column):
+                labels[column] = record[column]
+        return labels
+
+    def set(self, position, column, value=1):
+        with self._lock:
+            self._labels[position, self._column_index[column]] = value
+
+    def get(self, position, column):
+        return int(self._labels[position, self._column_index[column]])
+
+    def record(self, position):
+        record = {self.columns[0]: self._ids[position], self.columns[1]: self._reports[position]}
+        record.update(zip(self.label_columns, self._labels[position].tolist()))
+        return record
+
+    def to_frame(self, exclude=()):
+        """DataFrame of all rows, without the rows whose id is in exclude (e.g. failed reports)"""
+        n_rows = len(self._ids)
+        result_df = pd.DataFrame(self._labels[:n_rows], columns=self.label_columns)
+        result_df.insert(0, self.columns[1], self._reports)
+        result_df.insert(0, self.columns[0], self._ids)
+        if exclude:
+            result_df = result_df[~result_df[self.columns[0]].isin(list(exclude))]
+        return result_df
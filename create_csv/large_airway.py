@@ -2,16 +2,20 @@ import pandas as pd
 import dspy
 import os
 import random
-from tqdm import tqdm
 
+from ..pipeline import process_reports
+from ..journal import start_journal, open_dead_letter
+from .label_builder import LabelBuilder
+from ..negative_sections import skip_negative
+from ..rule_locator import rule_locator, parse_endobronchial
 from ..prompt.large_airway_prompt import *
 
-def large_airway_csv(save_path, report_df):
+def large_airway_csv(save_path, report_df, resume=False, workers=1):
     # Disease classifier
     large_airway_disease_classifier = Large_Airway_Disease_Classifier()
     
     # Locator
-    locator_endobronchial_mass = dspy.ChainOfThought(Locator_Endobronchial_Mass)
+    locator_endobronchial_mass = rule_locator(dspy.ChainOfThought(Locator_Endobronchial_Mass), parse_endobronchial)
     
     columns = [
         'id', 'large_airway_report',
@@ -21,52 +25,65 @@ def large_airway_csv(save_path, report_df):
         'Endobronchial_Mass_single', 'Endobronchial_Mass_multiple'
     ]
     
-    result_df = pd.DataFrame(columns=columns)
-    result_df['id'] = report_df['id']
-    result_df['large_airway_report'] = report_df['large_airway_report']
+    # 완료된 report는 journal에 바로 기록 (resume 시 건너뛰기)
+    journal, done = start_journal(os.path.splitext(save_path)[0] + '.jsonl', resume)
+    dead_letter = open_dead_letter(journal, resume, done)
+    builder = LabelBuilder(columns)
+    for record in done.values():
+        builder.add_record(record)
     
-    # 모든 값을 0으로 초기화
-    for col in columns:
-        if col != 'id' and col != 'large_airway_report':  # id, report 열은 건너뛰기
-            result_df[col] = 0
-    
-    for idx, row in tqdm(report_df.iterrows()):
+    # report 단위로 workers개씩 동시에 처리 (builder, journal은 thread-safe)
+    def process_row(row):
         id = row['id']
         report = row['large_airway_report']
         
+        labels = builder.add_row(id, report)  # 모든 값을 0으로 초기화
+
+        # "No relevant findings." / 빈 section은 classifier 호출 없이 0으로 기록
+        if skip_negative('large_airway', report, large_airway_disease_classifier):
+            journal.append(labels.record())
+            return
+        
         disease_classifier_result = large_airway_disease_classifier(report=report)
 
         # Tracheal Stenosis
         if int(disease_classifier_result['tracheal_stenosis'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Tracheal_Stenosis_presence"] = 1
+            labels["Tracheal_Stenosis_presence"] = 1
         
         # Endotracheal Mass
         if int(disease_classifier_result['endotracheal_mass'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Endotracheal_Mass_presence"] = 1
+            labels["Endotracheal_Mass_presence"] = 1
             
             if int(disease_classifier_result['endotracheal_mass'].mass_count_single) == 1:
-                result_df.loc[result_df['id']==id, "Endotracheal_Mass_single"] = 1
+                labels["Endotracheal_Mass_single"] = 1
             if int(disease_classifier_result['endotracheal_mass'].mass_count_multiple) == 1:
-                result_df.loc[result_df['id']==id, "Endotracheal_Mass_multiple"] = 1
+                labels["Endotracheal_Mass_multiple"] = 1
         
         # Endobronchial Mass
         if int(disease_classifier_result['endobronchial_mass'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, "Endobronchial_Mass_presence"] = 1
+            labels["Endobronchial_Mass_presence"] = 1
             endobronchial_mass_sentence = disease_classifier_result['endobronchial_mass'].lesion_sentence
             locator_endobronchial_result = locator_endobronchial_mass(lesion_sentence=endobronchial_mass_sentence, abnormality_class="Endobronchial_Mass")
             
             if int(locator_endobronchial_result.left_main) == 1:
-                result_df.loc[result_df['id']==id, 'Endobronchial_Mass_left'] = 1
+                labels['Endobronchial_Mass_left'] = 1
             if int(locator_endobronchial_result.right_main) == 1:
-                result_df.loc[result_df['id']==id, 'Endobronchial_Mass_right'] = 1
+                labels['Endobronchial_Mass_right'] = 1
             if int(locator_endobronchial_result.unspecified) == 1:
-                result_df.loc[result_df['id']==id, 'Endobronchial_Mass_unspecified'] = 1
+                labels['Endobronchial_Mass_unspecified'] = 1
 
             if int(disease_classifier_result['endobronchial_mass'].mass_count_single) == 1:
-                result_df.loc[result_df['id']==id, "Endobronchial_Mass_single"] = 1
+                labels["Endobronchial_Mass_single"] = 1
             if int(disease_classifier_result['endobronchial_mass'].mass_count_multiple) == 1:
-                result_df.loc[result_df['id']==id, "Endobronchial_Mass_multiple"] = 1
+                labels["Endobronchial_Mass_multiple"] = 1
+        
+        journal.append(labels.record())
+
+    # 실패한 report는 dead letter로, batch 응답을 기다리는 report는 다음 round로 (빈 row를 CSV에 남기지 않음)
+    unfinished = process_reports(process_row, report_df, workers=workers, done=done, dead_letter=dead_letter, organ='large_airway')
 
+    result_df = builder.to_frame(exclude=unfinished)
+    
     # Sort df
     result_df = result_df.sort_values(by='id')
     
@@ -1,23 +1,144 @@
 import os
 import pandas as pd
-from tqdm import tqdm
 import dspy
 from glob import glob
 
+from ..pipeline import process_reports
+from ..llm_batch import BatchPending
+from ..journal import start_journal, open_dead_letter
+from .label_builder import LabelBuilder
+from ..negative_sections import skip_negative
+from ..rule_locator import rule_locator, parse_lung_sides, parse_left_lobes, parse_right_lobes
 from ..prompt.lung_prompt import *
         
 
-def lung_csv(save_path, report_df):
+LUNG_LOCATOR_MODES = ['chain', 'fused', 'fused_all']
+_locator_mode = 'chain'
+
+# Locator_Lung_Finding lobe field -> label suffix
+FUSED_LOBES = {
+    'left_upper_lobe': 'lul', 'left_lower_lobe': 'lll', 'left_unspecified': 'left_unspecified',
+    'right_upper_lobe': 'rul', 'right_middle_lobe': 'rml', 'right_lower_lobe': 'rll', 'right_unspecified': 'right_unspecified',
+}
+
+
+def configure_lung_locator(mode='chain'):
+    """chain: Locator_RL -> lobe locators -> Counter per disease, fused: one call per disease, fused_all: one call per report"""
+    global _locator_mode
+    if mode not in LUNG_LOCATOR_MODES:
+        raise ValueError(f"Unknown lung locator mode: {mode}")
+    _locator_mode = mode
+
+
+def fused_suffixes(flags, disease_name):
+    """Label suffixes from fused {field: 0/1}; like the chain, lobes only count for a lung marked as affected"""
+    suffixes = []
+    for field, suffix in FUSED_LOBES.items():
+        side = 'left_lung' if field.startswith('left') else 'right_lung'
+        if flags.get(side) == 1 and flags.get(field) == 1:
+            suffixes.append(suffix)
+    if flags.get('unspecified') == 1:
+        suffixes.append('unspecified')
+    if disease_name in ['Nodule', 'Mass']:
+        suffixes += [count for count in ['single', 'multiple'] if flags.get(count) == 1]
+    return suffixes
+
+
+def lung_csv(save_path, report_df, resume=False, workers=1):
     # Disease classifier
     lung_disease_classifier = Lung_Disease_Classifier()
 
     # Locator
-    rl_locator = dspy.ChainOfThought(Locator_RL)
-    left_lobe_locator = dspy.ChainOfThought(Locator_Left_Lobes)
-    right_lobe_locator = dspy.ChainOfThought(Locator_Right_Lobes)
+    rl_locator = rule_locator(dspy.ChainOfThought(Locator_RL), parse_lung_sides)
+    left_lobe_locator = rule_locator(dspy.ChainOfThought(Locator_Left_Lobes), parse_left_lobes)
+    right_lobe_locator = rule_locator(dspy.ChainOfThought(Locator_Right_Lobes), parse_right_lobes)
 
     # Counter
     counter = dspy.ChainOfThought(Counter)
+
+    # Side + lobe + count in one call (--lung_locator fused / fused_all)
+    finding_locator = dspy.ChainOfThought(Locator_Lung_Finding)
+    findings_locator = dspy.ChainOfThought(Locator_Lung_Findings)
+
+    def chain_locate(report, disease_name, disease_lesion_sentence):
+        """Label suffixes of one disease from Locator_RL -> Locator_Left/Right_Lobes -> Counter"""
+        suffixes = []
+        rl_result = rl_locator(report=report, abnormality_class=disease_name)
+        
+        if int(rl_result.left)==1:
+            left_lobe_locator_result = left_lobe_locator(sentence=disease_lesion_sentence, abnormality_class=disease_name)
+            
+            if int(left_lobe_locator_result.left_upper_lobe)==1:
+                suffixes.append('lul')
+                
+            if int(left_lobe_locator_result.left_lower_lobe)==1:
+                suffixes.append('lll')
+            
+            if int(left_lobe_locator_result.unspecified)==1:
+                suffixes.append('left_unspecified')
+                
+        if int(rl_result.right)==1:
+            right_lobe_locator_result = right_lobe_locator(sentence=disease_lesion_sentence, abnormality_class=disease_name)
+            
+            if int(right_lobe_locator_result.right_upper_lobe)==1:
+                suffixes.append('rul')
+                
+            if int(right_lobe_locator_result.right_middle_lobe)==1:
+                suffixes.append('rml')
+
+            if int(right_lobe_locator_result.right_lower_lobe)==1:
+                suffixes.append('rll')
+
+            if int(right_lobe_locator_result.unspecified)==1:
+                suffixes.append('right_unspecified')
+            
+        if int(rl_result.unspecified)==1:
+            suffixes.append('unspecified')
+        
+        if disease_name in ['Nodule', 'Mass']:
+            # Count 추가하기
+            counter_result = counter(report=report, abnormality_class=disease_name)
+            
+            if int(counter_result.single)==1:
+                suffixes.append('single')
+            
+            if int(counter_result.multiple)==1:
+                suffixes.append('multiple')
+        return suffixes
+
+    def fused_locate(report, disease_name, disease_lesion_sentence):
+        """Label suffixes of one disease from one Locator_Lung_Finding call (the chain if it fails)"""
+        try:
+            result = finding_locator(report=report, lesion_sentence=disease_lesion_sentence, abnormality_class=disease_name)
+            return fused_suffixes({field: int(getattr(result, field)) for field in LUNG_LOCATIONS}, disease_name)
+        except BatchPending:
+            raise
+        except Exception as e:
+            print(f"Fused lung locator failed for {disease_name}: {e}. Falling back to the locator chain.")
+            return chain_locate(report, disease_name, disease_lesion_sentence)
+
+    def locate(report, positives):
+        """{disease: label suffixes} of the positive diseases with the configured locator"""
+        if _locator_mode == 'chain':
+            return {name: chain_locate(report, name, sentence) for name, sentence in positives.items()}
+        
+        located = {}
+        if _locator_mode == 'fused_all' and len(positives) > 1:
+            # 모든 positive disease를 한 번에, 빠진 disease는 disease별로
+            try:
+                answer = findings_locator(report=report, findings=positives).locations
+            except BatchPending:
+                raise
+            except Exception as e:
+                print(f"Fused lung locator failed for all findings: {e}. Locating per finding.")
+                answer = {}
+            for name in positives:
+                if isinstance(answer.get(name), list):
+                    located[name] = fused_suffixes({label: 1 for label in answer[name]}, name)
+        for name, sentence in positives.items():
+            if name not in located:
+                located[name] = fused_locate(report, name, sentence)
+        return located
     
     # Nodule, Mass 제외
     disease_list = ['Nodule', 'Mass', 'Pleural Effusion', 'Consolidation', 'Atelectasis', 'Pneumothorax', 'Ground Glass Opacity', 'Emphysema', 'Mosaic Attenuation', 'Bronchiectasis', 'Interlobular Septal Thickening']
@@ -38,71 +159,45 @@ def lung_csv(save_path, report_df):
             columns.append(f"{disease_name}_single")
             columns.append(f"{disease_name}_multiple")
     
-    result_df = pd.DataFrame(columns=columns)
-    result_df['id'] = report_df['id']
-    result_df['lung_report'] = report_df['lung_report']
-    
-    # 모든 값을 0으로 초기화
-    for col in columns:
-        if col != 'id' and col != 'lung_report':  # id, report 열은 건너뛰기
-            result_df[col] = 0
+    # 완료된 report는 journal에 바로 기록 (resume 시 건너뛰기)
+    journal, done = start_journal(os.path.splitext(save_path)[0] + '.jsonl', resume)
+    dead_letter = open_dead_letter(journal, resume, done)
+    builder = LabelBuilder(columns)
+    for record in done.values():
+        builder.add_record(record)
         
-    for idx, row in tqdm(report_df.iterrows()):
+    # report 단위로 workers개씩 동시에 처리 (builder, journal은 thread-safe)
+    def process_row(row):
         id = row['id']
         report = row['lung_report']
         
+        labels = builder.add_row(id, report)  # 모든 값을 0으로 초기화
+
+        # "No relevant findings." / 빈 section은 classifier 호출 없이 0으로 기록
+        if skip_negative('lung', report, lung_disease_classifier):
+            journal.append(labels.record())
+            return
+        
         disease_classifier_result = lung_disease_classifier(report)
         
+        positives = {}
         for disease_name in disease_list:
             if int(disease_classifier_result['abnormality_presence'][disease_name]) == 0:
                 continue
-            
-            disease_lesion_sentence = disease_classifier_result['lesion_sentence'][disease_name]
-            
-            result_df.loc[result_df['id']==id, f"{disease_name}_presence"] = 1
-            
-            rl_result = rl_locator(report=report, abnormality_class=disease_name)
-            
-            if int(rl_result.left)==1:
-                left_lobe_locator_result = left_lobe_locator(sentence=disease_lesion_sentence, abnormality_class=disease_name)
-                
-                if int(left_lobe_locator_result.left_upper_lobe)==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_lul"] = 1
-                    
-                if int(left_lobe_locator_result.left_lower_lobe)==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_lll"] = 1
-                
-                if int(left_lobe_locator_result.unspecified)==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_left_unspecified"] = 1
-                    
-            if int(rl_result.right)==1:
-                right_lobe_locator_result = right_lobe_locator(sentence=disease_lesion_sentence, abnormality_class=disease_name)
-                
-                if int(right_lobe_locator_result.right_upper_lobe)==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_rul"] = 1
-                    
-                if int(right_lobe_locator_result.right_middle_lobe)==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_rml"] = 1
-  
-                if int(right_lobe_locator_result.right_lower_lobe)==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_rll"] = 1
-
-                if int(right_lobe_locator_result.unspecified)==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_right_unspecified"] = 1
-                
-            if int(rl_result.unspecified)==1:
-                result_df.loc[result_df['id']==id, f"{disease_name}_unspecified"] = 1
-            
-            if disease_name in ['Nodule', 'Mass']:
-                # Count 추가하기
-                counter_result = counter(report=report, abnormality_class=disease_name)
-                
-                if counter_result.single==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_single"] = 1
-                
-                if counter_result.multiple==1:
-                    result_df.loc[result_df['id']==id, f"{disease_name}_multiple"] = 1
+            positives[disease_name] = disease_classifier_result['lesion_sentence'][disease_name]
+            labels[f"{disease_name}_presence"] = 1
+        
+        for disease_name, suffixes in locate(report, positives).items():
+            for suffix in suffixes:
+                labels[f"{disease_name}_{suffix}"] = 1
+        
+        journal.append(labels.record())
 
+    # 실패한 report는 dead letter로, batch 응답을 기다리는 report는 다음 round로 (빈 row를 CSV에 남기지 않음)
+    unfinished = process_reports(process_row, report_df, workers=workers, done=done, dead_letter=dead_letter, organ='lung')
+
+    result_df = builder.to_frame(exclude=unfinished)
+    
     # Sort df
     result_df = result_df.sort_values(by='id')
     
@@ -1,11 +1,14 @@
 import pandas as pd
 import dspy
 import os
-from tqdm import tqdm
 
+from ..pipeline import process_reports
+from ..journal import start_journal, open_dead_letter
+from .label_builder import LabelBuilder
+from ..negative_sections import skip_negative
 from ..prompt.mediastinum_prompt import *
 
-def mediastinum_csv(save_path, report_df):
+def mediastinum_csv(save_path, report_df, resume=False, workers=1):
     # Disease classifier
     mediastinum_disease_classifier = Mediastinum_Disease_Classifier()
     
@@ -29,19 +32,25 @@ def mediastinum_csv(save_path, report_df):
         'Pneumomediastinum_presence'
     ]
     
-    result_df = pd.DataFrame(columns=columns)
-    result_df['id'] = report_df['id']
-    result_df['mediastinum_report'] = report_df['mediastinum_report']
-    
-    # 모든 값을 0으로 초기화
-    for col in columns:
-        if col != 'id' and col != 'mediastinum_report':  # id, report 열은 건너뛰기
-            result_df[col] = 0
+    # 완료된 report는 journal에 바로 기록 (resume 시 건너뛰기)
+    journal, done = start_journal(os.path.splitext(save_path)[0] + '.jsonl', resume)
+    dead_letter = open_dead_letter(journal, resume, done)
+    builder = LabelBuilder(columns)
+    for record in done.values():
+        builder.add_record(record)
     
     # Csv 생성
-    for idx, row in tqdm(report_df.iterrows()):
+    # report 단위로 workers개씩 동시에 처리 (builder, journal은 thread-safe)
+    def process_row(row):
         id = row['id']
         report = row['mediastinum_report']
+        
+        labels = builder.add_row(id, report)  # 모든 값을 0으로 초기화
+
+        # "No relevant findings." / 빈 section은 classifier 호출 없이 0으로 기록
+        if skip_negative('mediastinum', report, mediastinum_disease_classifier):
+            journal.append(labels.record())
+            return
 
         disease_classifier_result = mediastinum_disease_classifier(report=report)
         
@@ -51,65 +60,72 @@ def mediastinum_csv(save_path, report_df):
             locator_mediastinal_result = locator_mediastinal_mass(lesion_sentence=mediastinal_mass_sentence)
             
             # Presence
-            result_df.loc[result_df['id']==id, "Mediastinal_Mass_presence"] = 1
+            labels["Mediastinal_Mass_presence"] = 1
 
             # Mediastinal mass locator
             if int(locator_mediastinal_result.anterior) == 1:
-                result_df.loc[result_df['id']==id, 'Mediastinal_Mass_anterior'] = 1
+                labels['Mediastinal_Mass_anterior'] = 1
             if int(locator_mediastinal_result.middle) == 1:
-                result_df.loc[result_df['id']==id, 'Mediastinal_Mass_middle'] = 1
+                labels['Mediastinal_Mass_middle'] = 1
             if int(locator_mediastinal_result.posterior) == 1:
-                result_df.loc[result_df['id']==id, 'Mediastinal_Mass_posterior'] = 1
+                labels['Mediastinal_Mass_posterior'] = 1
             if int(locator_mediastinal_result.unspecified) == 1:
-                result_df.loc[result_df['id']==id, 'Mediastinal_Mass_unspecified'] = 1
+                labels['Mediastinal_Mass_unspecified'] = 1
 
         # Lymphadenopathy
         if int(disease_classifier_result['Lymphadenopathy'].abnormality_presence) == 1:
             lymphadenopathy_sentence = disease_classifier_result['Lymphadenopathy'].lesion_sentence
             locator_lymphadenopathy_result = locator_lymphadenopathy(lesion_sentence=lymphadenopathy_sentence)
 
-            result_df.loc[result_df['id']==id, "Lymphadenopathy_presence"] = 1
+            labels["Lymphadenopathy_presence"] = 1
 
             # Lymphadenopathy locator
             if int(locator_lymphadenopathy_result.supraclavicular) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_supraclavicular'] = 1
+                labels['Lymphadenopathy_supraclavicular'] = 1
             if int(locator_lymphadenopathy_result.upper_paratracheal) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_upper_paratracheal'] = 1
+                labels['Lymphadenopathy_upper_paratracheal'] = 1
             if int(locator_lymphadenopathy_result.prevascular) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_prevascular'] = 1
+                labels['Lymphadenopathy_prevascular'] = 1
             if int(locator_lymphadenopathy_result.prevertebral) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_prevertebral'] = 1
+                labels['Lymphadenopathy_prevertebral'] = 1
             if int(locator_lymphadenopathy_result.lower_paratracheal) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_lower_paratracheal'] = 1
+                labels['Lymphadenopathy_lower_paratracheal'] = 1
             if int(locator_lymphadenopathy_result.subaortic) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_subaortic'] = 1
+                labels['Lymphadenopathy_subaortic'] = 1
             if int(locator_lymphadenopathy_result.paraaortic) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_paraaortic'] = 1
+                labels['Lymphadenopathy_paraaortic'] = 1
             if int(locator_lymphadenopathy_result.subcarinal) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_subcarinal'] = 1
+                labels['Lymphadenopathy_subcarinal'] = 1
             if int(locator_lymphadenopathy_result.paraesophageal) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_paraesophageal'] = 1
+                labels['Lymphadenopathy_paraesophageal'] = 1
             if int(locator_lymphadenopathy_result.hilar) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_hilar'] = 1
+                labels['Lymphadenopathy_hilar'] = 1
             if int(locator_lymphadenopathy_result.unspecified) == 1:
-                result_df.loc[result_df['id']==id, 'Lymphadenopathy_unspecified'] = 1
+                labels['Lymphadenopathy_unspecified'] = 1
 
         # Esophageal Mass
         if int(disease_classifier_result['Esophageal_Mass'].abnormality_presence) == 1:
             esophageal_mass_sentence = disease_classifier_result['Esophageal_Mass'].lesion_sentence
             counter_esophageal_mass_result = counter_esophageal_mass(lesion_sentence=esophageal_mass_sentence)
 
-            result_df.loc[result_df['id']==id, "Esophageal_Mass_presence"] = 1    
+            labels["Esophageal_Mass_presence"] = 1    
 
             if int(counter_esophageal_mass_result.single) == 1:
-                result_df.loc[result_df['id']==id, 'Esophageal_Mass_single'] = 1
+                labels['Esophageal_Mass_single'] = 1
             if int(counter_esophageal_mass_result.multiple) == 1:
-                result_df.loc[result_df['id']==id, 'Esophageal_Mass_multiple'] = 1            
+                labels['Esophageal_Mass_multiple'] = 1            
                 
         # Pneumomediastinum
         if int(disease_classifier_result['Pneumomediastinum'].abnormality_presence) == 1:
-            result_df.loc[result_df['id']==id, 'Pneumomediastinum_presence'] = 1
+            labels['Pneumomediastinum_presence'] = 1
+        
+        journal.append(labels.record())
+
+    # 실패한 report는 dead letter로, batch 응답을 기다리는 report는 다음 round로 (빈 row를 CSV에 남기지 않음)
+    unfinished = process_reports(process_row, report_df, workers=workers, done=done, dead_letter=dead_letter, organ='mediastinum')
 
+    result_df = builder.to_frame(exclude=unfinished)
+    
     # Sort df
     result_df = result_df.sort_values(by='id')
     
@@ -121,4 +121,45 @@ class Extract_OsseousStructures(dspy.Signature):
     3. If no direct observations can be identified, write "No relevant findings."
     """
     report: str = dspy.InputField(desc="patient's medical report")
-    sentences: str = dspy.OutputField(desc="sentences corresponding to the osseous structures from the medical report")
\ No newline at end of file
+    sentences: str = dspy.OutputField(desc="sentences corresponding to the osseous structures from the medical report")
+
+class Extract_AllSections(dspy.Signature):
+    """
+    Task:
+    You are given a medical report. Extract the findings of each of the following sections from the report in a single pass:
+    'lung parenchyma, small airway and pleural space', 'large airway', 'mediastinum', 'heart and great vessels', 'abdomen', 'osseous structures'.
+    
+    Instructions:
+    1. lung_parenchyma: findings of the 'lung parenchyma', 'small airway' or 'pleural space'.
+    Do not include keywords that indicate 'large airway' (e.g., trachea, bronchus, bronchi)
+    Keywords: emphysema, nodule(s), consolidation, parenchymal distortion, ground-glass opacity (GGO), mass, fibrosis, infiltrates, atelectasis, scarring, linear opacity, bullae, lobe, interlobar, bronchiectasis, bronchiole, bronchiolitis, bronchovascular, pleural effusion, pleural thickening, subpleural, ...
+    Combine all descriptions referring to the same finding into a single entry, maintaining logical connections.
+    
+    2. airways: findings of the 'Large airway' (trachea, bronchus, bronchi).
+    Keywords like Bronchioles, Bronchiectasis, Bronchiolitis, Bronchovascular are not included.
+    Do not include terms that describe locations such as paratracheal or retrotracheal.
+    
+    3. mediastinum: findings of the 'Mediastinum'.
+    Keywords: Esophagus, paratracheal, prevascular, paraaortic, subaortic, subcarinal, hilar, thymus, ...
+    
+    4. heart_and_great_vessels: findings of the 'Heart and great vessels'.
+    Do not include findings related to osseous structures. (e.g, bone, rib, fracture)
+    Keywords: cardiomegaly, pericardial effusion, aortic aneurysm, pulmonary artery enlargement, vascular calcifications, pulmonary embolism, ..
+    
+    5. abdomen: findings of the 'Abdomen'.
+    Keywords: liver lesion, kidney, adrenal nodule, hepatic mass, splenomegaly, hiatal hernia ...
+    
+    6. osseous_structures: findings of the 'Osseous structures'.
+    Keywords: rib lesion, lytic bone lesion, osteoblastic lesion, spinal involvement, fractures, bony metastasis, ...
+    
+    7. For every section, use the exact wording from the given report without adding your thoughts or additional expressions.
+    
+    8. If no direct observations can be identified for a section, write "No relevant findings." for that section. Never leave a section empty.
+    """
+    report: str = dspy.InputField(desc="patient's medical report")
+    lung_parenchyma: str = dspy.OutputField(desc="sentences corresponding to lung parenchyma, small airway, or pleural space from the medical report")
+    airways: str = dspy.OutputField(desc="sentences corresponding to Large airway from the medical report")
+    mediastinum: str = dspy.OutputField(desc="sentences corresponding to the mediastinum from the medical report")
+    heart_and_great_vessels: str = dspy.OutputField(desc="sentences corresponding to the heart and great vessels from the medical report")
+    abdomen: str = dspy.OutputField(desc="sentences corresponding to the abdomen from the medical report")
+    osseous_structures: str = dspy.OutputField(desc="sentences corresponding to the osseous structures from the medical report")
@@ -6,43 +6,71 @@ import concurrent.futures
 from functools import partial
 
 from .formatting_prompt import *
+from ..llm_client import create_lm, find_layer
+from ..journal import start_journal, open_dead_letter, failure_record
+from ..call_context import call_context
+from ..llm_batch import BatchPending
+from ..prompt.parallel import run_classifiers
+from ..usage_ledger import LedgerLM
+from ..profiler import span
 
 def process_report(report_id, report_text, lung_cot, airway_cot, mediastinum_cot, heart_cot, abdomen_cot, osseous_cot):
-    """Process a single report with all classifiers"""
+    """
+    Process a single report with all classifiers.
+    Errors are raised (after the LLM retries) so that the report is dead-lettered instead of
+    flowing downstream with empty sections.
+    """
+    # Extract the relevant sections from the report (the six calls are independent, so they run concurrently)
+    sections = run_classifiers({
+        'lung_report': lung_cot,
+        'large_airway_report': airway_cot,
+        'mediastinum_report': mediastinum_cot,
+        'heart_and_vessel_report': heart_cot,
+        'abdomen_report': abdomen_cot,
+        'osseous_structure_report': osseous_cot,
+    }, report=report_text)
+    
+    row = {'id': report_id, 'original_report': report_text}
+    for column, result in sections.items():
+        row[column] = result.sentences
+    return row
+
+# Extract_AllSections output field -> format.csv column
+FUSED_SECTIONS = {
+    'lung_parenchyma': 'lung_report',
+    'airways': 'large_airway_report',
+    'mediastinum': 'mediastinum_report',
+    'heart_and_great_vessels': 'heart_and_vessel_report',
+    'abdomen': 'abdomen_report',
+    'osseous_structures': 'osseous_structure_report',
+}
+
+def validate_fused_result(result):
+    """Return True if every section of a fused response is a non-empty string"""
+    for field in FUSED_SECTIONS:
+        value = getattr(result, field, None)
+        if not isinstance(value, str) or not value.strip():
+            return False
+    return True
+
+def process_report_fused(report_id, report_text, fused_cot, fallback):
+    """Process a single report with one Extract_AllSections call, falling back to the per-organ classifiers"""
     try:
-        # Extract the relevant sections from the report
-        lung_parenchyma = lung_cot(report=report_text).sentences
-        airways = airway_cot(report=report_text).sentences
-        mediastinum = mediastinum_cot(report=report_text).sentences
-        heart_and_great_vessels = heart_cot(report=report_text).sentences
-        abdomen = abdomen_cot(report=report_text).sentences
-        osseous_structures = osseous_cot(report=report_text).sentences
-        
-        return {
-            'id': report_id,
-            'original_report': report_text,
-            'lung_report': lung_parenchyma,
-            'large_airway_report': airways,
-            'mediastinum_report': mediastinum,
-            'heart_and_vessel_report': heart_and_great_vessels,
-            'abdomen_report': abdomen,
-            'osseous_structure_report': osseous_structures
-        }
+        result = fused_cot(report=report_text)
+        if validate_fused_result(result):
+            row = {'id': report_id, 'original_report': report_text}
+            for field, column in FUSED_SECTIONS.items():
+                row[column] = getattr(result, field)
+            return row
+        print(f"Fused response for report {report_id} failed validation. Falling back to per-organ formatting.")
+    except BatchPending:
+        raise
     except Exception as e:
-        print(f"Error processing report {report_id}: {e}")
-        # Return a row with the ID and original report, but empty formatted sections
-        return {
-            'id': report_id,
-            'original_report': report_text,
-            'lung_report': "",
-            'large_airway_report': "",
-            'mediastinum_report': "",
-            'heart_and_vessel_report': "",
-            'abdomen_report': "",
-            'osseous_structure_report': ""
-        }
+        print(f"Fused formatting failed for report {report_id}: {e}. Falling back to per-organ formatting.")
+    
+    return fallback(report_id, report_text)
 
-def format_csv(save_path, report_df, max_workers=None):
+def format_csv(save_path, report_df, max_workers=None, fused=False, streams=None, lm=None, resume=False, retry_failed=False):
     """
     Process reports in parallel using ThreadPoolExecutor
     
@@ -50,14 +78,24 @@ def format_csv(save_path, report_df, max_workers=None):
         save_path: Path to save the formatted CSV
         report_df: DataFrame containing reports to process
         max_workers: Number of parallel workers (default: None, which uses CPU count)
+        fused: Extract all six sections with a single Extract_AllSections call per report
+        streams: ReportStreams that receive each formatted row as soon as it completes (pipelined mode)
+        lm: Already configured dspy.LM to use (default: None, which creates and configures a new one)
+        resume: Skip reports already recorded in the journal of a previous run
+        retry_failed: Only reprocess the reports in the dead-letter file of a previous run (implies resume)
+    
+    Each finished report is appended to a journal (format.jsonl next to save_path) as soon as it completes,
+    and the final CSV is assembled from that journal. Reports that fail are appended to format_failed.jsonl
+    and are not passed to the organ builders.
     """
     columns = ['id', 'original_report', 'lung_report', 'large_airway_report', 
                'mediastinum_report', 'heart_and_vessel_report', 'abdomen_report', 
                'osseous_structure_report']
 
     # OpenAI
-    lm = dspy.LM('openai/gpt-4o-mini', api_key=os.environ['OPENAI_API_KEY'], temperature=1.0, max_tokens=5000)
-    dspy.configure(lm=lm)
+    if lm is None:
+        lm = create_lm()
+        dspy.configure(lm=lm, disable_history=True)
 
     # Initialize classifiers
     lung_cot = dspy.ChainOfThought(Extract_LungParenchyma)
@@ -80,31 +118,70 @@ def format_csv(save_path, report_df, max_workers=None):
         osseous_cot=osseous_cot
     )
     
-    results = []
+    if fused:
+        fused_cot = dspy.ChainOfThought(Extract_AllSections)
+        process_func = partial(process_report_fused, fused_cot=fused_cot, fallback=process_func)
+    
+    journal, done = start_journal(os.path.splitext(save_path)[0] + '.jsonl', resume or retry_failed)
+    dead_letter = open_dead_letter(journal, resume or retry_failed, done)
+    
+    if retry_failed:
+        retry_ids = set(dead_letter.load()) - set(done)
+        print(f"Retrying {len(retry_ids)} failed reports.")
+        pending_df = report_df[report_df['id'].isin(retry_ids)]
+    else:
+        pending_df = report_df[~report_df['id'].isin(list(done))]
+    
+    streams = streams or []
     
     # Using ThreadPoolExecutor for parallel processing
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_id = {
-            executor.submit(process_func, row['id'], row['report']): row['id'] 
-            for _, row in report_df.iterrows()
-        }
+    try:
+        # Reports formatted by a previous run go straight to the organ builders
+        for result in done.values():
+            for stream in streams:
+                stream.put(result)
+        
+        def format_in_context(report_id, report_text):
+            # Lets the LLM scheduler tell formatting calls apart from organ calls
+            with call_context(stage='format', report_id=report_id), span('report', 'report', id=report_id, stage='format'):
+                return process_func(report_id, report_text)
         
-        # Process results as they complete
-        for future in tqdm(concurrent.futures.as_completed(future_to_id), total=len(future_to_id), desc="Formatting reports"):
-            report_id = future_to_id[future]
-            try:
-                result = future.result()
-                results.append(result)
-            except Exception as e:
-                print(f"Report {report_id} generated an exception: {e}")
+        with span('format', 'stage'), concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Submit all tasks
+            future_to_id = {
+                executor.submit(format_in_context, row['id'], row['report']): row['id'] 
+                for _, row in pending_df.iterrows()
+            }
+            
+            # Process results as they complete
+            for future in tqdm(concurrent.futures.as_completed(future_to_id), total=len(future_to_id), desc="Formatting reports"):
+                report_id = future_to_id[future]
+                try:
+                    result = future.result()
+                    journal.append(result)
+                    dead_letter.discard(report_id)
+                except BatchPending:
+                    # Formatted in the next batch round
+                    continue
+                except Exception as e:
+                    print(f"Report {report_id} generated an exception: {e}")
+                    dead_letter.append(failure_record(report_id, 'format', e))
+                    continue
+                
+                # Hand the row to the organ builders without waiting for the whole batch
+                for stream in streams:
+                    stream.put(result)
+    finally:
+        for stream in streams:
+            stream.close()
     
-    # Convert results to DataFrame and save
-    format_df = pd.DataFrame(results, columns=columns)
+    # Assemble the DataFrame from the journal and save
+    format_df = pd.DataFrame(list(journal.load().values()), columns=columns)
     
-    # OpenAI cost calculation
-    cost = sum([x['cost'] for x in lm.history if x['cost'] is not None])
-    print("Total cost:", cost)
+    # OpenAI cost calculation (only recorded when the LM has a usage ledger)
+    ledger_lm = find_layer(lm, LedgerLM)
+    if ledger_lm is not None:
+        print("Formatting cost:", ledger_lm.ledger.cost('stage', 'format'))
 
     # Sort df
     format_df = format_df.sort_values(by='id')
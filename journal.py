@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+
+from .profiler import span
+
+
+def _to_builtin(value):
+    # numpy scalars (e.g. ids read by pandas) are not JSON serializable
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class Journal:
+    """
+    Append-only JSONL journal of finished reports, keyed by report id.
+
+    Every record is flushed and fsynced as soon as it is appended, so a crash or Ctrl-C
+    loses at most the report that was being written.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def reset(self):
+        """Start a new journal, discarding previous records"""
+        with self._lock:
+            open(self.path, 'w').close()
+
+    def load(self):
+        """Return {id: record} for every complete record, later records win"""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+
+        with self._lock:
+            # Terminate a line cut off by a crash, so the next append starts on its own line
+            with open(self.path, 'rb+') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        f.write(b'\n')
+
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line cut off by a crash
+                    continue
+                records[record['id']] = record
+        return records
+
+    def append(self, record):
+        with span('journal.append', 'io'):
+            line = json.dumps(record, ensure_ascii=False, default=_to_builtin)
+            with self._lock:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+
+
+class DeadLetter(Journal):
+    """Journal of reports that failed after all retries, keeping one record (the latest failure) per id"""
+    def __init__(self, path):
+        super().__init__(path)
+        self._records = {}
+        self._records_lock = threading.Lock()
+
+    def reset(self):
+        with self._records_lock:
+            self._records = {}
+            super().reset()
+
+    def reopen(self, done=()):
+        """Keep the latest record of every id that is not in done, so retried reports do not pile up"""
+        with self._records_lock:
+            self._records = {id: record for id, record in self.load().items() if id not in done}
+            self._rewrite()
+
+    def _rewrite(self):
+        tmp_path = self.path + '.tmp'
+        with self._lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in self._records.values():
+                    f.write(json.dumps(record, ensure_ascii=False, default=_to_builtin) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def discard(self, id):
+        """Drop the record of a report that has now finished"""
+        with self._records_lock:
+            if self._records.pop(id, None) is not None:
+                self._rewrite()
+
+    def append(self, record):
+        with self._records_lock:
+            seen = record['id'] in self._records
+            self._records[record['id']] = record
+            if seen:
+                # A retried report failed again: replace its record instead of adding a second one
+                self._rewrite()
+            else:
+                super().append(record)
+
+
+def start_journal(path, resume=False):
+    """
+    Open the journal at path and return (journal, {id: record} of finished reports).
+    Without resume the previous journal is discarded.
+    """
+    journal = Journal(path)
+    if resume:
+        done = journal.load()
+        print(f"Resuming from {path}: {len(done)} reports already processed.")
+    else:
+        done = {}
+        journal.reset()
+    return journal, done
+
+
+def open_dead_letter(journal, resume=False, done=()):
+    """
+    Open the dead-letter journal next to journal (<name>_failed.jsonl): reports that still failed after all retries.
+    Without resume the previous dead letters are discarded. On resume they are deduplicated by id,
+    and reports that have since finished (in done) are dropped.
+    """
+    dead_letter = DeadLetter(os.path.splitext(journal.path)[0] + '_failed.jsonl')
+    if resume:
+        dead_letter.reopen(done)
+    else:
+        dead_letter.reset()
+    return dead_letter
+
+
+def failure_record(id, stage, exc):
+    return {'id': id, 'stage': stage, 'error': f"{type(exc).__name__}: {exc}"}
@@ -0,0 +1,173 @@
+"""
+OpenAI Batch API execution for offline bulk runs.
+
+A batch run repeats the normal sequential pipeline in rounds. During a round every LLM call goes
+through a BatchCollectorLM (with the BatchAdapter): answered from the response cache when possible, otherwise the request
+is queued and the report is left unfinished (BatchPending). Between rounds the queued requests are
+written to JSONL, submitted to the Batch API, polled until done, and their responses stored in the
+cache. Each dependent link (formatting, classifier, locator, counter/onset) therefore takes one round,
+and the run ends when a round queues nothing.
+"""
+import json
+import os
+import threading
+import time
+
+import dspy
+from dspy.adapters.base import Adapter
+from litellm import ModelResponse, completion_cost
+from openai import OpenAI
+
+from .llm_cache import CachedLM
+
+MAX_REQUESTS_PER_BATCH = 50000
+BATCH_DISCOUNT = 0.5
+MAX_ATTEMPTS = 3  # batches a request may fail in before its report is dead-lettered
+
+
+class BatchPending(Exception):
+    """The report needs a response that is queued for the next batch"""
+
+
+class BatchRequestFailed(Exception):
+    """A request failed in MAX_ATTEMPTS batches"""
+
+
+class BatchAdapter(dspy.ChatAdapter):
+    """
+    ChatAdapter without the JSONAdapter fallback.
+
+    The fallback would swallow BatchPending and queue structured-output variants of every request.
+    A batch response that does not parse fails its report, which is dead-lettered as usual
+    (and can be retried interactively with --retry-failed).
+    """
+    def __call__(self, lm, lm_kwargs, signature, demos, inputs):
+        return Adapter.__call__(self, lm, lm_kwargs, signature, demos, inputs)
+
+
+class BatchCollectorLM(CachedLM):
+    """dspy LM that answers from the response cache and queues every other request for the Batch API"""
+    def __init__(self, lm, cache):
+        super().__init__(lm, cache)
+        self.pending = {}
+        self.failures = {}
+        self.unbooked = {}  # batch cost of responses no LLM call has used yet
+        self._lock = threading.Lock()
+
+    def store(self, key, response, cost):
+        with self._lock:
+            self.unbooked[key] = cost
+        self.response_cache.put(key, response)
+
+    def lookup(self, key):
+        response = super().lookup(key)
+        if response is None:
+            return None
+        with self._lock:
+            cost = self.unbooked.pop(key, None)
+        if cost is not None:
+            # The call that waited for this batch response pays its discounted cost (in the ledger too)
+            response._hidden_params['response_cost'] = cost
+            response.cache_hit = False
+        return response
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        kwargs = {**self.kwargs, **kwargs}
+        key = self.response_cache.key(self.model, prompt, messages, kwargs)
+        response = self.lookup(key)
+        if response is not None:
+            return response
+
+        if self.failures.get(key, 0) >= MAX_ATTEMPTS:
+            raise BatchRequestFailed(f"request failed in {MAX_ATTEMPTS} batches")
+
+        with self._lock:
+            self.pending[key] = {
+                'messages': messages or [{'role': 'user', 'content': prompt}],
+                'kwargs': {k: v for k, v in kwargs.items() if not k.startswith('api_')},
+            }
+        raise BatchPending()
+
+    def take_pending(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+
+class BatchRunner:
+    """Submits queued requests to the Batch API and stores the responses in the collector's cache"""
+    def __init__(self, collector, work_dir, base_url=None, api_key=None, poll_interval=60.0):
+        self.collector = collector
+        self.work_dir = work_dir
+        self.client = OpenAI(base_url=base_url, api_key=api_key or os.environ.get('OPENAI_API_KEY'))
+        self.poll_interval = poll_interval
+        self.rounds = 0
+        self.cost = 0.0
+        os.makedirs(work_dir, exist_ok=True)
+
+    def write_requests(self, requests, path):
+        model = self.collector.model.split('/', 1)[-1]
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, request in requests:
+                line = {
+                    'custom_id': key,
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': {'model': model, 'messages': request['messages'], **request['kwargs']},
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+    def submit(self, path):
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        return self.client.batches.create(input_file_id=input_file.id, endpoint='/v1/chat/completions', completion_window='24h')
+
+    def wait(self, batch):
+        while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+        return batch
+
+    def store_results(self, batch, keys):
+        """Cache every successful response; count a failure for every other request of the batch"""
+        answered = set()
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get('response') or {}
+                if response.get('status_code') != 200:
+                    continue
+                model_response = ModelResponse(**response['body'])
+                try:
+                    cost = completion_cost(completion_response=model_response) * BATCH_DISCOUNT
+                except Exception:
+                    cost = 0.0
+                self.cost += cost
+                self.collector.store(result['custom_id'], model_response, cost)
+                answered.add(result['custom_id'])
+
+        for key in keys - answered:
+            self.collector.failures[key] = self.collector.failures.get(key, 0) + 1
+        return len(answered)
+
+    def run(self, requests):
+        """Run one round: submit all queued requests (in chunks of MAX_REQUESTS_PER_BATCH) and wait for them"""
+        self.rounds += 1
+        items = list(requests.items())
+        batches = []
+        for start in range(0, len(items), MAX_REQUESTS_PER_BATCH):
+            chunk = items[start:start + MAX_REQUESTS_PER_BATCH]
+            path = os.path.join(self.work_dir, f"round{self.rounds}_{start // MAX_REQUESTS_PER_BATCH}.jsonl")
+            self.write_requests(chunk, path)
+            batches.append((self.submit(path), {key for key, _ in chunk}))
+        print(f"Batch round {self.rounds}: submitted {len(items)} requests in {len(batches)} batches.")
+
+        answered = 0
+        for batch, keys in batches:
+            batch = self.wait(batch)
+            if batch.status != 'completed':
+                print(f"Batch {batch.id} ended with status {batch.status}.")
+            answered += self.store_results(batch, keys)
+        print(f"Batch round {self.rounds}: {answered} of {len(items)} requests answered.")
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import dspy
+
+
+class LLMCache:
+    """
+    Persistent content-addressed store of LLM responses, backed by SQLite.
+
+    Safe to share between threads (one connection per thread) and processes (WAL journal + busy timeout).
+    When the stored responses exceed max_bytes, the least recently used entries are evicted.
+    """
+    EVICT_EVERY = 100  # puts between size checks
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'llm_cache.sqlite')
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(model, prompt, messages, kwargs):
+        """
+        Hash of everything that determines a response.
+        The messages rendered by dspy already contain the signature instructions, field descriptions and inputs.
+        """
+        kwargs = {k: v for k, v in kwargs.items() if not k.startswith('api_')}
+        payload = json.dumps(
+            {'model': model, 'prompt': prompt, 'messages': messages, 'kwargs': kwargs},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+
+        conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        conn.commit()
+        return pickle.loads(row[0])
+
+    def put(self, key, response):
+        value = pickle.dumps(response)
+        conn = self._conn()
+        conn.execute(
+            'INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+            (key, value, len(value), time.time()),
+        )
+        conn.commit()
+
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache is back under 90% of max_bytes"""
+        conn = self._conn()
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        keys = []
+        cursor = conn.execute('SELECT key, size FROM responses ORDER BY accessed')
+        for key, size in cursor:
+            keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        cursor.close()
+        conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+        conn.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+class CachedLM(dspy.BaseLM):
+    """dspy LM that answers repeated requests from an LLMCache and forwards the rest to the wrapped LM"""
+    def __init__(self, lm, cache):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.response_cache = cache
+
+    def lookup(self, key):
+        response = self.response_cache.get(key)
+        if response is not None:
+            # Nothing was paid for this response
+            response._hidden_params['response_cost'] = 0.0
+            response.cache_hit = True
+        return response
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        key = self.response_cache.key(self.model, prompt, messages, {**self.kwargs, **kwargs})
+
+        response = self.lookup(key)
+        if response is not None:
+            return response
+
+        response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        self.response_cache.put(key, response)
+        return response
@@ -0,0 +1,208 @@
+"""
+Record / replay cassettes of LLM traffic.
+
+--record wraps the API model with a RecordingLM that appends every answered request (messages, sampling
+kwargs, response, latency, cost) to a gzip-compressed JSONL cassette. --replay answers the same requests
+from the cassette with a ReplayLM instead of the API, sleeping the recorded latency (or not at all), so
+formatting, the organ builders and the evaluation can be profiled and compared offline on identical responses.
+
+Requests are matched by model and rendered messages only, so a cassette still replays when sampling
+parameters change. Identical requests are served in the order they were recorded.
+
+--verify reruns a cassette's inputs against the API and compares every response with the recorded one,
+to check that a --deterministic run really reproduces its outputs.
+"""
+import collections
+import gzip
+import json
+import threading
+import time
+
+import dspy
+from litellm import ModelResponse
+
+from .llm_cache import LLMCache
+
+
+def request_key(model, prompt, messages):
+    return LLMCache.key(model, prompt, messages, {})
+
+
+class CassetteMiss(Exception):
+    """The replayed run made a request that is not in the cassette"""
+
+
+class CassetteRecorder:
+    """Appends recorded calls to a gzip JSONL file, safe to share between threads"""
+    FLUSH_EVERY = 100  # calls between flushes, so an interrupted run keeps most of its cassette
+
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, model, prompt, messages, kwargs, response, latency):
+        entry = {
+            'key': request_key(model, prompt, messages),
+            'model': model,
+            'prompt': prompt,
+            'messages': messages,
+            'kwargs': {k: v for k, v in kwargs.items() if not k.startswith('api_')},
+            'response': response.model_dump(),
+            'cost': getattr(response, '_hidden_params', {}).get('response_cost') or 0.0,
+            'latency': latency,
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self.calls += 1
+            if self.calls % self.FLUSH_EVERY == 0:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingLM(dspy.BaseLM):
+    """dspy LM that records every successful call of the wrapped LM (errors and retries are not recorded)"""
+    def __init__(self, lm, recorder):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.recorder = recorder
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        start = time.monotonic()
+        response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        self.recorder.record(self.model, prompt, messages, {**self.kwargs, **kwargs}, response, time.monotonic() - start)
+        return response
+
+
+class Cassette:
+    """Recorded calls grouped by request, each group served in recording order"""
+    def __init__(self, path):
+        self.path = path
+        self._entries = collections.defaultdict(list)
+        self.model = None
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.model = self.model or entry['model']
+                    self._entries[entry['key']].append(entry)
+        self._served = collections.Counter()
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def next(self, key):
+        """Next recorded call of the request (the last one again once all were served), or None"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                return None
+            entry = entries[min(self._served[key], len(entries) - 1)]
+            self._served[key] += 1
+            return entry
+
+    def stats(self):
+        with self._lock:
+            return {'recorded': len(self), 'served': sum(self._served.values()), 'misses': self.misses}
+
+
+def response_text(response):
+    return [choice['message']['content'] for choice in response['choices']]
+
+
+class CassetteVerifier:
+    """Compares live responses with a Cassette and writes every mismatch to a JSONL file"""
+    def __init__(self, cassette, path):
+        self.cassette = cassette
+        self.path = path
+        self.matched = 0
+        self.mismatched = 0
+        self.unrecorded = 0
+        self._file = open(path, 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def check(self, model, prompt, messages, kwargs, response):
+        entry = self.cassette.next(request_key(model, prompt, messages))
+        actual = response.model_dump()
+        with self._lock:
+            if entry is None:
+                self.unrecorded += 1
+                return
+            if response_text(entry['response']) == response_text(actual):
+                self.matched += 1
+                return
+            self.mismatched += 1
+            mismatch = {
+                'key': entry['key'],
+                'recorded': response_text(entry['response']),
+                'actual': response_text(actual),
+                'recorded_kwargs': entry['kwargs'],
+                'kwargs': {k: v for k, v in kwargs.items() if not k.startswith('api_')},
+                # A different backend configuration explains a mismatch despite the same seed
+                'recorded_fingerprint': entry['response'].get('system_fingerprint'),
+                'fingerprint': actual.get('system_fingerprint'),
+            }
+            self._file.write(json.dumps(mismatch, ensure_ascii=False, default=str) + '\n')
+            self._file.flush()
+
+    def stats(self):
+        with self._lock:
+            checked = self.matched + self.mismatched
+            return {
+                'matched': self.matched,
+                'mismatched': self.mismatched,
+                'unrecorded': self.unrecorded,
+                'match_rate': self.matched / checked if checked else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class VerifyingLM(dspy.BaseLM):
+    """dspy LM that hands every successful call of the wrapped LM to a CassetteVerifier"""
+    def __init__(self, lm, verifier):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.verifier = verifier
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        self.verifier.check(self.model, prompt, messages, {**self.kwargs, **kwargs}, response)
+        return response
+
+
+class ReplayLM(dspy.BaseLM):
+    """
+    dspy LM answering from a Cassette instead of the API.
+
+    Args:
+        cassette: Cassette of a recorded run
+        model: Model name requests are matched with (default: the model of the recording)
+        zero_latency: Answer immediately instead of sleeping the recorded latency
+    """
+    def __init__(self, cassette, model=None, zero_latency=False):
+        super().__init__(model=model or cassette.model, model_type='chat', cache=False)
+        self.cassette = cassette
+        self.zero_latency = zero_latency
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        entry = self.cassette.next(request_key(self.model, prompt, messages))
+        if entry is None:
+            raise CassetteMiss(f"Request not recorded in {self.cassette.path}")
+        if not self.zero_latency:
+            time.sleep(entry['latency'])
+        response = ModelResponse(**entry['response'])
+        response._hidden_params['response_cost'] = entry['cost']
+        return response
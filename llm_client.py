@@ -0,0 +1,108 @@
+import os
+import dspy
+
+from .llm_cache import LLMCache, CachedLM
+from .llm_gate import InflightGate, GatedLM
+from .rate_control import RateController, RateControlledLM, RatePacedLM
+from .llm_retry import CircuitBreaker, RetryingLM
+from .llm_hedge import HedgedLM, RequestTimedLM
+from .llm_batch import BatchCollectorLM
+from .usage_ledger import LedgerLM
+from .llm_cassette import RecordingLM, VerifyingLM
+from .llm_sampling import SamplingLM
+
+MODEL = 'openai/gpt-4o-mini'
+# Sampling of a normal run, --deterministic overrides it per stage (see llm_sampling)
+SAMPLING = {'temperature': 1.0, 'max_tokens': 5000}
+
+
+def api_lm():
+    # dspy's own cache and litellm's retries are turned off, the wrappers in create_lm replace them
+    return dspy.LM(MODEL, api_key=os.environ['OPENAI_API_KEY'], cache=False, num_retries=0, **SAMPLING)
+
+
+def create_lm(cache_dir=None, cache_size_mb=2048, max_inflight=None, initial_inflight=None, rpm=None, tpm=None, adaptive=False, max_retries=5, hedge_percentile=None, hedge_max_ratio=0.1, ledger=None, backend=None, recorder=None, verifier=None, sampling=None):
+    """
+    Create the LM shared by formatting and every organ stage.
+
+    Args:
+        cache_dir: Directory of the persistent response cache (default: None, which disables caching)
+        cache_size_mb: Size bound of the response cache before LRU eviction
+        max_inflight: Maximum number of concurrent requests to the API (default: None, unlimited).
+            Cache hits do not count against it.
+        initial_inflight: Starting concurrency of the adaptive controller (default: max_inflight)
+        rpm, tpm: Requests / tokens per minute allowed by the deployment (default: None, unpaced)
+        adaptive: Let an AIMD controller move the concurrency between 1 and max_inflight
+            based on latency and 429/5xx responses
+        max_retries: Retries of a transient API error (timeout, 429, 5xx) before the call fails.
+            A circuit breaker pauses all calls while the provider keeps failing.
+        hedge_percentile: Send a duplicate request when a call is slower than this percentile of
+            its signature's latency (default: None, no hedging)
+        hedge_max_ratio: Maximum fraction of calls that may be hedged
+        ledger: UsageLedger that records every call (default: None, no per-call usage)
+        backend: LM that answers the requests (default: None, the OpenAI model of api_lm).
+            Benchmarks pass a FakeLM here to run the whole wrapper chain offline, --replay a ReplayLM.
+        recorder: CassetteRecorder that records every response of the backend (default: None)
+        verifier: CassetteVerifier that compares every response of the backend with a recording (default: None)
+        sampling: Sampling parameters per stage that override the backend's (default: None, see llm_sampling)
+    """
+    lm = backend if backend is not None else api_lm()
+    if recorder is not None:
+        # Innermost, so the recorded latency is the API's own and not the gate's queueing
+        lm = RecordingLM(lm, recorder)
+    if verifier is not None:
+        lm = VerifyingLM(lm, verifier)
+    if hedge_percentile is not None:
+        # Times the request itself for the hedger, without queueing, pacing or backoff
+        lm = RequestTimedLM(lm)
+
+    if max_inflight is not None:
+        gate = InflightGate(initial_inflight or max_inflight)
+        controller = RateController(gate, max_inflight, rpm=rpm, tpm=tpm, adaptive=adaptive) if adaptive or rpm or tpm else None
+        if controller is not None:
+            lm = RateControlledLM(lm, controller)
+        lm = GatedLM(lm, gate)
+        # Pacing and Retry-After pauses wait before a slot is taken, so they cannot block higher-priority calls
+        if controller is not None:
+            lm = RatePacedLM(lm, controller)
+
+    # Outside the gate, so backoff sleeps do not hold a slot
+    lm = RetryingLM(lm, CircuitBreaker(), max_retries=max_retries)
+
+    if hedge_percentile is not None:
+        lm = HedgedLM(lm, percentile=hedge_percentile, max_ratio=hedge_max_ratio)
+
+    if cache_dir is not None:
+        lm = CachedLM(lm, LLMCache(cache_dir, max_bytes=cache_size_mb * 1024 ** 2))
+
+    # Outside the cache, so the pinned parameters are part of the cache key
+    if sampling is not None:
+        lm = SamplingLM(lm, sampling)
+
+    # Outermost, so cache hits are recorded too
+    if ledger is not None:
+        lm = LedgerLM(lm, ledger)
+
+    return lm
+
+
+def create_batch_lm(cache_dir, cache_size_mb=2048, ledger=None, sampling=None):
+    """
+    Create the LM of a --batch-mode run: answers from the response cache and queues every other request
+    for the Batch API. Requests are rendered exactly like create_lm's, so both share the cache.
+    """
+    lm = BatchCollectorLM(api_lm(), LLMCache(cache_dir, max_bytes=cache_size_mb * 1024 ** 2))
+    if sampling is not None:
+        lm = SamplingLM(lm, sampling)
+    if ledger is not None:
+        lm = LedgerLM(lm, ledger)
+    return lm
+
+
+def find_layer(lm, cls):
+    """The wrapper of type cls in the chain built by create_lm, or None"""
+    while lm is not None:
+        if isinstance(lm, cls):
+            return lm
+        lm = getattr(lm, 'lm', None)
+    return None
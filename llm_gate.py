@@ -0,0 +1,83 @@
+import contextlib
+import heapq
+import itertools
+import threading
+
+import dspy
+
+from .call_context import current_call
+from .profiler import span
+
+# Lower runs first. Formatting feeds every organ, and lung / osseous_structure have the
+# longest classifier -> locator -> counter/onset chains, so they bound the wall time of a run
+STAGE_PRIORITY = {'format': 0, 'lung': 0, 'osseous_structure': 0}
+DEFAULT_PRIORITY = 1
+
+
+def call_priority(call):
+    """
+    Priority of an LLM call from its call context.
+    Critical-path organs first, then deeper links of a chain first, so started reports finish
+    (and free their worker) before new reports are opened.
+    """
+    stage = call.get('organ', call.get('stage'))
+    return (STAGE_PRIORITY.get(stage, DEFAULT_PRIORITY), -call.get('depth', 0))
+
+
+class InflightGate:
+    """
+    Single bounded pool of in-flight LLM requests shared by all stages, organs and workers.
+
+    When the pool is full, waiting requests are admitted in priority order (FIFO within a priority).
+    The limit can be changed while requests are running.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.inflight = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority=(DEFAULT_PRIORITY,)):
+        with self._condition:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            while self.inflight >= self.limit or self._waiting[0] is not entry:
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self.inflight += 1
+            # The next waiter may fit as well
+            self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self.inflight -= 1
+            self._condition.notify_all()
+
+    def set_limit(self, limit):
+        with self._condition:
+            self.limit = max(1, limit)
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, priority=(DEFAULT_PRIORITY,)):
+        with span('queue_wait', 'llm'):
+            self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class GatedLM(dspy.BaseLM):
+    """dspy LM that holds a slot of an InflightGate for the duration of every request to the wrapped LM"""
+    def __init__(self, lm, gate):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.gate = gate
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        with self.gate.slot(call_priority(current_call())):
+            with span('request', 'llm'):
+                return self.lm.forward(prompt=prompt, messages=messages, **kwargs)
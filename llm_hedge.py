@@ -0,0 +1,203 @@
+import collections
+import concurrent.futures
+import contextvars
+import hashlib
+import threading
+import time
+
+import dspy
+
+
+def signature_key(prompt, messages):
+    """Requests of the same signature share their system message (the rendered instructions and fields)"""
+    text = messages[0]['content'] if messages else prompt or ''
+    return hashlib.sha1(str(text).encode('utf-8')).hexdigest()
+
+
+class LatencyTracker:
+    """Latencies of the last `window` requests per signature"""
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, key, latency):
+        with self._lock:
+            self._samples[key].append(latency)
+
+    def percentile(self, key, q):
+        """q-th percentile of the signature's latency, None until min_samples were recorded"""
+        with self._lock:
+            samples = sorted(self._samples[key])
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+class RequestClock:
+    """
+    Running time of the current attempt of one request, kept by RequestTimedLM.
+    Only the time the API itself takes counts: gate queueing, rate pacing and retry backoff do not.
+    """
+    def __init__(self):
+        self.latency = None
+        self._started = None
+        self._finished = False
+        self._version = 0
+        self._condition = threading.Condition()
+
+    def _update(self, started=None, finished=False):
+        with self._condition:
+            if self._started is not None and started is None:
+                self.latency = time.monotonic() - self._started
+            self._started = started
+            self._finished = self._finished or finished
+            self._version += 1
+            self._condition.notify_all()
+
+    def start(self):
+        self._update(started=time.monotonic())
+
+    def stop(self):
+        self._update()
+
+    def finish(self):
+        self._update(finished=True)
+
+    def state(self):
+        """(version, seconds the current attempt has been running or None, finished)"""
+        with self._condition:
+            elapsed = None if self._started is None else time.monotonic() - self._started
+            return self._version, elapsed, self._finished
+
+    def wait(self, version, timeout=None):
+        """Block until the clock changes after version (an attempt starts or stops, the request finishes) or timeout"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != version, timeout)
+
+
+_request_clock = contextvars.ContextVar('request_clock', default=None)
+
+
+class RequestTimedLM(dspy.BaseLM):
+    """dspy LM that runs the RequestClock of the calling HedgedLM while the wrapped LM answers (innermost layer)"""
+    def __init__(self, lm):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        clock = _request_clock.get()
+        if clock is None:
+            return self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        clock.start()
+        try:
+            return self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        finally:
+            clock.stop()
+
+
+class HedgedLM(dspy.BaseLM):
+    """
+    dspy LM that sends a duplicate request when a call is slower than the `percentile`-th latency
+    of its signature, and returns whichever response arrives first.
+
+    Latency and the hedge timer come from the RequestClock of a RequestTimedLM inside the gate and the retries,
+    so calls that only wait for a slot (or a retry) are never hedged into an already congested gate.
+    At most max_ratio of all calls are hedged, so hedging cannot snowball when the API is slow for everyone.
+    The cost of the losing duplicates is tracked in extra_cost, apart from the regular cost.
+    """
+    def __init__(self, lm, percentile=95, max_ratio=0.1, max_workers=128):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.latencies = LatencyTracker()
+
+        self.calls = 0
+        self.hedged = 0
+        self.won = 0
+        self.extra_cost = 0.0
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+
+    def _submit(self, prompt, messages, kwargs, clock=None):
+        # Keep the call context (organ, report) so the scheduler still sees the request's priority
+        context = contextvars.copy_context()
+        context.run(_request_clock.set, clock)
+        return self._executor.submit(context.run, self.lm.forward, prompt=prompt, messages=messages, **kwargs)
+
+    def _count_extra(self, future):
+        if future.exception() is None:
+            cost = future.result()._hidden_params.get('response_cost') or 0.0
+            with self._lock:
+                self.extra_cost += cost
+
+    def _record(self, key, clock):
+        if clock.latency is not None:
+            self.latencies.record(key, clock.latency)
+
+    @staticmethod
+    def _slow(clock, threshold):
+        """True once an attempt has run for threshold seconds, False if the request finished first"""
+        while True:
+            version, elapsed, finished = clock.state()
+            if finished:
+                return False
+            if elapsed is not None and elapsed >= threshold:
+                return True
+            # Waiting for a slot or a retry does not count, only a running attempt
+            clock.wait(version, None if elapsed is None else threshold - elapsed)
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        key = signature_key(prompt, messages)
+        threshold = self.latencies.percentile(key, self.percentile)
+        with self._lock:
+            self.calls += 1
+
+        clock = RequestClock()
+        if threshold is None:
+            token = _request_clock.set(clock)
+            try:
+                response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+            finally:
+                _request_clock.reset(token)
+            self._record(key, clock)
+            return response
+
+        primary = self._submit(prompt, messages, kwargs, clock)
+        primary.add_done_callback(lambda f: clock.finish())
+        # Latency of single requests, whether or not a duplicate wins
+        primary.add_done_callback(lambda f: f.exception() is None and self._record(key, clock))
+
+        if not self._slow(clock, threshold):
+            return primary.result()
+
+        with self._lock:
+            allowed = self.hedged < self.max_ratio * self.calls
+            if allowed:
+                self.hedged += 1
+        if not allowed:
+            return primary.result()
+
+        hedge = self._submit(prompt, messages, kwargs)
+        error = None
+        for future in concurrent.futures.as_completed([primary, hedge]):
+            try:
+                response = future.result()
+            except Exception as e:
+                error = e
+                continue
+            # The other request is still paid for
+            loser = hedge if future is primary else primary
+            loser.add_done_callback(self._count_extra)
+            if future is hedge:
+                with self._lock:
+                    self.won += 1
+            return response
+        raise error
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'hedged': self.hedged, 'won': self.won, 'extra_cost': self.extra_cost}
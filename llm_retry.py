@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+
+import dspy
+
+from .rate_control import status_code, retry_after
+from .profiler import span
+
+
+def is_transient(exc):
+    """Timeouts, conflicts, 429 and 5xx are worth retrying; bad requests and parse errors are not"""
+    code = status_code(exc)
+    return code is not None and (code in (408, 409, 429) or code >= 500)
+
+
+class CircuitBreaker:
+    """
+    Pauses every LLM call during a provider outage.
+
+    After `threshold` consecutive transient failures the breaker opens and callers wait instead of
+    hammering the API. After `reset_timeout` seconds one trial call is let through: success closes
+    the breaker, failure opens it again.
+    """
+    def __init__(self, threshold=10, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._condition = threading.Condition()
+
+    def before_call(self):
+        with self._condition:
+            while True:
+                if self.state == 'closed':
+                    return
+                if self.state == 'open':
+                    wait = self._opened_at + self.reset_timeout - time.monotonic()
+                    if wait <= 0:
+                        # This caller is the trial call
+                        self.state = 'half_open'
+                        return
+                    self._condition.wait(wait)
+                else:
+                    # Wait for the outcome of the trial call
+                    self._condition.wait()
+
+    def on_success(self):
+        with self._condition:
+            if self.state != 'closed':
+                print("LLM provider is back, resuming.")
+            self.state = 'closed'
+            self._failures = 0
+            self._condition.notify_all()
+
+    def on_failure(self):
+        with self._condition:
+            self._failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self._failures >= self.threshold):
+                if self.state == 'closed':
+                    print(f"{self._failures} consecutive LLM failures, pausing for {self.reset_timeout:.0f}s.")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._condition.notify_all()
+
+
+class RetryingLM(dspy.BaseLM):
+    """
+    dspy LM that retries transient errors of the wrapped LM with jittered exponential backoff.
+
+    The delay before retry n is uniform in [0, min(max_delay, base_delay * 2**n)] ("full jitter"),
+    but never shorter than the Retry-After the API asked for.
+    """
+    def __init__(self, lm, breaker, max_retries=5, base_delay=1.0, max_delay=60.0):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.breaker.before_call()
+            try:
+                response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # The provider answered, only this request is bad
+                    self.breaker.on_success()
+                    raise
+                self.breaker.on_failure()
+                if attempt == self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                with span('backoff', 'llm'):
+                    time.sleep(max(delay, retry_after(e) or 0))
+                continue
+
+            self.breaker.on_success()
+            return response
@@ -0,0 +1,32 @@
+"""
+--deterministic: pinned sampling parameters per stage.
+
+The API model samples at temperature 1.0, so reruns disagree and the response cache rarely hits.
+A SamplingLM overrides the sampling parameters of every call with the ones of its stage. It sits outside
+the response cache, so the pinned parameters are part of every cache key.
+"""
+import dspy
+
+from .call_context import current_stage
+
+
+def deterministic_sampling(seed=0):
+    """Sampling parameters per stage: greedy decoding with a fixed seed (OpenAI's best-effort reproducibility)"""
+    greedy = {'temperature': 0.0, 'top_p': 1.0, 'seed': seed, 'max_tokens': 5000}
+    return {
+        'format': dict(greedy),
+        'organ': dict(greedy),
+    }
+
+
+class SamplingLM(dspy.BaseLM):
+    """dspy LM that sends every call with the sampling parameters of its stage ('default' outside any stage)"""
+    def __init__(self, lm, sampling):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.sampling = sampling
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        params = self.sampling.get(current_stage()) or self.sampling.get('default') or {}
+        return self.lm.forward(prompt=prompt, messages=messages, **{**kwargs, **params})
@@ -1,4 +1,5 @@
 import os
+import json
 import dspy
 import argparse
 import pandas as pd
@@ -10,16 +11,46 @@ from tqdm import tqdm
 
 # Import processing modules
 from .formatting.formatting_report import format_csv  # Assuming you've updated this with the parallel version
-from .create_csv.lung import lung_csv
+from .create_csv.lung import lung_csv, configure_lung_locator, LUNG_LOCATOR_MODES
 from .create_csv.large_airway import large_airway_csv
 from .create_csv.mediastinum import mediastinum_csv
 from .create_csv.heart_and_vessel import heart_and_vessel_csv
 from .create_csv.abdomen import abdomen_csv
 from .create_csv.osseous_structure import osseous_structure_csv
+from .pipeline import ReportStream
+from .llm_client import MODEL, SAMPLING, create_lm, create_batch_lm, find_layer
+from .llm_cassette import CassetteRecorder, CassetteVerifier, Cassette, ReplayLM
+from .llm_sampling import deterministic_sampling
+from .negative_sections import configure_negative_sections, load_patterns, skipped_stats
+from .prefilter import configure_prefilter, audit as audit_prefilter, print_audit, skipped_stats as prefilter_skipped_stats
+from .rule_locator import configure_rule_locator, rule_locator_stats
+from .llm_batch import BatchRunner, BatchAdapter, BatchCollectorLM
+from .llm_cache import CachedLM
+from .llm_hedge import HedgedLM
+from .prompt.parallel import configure_executor
+from .rate_control import log_to as log_rate_control_to
+from .planner import ORGAN_PLAN, plan_run, print_plan
+from .usage_ledger import UsageLedger
+from .profiler import start_profiling, stop_profiling, span
 
 # Import evaluation
 from .f1_calculator import calculate_organ_f1
 
+# Organ name -> CSV builder
+ORGAN_CSV = {
+    'lung': lung_csv,
+    'large_airway': large_airway_csv,
+    'mediastinum': mediastinum_csv,
+    'heart_and_vessel': heart_and_vessel_csv,
+    'abdomen': abdomen_csv,
+    'osseous_structure': osseous_structure_csv,
+}
+
+
+def write_metadata(path, metadata):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=4, ensure_ascii=False)
+
 
 # Create async wrapper for each processing function
 async def async_process(func, *args):
@@ -41,61 +72,228 @@ async def main_async():
     parser.add_argument('--output', type=str, required=False, default=f'{base_path}/result/output/{args.exp}', help='Output root path')
     parser.add_argument('--gt', type=str, required=False, default=f'{base_path}/result/ground_truth', help='Ground truth directory path')
     
-    parser.add_argument('--format_workers', type=int, required=False, default=None, help='Number of workers for formatting')
-    parser.add_argument('--csv_workers', type=int, required=False, default=6, help='Number of workers for CSV creation')
+    parser.add_argument('--format_workers', type=int, required=False, default=None, help='Number of workers for formatting (default: --max_inflight)')
+    parser.add_argument('--fused_format', action='store_true', default=False, help='Extract all six organ sections with one LLM call per report')
+    parser.add_argument('--csv_workers', type=int, required=False, default=6, help='Number of reports processed concurrently by each organ CSV builder')
+    parser.add_argument('--classifier_workers', type=int, required=False, default=None, help='Size of the thread pool shared by the disease classifier calls of all organs (default: --max_inflight)')
+    
+    parser.add_argument('--max_inflight', type=int, required=False, default=32, help='Maximum number of concurrent LLM requests across all stages and organs')
+    parser.add_argument('--initial_inflight', type=int, required=False, default=8, help='Concurrency the adaptive controller starts from')
+    parser.add_argument('--rpm', type=int, required=False, default=None, help='Requests per minute allowed by the OpenAI deployment')
+    parser.add_argument('--tpm', type=int, required=False, default=None, help='Tokens per minute allowed by the OpenAI deployment')
+    parser.add_argument('--no-adaptive', action='store_false', dest='adaptive', default=True, help='Keep concurrency fixed at --max_inflight instead of adapting it to latency and 429/5xx responses')
+    
+    parser.add_argument('--negative_patterns', type=str, required=False, default=None, help='File of negative section texts (one per line) whose organ gets an all-zero row without LLM calls (default: "No relevant findings." and the like)')
+    parser.add_argument('--no-negative-fast-path', action='store_false', dest='negative_fast_path', default=True, help='Run the disease classifiers on negative sections too')
+    
+    parser.add_argument('--prefilter', action='store_true', default=False, help='Call a disease classifier only when its section mentions one of its trigger terms outside a negation (others are labeled 0)')
+    parser.add_argument('--prefilter-audit', action='store_true', dest='prefilter_audit', default=False, help='Print how many ground-truth positives (--gt) the prefilter would skip, without calling the API')
+    parser.add_argument('--lung_locator', type=str, choices=LUNG_LOCATOR_MODES, default='chain', help='Lung localization: chain (Locator_RL -> lobe locators -> Counter per disease), fused (one call per positive disease) or fused_all (one call per report)')
+    parser.add_argument('--lung_locator_compare', action='store_true', default=False, help='After the evaluation, rebuild lung.csv with the other --lung_locator modes and compare their lung F1')
+    parser.add_argument('--rule_locator', action='store_true', default=False, help='Parse plain locations (right 5th rib, T7-T9, RUL, left adrenal) without the LLM locator; unclear ones still go to the LLM')
+    
+    parser.add_argument('--pipeline', action='store_true', default=False, help='Start organ extraction on each report as soon as it is formatted')
+    parser.add_argument('--pipeline_queue_size', type=int, required=False, default=64, help='Maximum number of formatted reports buffered per organ in pipelined mode')
+    
+    parser.add_argument('--resume', action='store_true', default=False, help='Resume an interrupted run, skipping reports that were already processed')
+    parser.add_argument('--retry-failed', action='store_true', dest='retry_failed', default=False, help='Only reprocess the reports dead-lettered (*_failed.jsonl) by a previous run')
+    parser.add_argument('--hedge_percentile', type=float, required=False, default=None, help='Send a duplicate LLM request when a call is slower than this latency percentile of its signature (e.g. 95)')
+    parser.add_argument('--hedge_max_ratio', type=float, required=False, default=0.1, help='Maximum fraction of LLM calls that may be hedged')
+    parser.add_argument('--max_retries', type=int, required=False, default=5, help='Retries of a transient LLM error (timeout, 429, 5xx) before the report is dead-lettered')
+    
+    parser.add_argument('--cache-dir', type=str, required=False, default=f'{base_path}/result/cache', dest='cache_dir', help='Directory of the persistent LLM response cache')
+    parser.add_argument('--cache-size-mb', type=int, required=False, default=2048, dest='cache_size_mb', help='Size bound of the LLM response cache')
+    parser.add_argument('--no-cache', action='store_false', dest='cache', default=True, help='Disable the LLM response cache')
+    
+    parser.add_argument('--batch-mode', action='store_true', dest='batch_mode', default=False, help='Run every LLM call through the OpenAI Batch API, one batch round per dependent stage (offline bulk runs)')
+    parser.add_argument('--batch-base-url', type=str, required=False, default=None, dest='batch_base_url', help='Base URL of the Batch API (e.g. a local fake endpoint for testing)')
+    parser.add_argument('--batch-poll-interval', type=float, required=False, default=60.0, dest='batch_poll_interval', help='Seconds between batch status checks')
+    
+    parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False, help='Print the projected calls, tokens, cost and wall time of the run without calling the API')
+    parser.add_argument('--max-cost', type=float, required=False, default=None, dest='max_cost', help='Refuse to start a run whose projected cost exceeds this many dollars')
+    parser.add_argument('--call_latency', type=float, required=False, default=3.0, help='Seconds per LLM call assumed by the wall time projection')
+    
+    parser.add_argument('--profile', action='store_true', default=False, help='Record stage, report and LLM call spans to trace.json (chrome://tracing / Perfetto) and print latency percentiles per signature')
+    
+    parser.add_argument('--record', type=str, required=False, default=None, help='Record every LLM request and response of the run to this cassette file (.jsonl.gz)')
+    parser.add_argument('--replay', type=str, required=False, default=None, help='Answer every LLM request from this cassette instead of the API')
+    parser.add_argument('--replay-zero-latency', action='store_true', dest='replay_zero_latency', default=False, help='Answer replayed requests immediately instead of with their recorded latency')
+    
+    parser.add_argument('--deterministic', action='store_true', default=False, help='Pin temperature 0, top_p 1 and --seed for every stage, so reruns and the response cache agree')
+    parser.add_argument('--seed', type=int, required=False, default=0, help='Sampling seed of a --deterministic run')
+    parser.add_argument('--verify', type=str, required=False, default=None, help='Compare every LLM response with the one recorded in this cassette and report the mismatches')
     
     parser.add_argument('--no-eval', action='store_false', dest='eval', default=True, help='Skip evaluation when specified')
     
     args = parser.parse_args()
     
-    # OpenAI setup
-    load_dotenv()
-    api_key = os.getenv('OPENAI_API_KEY')
+    configure_negative_sections(load_patterns(args.negative_patterns) if args.negative_patterns else None, enabled=args.negative_fast_path)
+    configure_prefilter(args.prefilter)
+    configure_rule_locator(args.rule_locator)
+    configure_lung_locator(args.lung_locator)
     
-    if api_key is None:
-        raise ValueError("Please set the OPENAI_API_KEY environment variable.")
+    if args.prefilter_audit:
+        print_audit(audit_prefilter(args.gt, [classifier for classifier, _ in ORGAN_PLAN.values()]))
+        return
     
-    os.environ['OPENAI_API_KEY'] = api_key
-    lm = dspy.LM('openai/gpt-4o-mini', api_key=os.environ['OPENAI_API_KEY'], temperature=1.0, max_tokens=5000)
-
-    dspy.configure(lm=lm)
+    # Pre-flight projection, before any API key or LLM is needed
+    if args.dry_run or args.max_cost is not None:
+        plan_df = pd.read_csv(args.input)
+        rows = plan_run(plan_df, args.gt, fused=args.fused_format, lung_locator=args.lung_locator, rule_locator=args.rule_locator)
+        projected_cost = print_plan(rows, len(plan_df), args.max_inflight, args.call_latency, rpm=args.rpm, tpm=args.tpm, batch_mode=args.batch_mode)
+        if args.max_cost is not None and projected_cost > args.max_cost:
+            raise SystemExit(f"Projected cost ${projected_cost:.2f} exceeds --max-cost ${args.max_cost:.2f}.")
+        if args.dry_run:
+            return
+    
+    if (args.record or args.replay or args.verify) and args.batch_mode:
+        raise ValueError("--record / --replay / --verify do not support --batch-mode.")
+    if args.lung_locator_compare and (args.batch_mode or not args.eval):
+        raise ValueError("--lung_locator_compare needs the evaluation and does not support --batch-mode.")
+    if args.replay and (args.record or args.verify):
+        raise ValueError("--replay never calls the API, it cannot be combined with --record or --verify.")
+    if (args.record or args.replay or args.verify) and args.cache:
+        # Cache hits would never reach the cassette, and would hide the replayed latencies
+        print("Recording / replaying / verifying without the LLM response cache.")
+        args.cache = False
+    
+    # OpenAI setup (a replay never calls the API)
+    if not args.replay:
+        load_dotenv()
+        api_key = os.getenv('OPENAI_API_KEY')
+        
+        if api_key is None:
+            raise ValueError("Please set the OPENAI_API_KEY environment variable.")
+        
+        os.environ['OPENAI_API_KEY'] = api_key
     
     # Create directories
     os.makedirs(args.format, exist_ok=True)
     os.makedirs(args.output, exist_ok=True)
     
+    # Concurrency decisions go to the output folder, for tuning RPM/TPM per deployment
+    log_rate_control_to(f"{args.output}/rate_control.log")
+    # A retry run continues from the journals, so only dead-lettered (or unfinished) reports are processed
+    resume = args.resume or args.retry_failed
+    # Usage of every LLM call, streamed to disk instead of kept in lm.history
+    ledger = UsageLedger(f"{args.output}/usage.jsonl", resume=resume)
+    sampling = deterministic_sampling(args.seed) if args.deterministic else None
+    # What produced the outputs, so experiments can be compared and prior results reused
+    metadata = {
+        'model': MODEL,
+        'deterministic': args.deterministic,
+        'sampling': sampling or {'default': SAMPLING},
+        'args': vars(args),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    write_metadata(f"{args.output}/run_metadata.json", metadata)
+    if args.batch_mode:
+        # Batch responses are handed to the stages through the response cache
+        if not args.cache:
+            raise ValueError("--batch-mode needs the LLM response cache, remove --no-cache.")
+        lm = create_batch_lm(args.cache_dir, cache_size_mb=args.cache_size_mb, ledger=ledger, sampling=sampling)
+    else:
+        recorder = CassetteRecorder(args.record) if args.record else None
+        verifier = CassetteVerifier(Cassette(args.verify), f"{args.output}/verify_mismatches.jsonl") if args.verify else None
+        cassette = Cassette(args.replay) if args.replay else None
+        if cassette is not None:
+            print(f"Replaying {len(cassette)} recorded LLM calls from {args.replay}")
+        lm = create_lm(
+            cache_dir=args.cache_dir if args.cache else None, cache_size_mb=args.cache_size_mb,
+            max_inflight=args.max_inflight, initial_inflight=args.initial_inflight if args.adaptive else None,
+            rpm=args.rpm, tpm=args.tpm, adaptive=args.adaptive, max_retries=args.max_retries,
+            hedge_percentile=args.hedge_percentile, hedge_max_ratio=args.hedge_max_ratio, ledger=ledger,
+            backend=ReplayLM(cassette, zero_latency=args.replay_zero_latency) if cassette else None,
+            recorder=recorder, verifier=verifier, sampling=sampling,
+        )
+
+    # Spans go to the output folder, the dspy callback names every Predict call by its signature
+    callbacks = [start_profiling(f"{args.output}/trace.json")] if args.profile else []
+    dspy.configure(lm=lm, adapter=BatchAdapter() if args.batch_mode else None, disable_history=True, callbacks=callbacks)
+    # Pools only need to be large enough to keep the gate busy, the gate decides what runs
+    configure_executor(args.classifier_workers or args.max_inflight)
+    format_workers = args.format_workers or args.max_inflight
+    
     # Read input data
     report_df = pd.read_csv(args.input)
     
-    # Format reports with parallel processing
-    print("Starting report formatting...")
-    start_time = time.time()
-    
-    format_df = format_csv(f"{args.format}/format.csv", report_df, max_workers=args.format_workers)
-    
-    end_time = time.time()
-    print(f"Formatting completed in {end_time - start_time:.2f} seconds.")
-    
-    # Create CSV files in parallel
-    print("Starting CSV creation...")
-    start_time = time.time()
-    
-    # Define tasks to run in parallel using async
-    tasks = [
-        async_process(lung_csv, f"{args.output}/lung.csv", format_df),
-        async_process(large_airway_csv, f"{args.output}/large_airway.csv", format_df),
-        async_process(mediastinum_csv, f"{args.output}/mediastinum.csv", format_df),
-        async_process(heart_and_vessel_csv, f"{args.output}/heart_and_vessel.csv", format_df),
-        async_process(abdomen_csv, f"{args.output}/abdomen.csv", format_df),
-        async_process(osseous_structure_csv, f"{args.output}/osseous_structure.csv", format_df)
-    ]
-    
-    # Create a progress bar to track completion
-    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Creating CSV files"):
-        await task
+    async def run_sequential(resume, retry_failed):
+        # Format reports with parallel processing
+        print("Starting report formatting...")
+        start_time = time.time()
+        
+        format_df = format_csv(f"{args.format}/format.csv", report_df, max_workers=format_workers, fused=args.fused_format, lm=lm, resume=resume, retry_failed=retry_failed)
+        
+        end_time = time.time()
+        print(f"Formatting completed in {end_time - start_time:.2f} seconds.")
+        
+        # Create CSV files in parallel
+        print("Starting CSV creation...")
+        start_time = time.time()
+        
+        # Define tasks to run in parallel using async
+        tasks = [
+            async_process(func, f"{args.output}/{organ}.csv", format_df, resume, args.csv_workers)
+            for organ, func in ORGAN_CSV.items()
+        ]
+        
+        # Create a progress bar to track completion
+        with span('csv_creation', 'stage'):
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Creating CSV files"):
+                await task
+        
+        end_time = time.time()
+        print(f"CSV creation completed in {end_time - start_time:.2f} seconds.")
     
-    end_time = time.time()
-    print(f"CSV creation completed in {end_time - start_time:.2f} seconds.")
+    if args.batch_mode:
+        # Every round answers what the previous batch returned and queues the next link of each chain
+        print("Starting batch mode...")
+        start_time = time.time()
+        
+        collector = find_layer(lm, BatchCollectorLM)
+        runner = BatchRunner(collector, f"{args.output}/batch", base_url=args.batch_base_url, poll_interval=args.batch_poll_interval)
+        while True:
+            first_round = runner.rounds == 0
+            await run_sequential(resume or not first_round, args.retry_failed and first_round)
+            requests = collector.take_pending()
+            if not requests:
+                break
+            runner.run(requests)
+        
+        end_time = time.time()
+        print(f"Batch mode completed in {runner.rounds} rounds, {end_time - start_time:.2f} seconds. Batch cost: {runner.cost}")
+        metadata['batch'] = {'rounds': runner.rounds, 'cost': runner.cost}
+    elif args.pipeline:
+        # Formatting and CSV creation run concurrently, connected by bounded per-organ streams
+        print("Starting pipelined formatting and CSV creation...")
+        start_time = time.time()
+        
+        streams = {organ: ReportStream(maxsize=args.pipeline_queue_size) for organ in ORGAN_CSV}
+        
+        # Every stage needs its own thread, otherwise a full stream would never be drained
+        asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=len(ORGAN_CSV) + 1))
+        
+        def format_stage():
+            try:
+                return format_csv(f"{args.format}/format.csv", report_df, max_workers=format_workers, fused=args.fused_format, streams=list(streams.values()), lm=lm, resume=resume, retry_failed=args.retry_failed)
+            finally:
+                # Organ builders would wait forever if formatting failed before closing the streams
+                for stream in streams.values():
+                    stream.close()
+        
+        tasks = [async_process(format_stage)]
+        tasks += [
+            async_process(func, f"{args.output}/{organ}.csv", streams[organ], resume, args.csv_workers)
+            for organ, func in ORGAN_CSV.items()
+        ]
+        
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Pipelined stages"):
+            await task
+        
+        end_time = time.time()
+        print(f"Formatting and CSV creation completed in {end_time - start_time:.2f} seconds.")
+    else:
+        await run_sequential(resume, args.retry_failed)
     
     # 평가 수행 (--no-eval 옵션이 없는 경우)
     if args.eval:
@@ -106,10 +304,29 @@ async def main_async():
         metrics_path = f"{args.output}/metrics.json"
         
         # F1 계산 실행
-        calculate_organ_f1(args.output, args.gt, metrics_path)
+        results = calculate_organ_f1(args.output, args.gt, metrics_path)
         
         end_time = time.time()
         print(f"Evaluation completed in {end_time - start_time:.2f} seconds.")
+        
+        # 같은 format.csv로 다른 lung locator mode의 lung.csv를 만들어 F1 비교
+        if args.lung_locator_compare:
+            lung_f1 = {args.lung_locator: results['lung']['f1_score']}
+            format_df = pd.read_csv(f"{args.format}/format.csv")
+            for mode in LUNG_LOCATOR_MODES:
+                if mode == args.lung_locator:
+                    continue
+                configure_lung_locator(mode)
+                mode_dir = f"{args.output}/lung_locator_{mode}"
+                os.makedirs(mode_dir, exist_ok=True)
+                lung_csv(f"{mode_dir}/lung.csv", format_df, workers=args.csv_workers)
+                lung_f1[mode] = calculate_organ_f1(mode_dir, args.gt, f"{mode_dir}/metrics.json")['lung']['f1_score']
+            configure_lung_locator(args.lung_locator)
+            metadata['lung_locator_f1'] = lung_f1
+            print("Lung F1 per --lung_locator mode:")
+            for mode, score in lung_f1.items():
+                # lung.csv나 GT 컬럼이 없으면 f1_score는 None
+                print(f"  {mode}: {'n/a' if score is None else f'{score:.4f}'}")
     else:
         print("\nEvaluation skipped.")
     
@@ -117,8 +334,54 @@ async def main_async():
     end_time_total = time.time()
     print(f"Total processing time: {end_time_total - start_time_total:.2f} seconds")
     
-    cost = sum([x['cost'] for x in lm.history if x['cost'] is not None])
-    print("Total OpenAI cost:", cost)
+    ledger.close()
+    usage = ledger.write_summary(f"{args.output}/usage_summary.json")
+    for group in ['by_stage', 'by_organ']:
+        for key, totals in usage[group].items():
+            if key != 'None':
+                print(f"  {key}: {totals['calls']} calls, cost {totals['cost']:.4f}, mean latency {totals['mean_latency']:.2f}s")
+    print("Total OpenAI cost:", usage['total']['cost'])
+    
+    hedger = find_layer(lm, HedgedLM)
+    if hedger is not None:
+        stats = hedger.stats()
+        print(f"Hedged requests: {stats['hedged']} of {stats['calls']} calls, {stats['won']} won by the duplicate, extra cost {stats['extra_cost']}")
+    
+    if args.record:
+        recorder.close()
+        print(f"Recorded {recorder.calls} LLM calls to {args.record}")
+    if args.replay:
+        stats = cassette.stats()
+        print(f"Cassette: {stats['served']} calls replayed, {stats['misses']} requests not recorded")
+    if args.verify:
+        verifier.close()
+        metadata['verification'] = verifier.stats()
+        print(f"Verification: {metadata['verification']['matched']} responses identical to {args.verify}, "
+              f"{metadata['verification']['mismatched']} different (see verify_mismatches.jsonl), {metadata['verification']['unrecorded']} not recorded")
+    metadata['negative_fast_path'] = skipped_stats()
+    if metadata['negative_fast_path']:
+        print(f"Negative fast path: {sum(stats['calls'] for stats in metadata['negative_fast_path'].values())} classifier calls skipped")
+        for organ, stats in metadata['negative_fast_path'].items():
+            print(f"  {organ}: {stats['reports']} negative sections, {stats['calls']} calls skipped")
+    if args.prefilter:
+        metadata['prefilter'] = prefilter_skipped_stats()
+        print(f"Prefilter: {sum(metadata['prefilter'].values())} classifier calls skipped")
+        for organ, calls in metadata['prefilter'].items():
+            print(f"  {organ}: {calls} calls skipped")
+    if args.rule_locator:
+        metadata['rule_locator'] = rule_locator_stats()
+        print(f"Rule locator: {sum(stats['rule'] for stats in metadata['rule_locator'].values())} locator calls answered by rule")
+        for name, stats in metadata['rule_locator'].items():
+            print(f"  {name}: {stats['rule']} by rule, {stats['llm']} by the LLM")
+    metadata['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    write_metadata(f"{args.output}/run_metadata.json", metadata)
+    
+    if args.cache:
+        stats = find_layer(lm, CachedLM).response_cache.stats()
+        print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+    
+    if args.profile:
+        stop_profiling(f"{args.output}/profile.txt")
 
 def main():
     # Run the async main function
@@ -0,0 +1,75 @@
+"""
+Negative-section fast path of the organ builders.
+
+Formatting writes "No relevant findings." for an organ without observations. Such a section (or an empty one)
+cannot contain any finding, so the builders write an all-zero row for it instead of running the disease classifiers.
+Sections are compared after lower-casing and dropping punctuation and repeated whitespace.
+"""
+import collections
+import re
+import threading
+
+import pandas as pd
+
+DEFAULT_PATTERNS = [
+    'No relevant findings.',
+    'No relevant finding.',
+    'None.',
+    'N/A',
+]
+
+_patterns = None
+_enabled = True
+_skipped = collections.defaultdict(lambda: {'reports': 0, 'calls': 0})
+_lock = threading.Lock()
+
+
+def normalize_section(text):
+    if text is None or (isinstance(text, float) and pd.isna(text)):
+        return ''
+    return ' '.join(re.sub(r'[^\w\s]', ' ', str(text).lower()).split())
+
+
+def configure_negative_sections(patterns=None, enabled=True):
+    """Set the negative patterns (default: DEFAULT_PATTERNS) or turn the fast path off"""
+    global _patterns, _enabled
+    with _lock:
+        _patterns = {normalize_section(pattern) for pattern in (patterns or DEFAULT_PATTERNS)}
+        _enabled = enabled
+
+
+def load_patterns(path):
+    """Patterns from a text file, one per line"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def is_negative_section(text):
+    if _patterns is None:
+        configure_negative_sections()
+    normalized = normalize_section(text)
+    return normalized == '' or normalized in _patterns
+
+
+def fast_path_applies(text):
+    """True if the builders skip this section (the fast path is on and the section is negative)"""
+    return _enabled and is_negative_section(text)
+
+
+def skip_negative(organ, report, classifier):
+    """
+    True if the organ section is negative and the builder should keep the all-zero row.
+    Counts the report and the disease classifier calls it saves.
+    """
+    if not fast_path_applies(report):
+        return False
+    with _lock:
+        _skipped[organ]['reports'] += 1
+        _skipped[organ]['calls'] += len(classifier.predictors())
+    return True
+
+
+def skipped_stats():
+    """{organ: {'reports', 'calls'}} skipped by the fast path so far"""
+    with _lock:
+        return {organ: dict(stats) for organ, stats in _skipped.items()}
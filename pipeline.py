@@ -0,0 +1,109 @@
+import concurrent.futures
+import queue
+
+from tqdm import tqdm
+
+from .call_context import call_context
+from .journal import failure_record
+from .llm_batch import BatchPending
+from .profiler import span
+
+# 스트림 종료 표시
+_END = object()
+
+
+class ReportStream:
+    """
+    Bounded queue of formatted report rows, consumed by one organ builder.
+
+    format_csv puts each row as soon as it is formatted and closes the stream when done.
+    put() blocks while the queue is full, so a slow organ applies backpressure to formatting.
+    """
+    def __init__(self, maxsize=64):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._abandoned = False
+        self._closed = False
+
+    def put(self, row):
+        # Stop blocking if the consumer died, otherwise the producer would wait forever
+        while not self._abandoned:
+            try:
+                self._queue.put(row, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.put(_END)
+
+    def __iter__(self):
+        try:
+            while True:
+                row = self._queue.get()
+                if row is _END:
+                    return
+                yield row
+        finally:
+            self._abandoned = True
+
+
+def iter_reports(reports):
+    """Yield report rows from a DataFrame or a ReportStream"""
+    if hasattr(reports, 'iterrows'):
+        for _, row in reports.iterrows():
+            yield row
+    else:
+        yield from reports
+
+
+def process_reports(process, reports, workers=1, done=(), dead_letter=None, **context):
+    """
+    Call process(row) for every report row whose id is not in done, up to `workers` rows at a time.
+
+    Rows are pulled only when a worker is free, so a ReportStream keeps applying backpressure.
+    Every LLM call made for a row carries the row's report_id and the given context (e.g. organ='lung').
+    A row whose process raises (after the LLM retries) is appended to dead_letter and skipped;
+    without a dead_letter the exception stops the run. A row waiting for a batch response
+    (batch mode) is skipped until the next round.
+
+    Returns the set of ids without a result (failed or waiting for a batch).
+    """
+    rows = (row for row in iter_reports(reports) if row['id'] not in done)
+    stage = context.get('organ', context.get('stage'))
+    failed = set()
+
+    def run(row):
+        with call_context(report_id=row['id'], **context), span('report', 'report', id=row['id'], stage=stage):
+            try:
+                process(row)
+                if dead_letter is not None:
+                    dead_letter.discard(row['id'])
+            except BatchPending:
+                failed.add(row['id'])
+            except Exception as e:
+                if dead_letter is None:
+                    raise
+                print(f"{stage} report {row['id']} failed: {e}")
+                dead_letter.append(failure_record(row['id'], stage, e))
+                failed.add(row['id'])
+
+    # Organ span in --profile mode
+    with span(stage, 'stage'):
+        if workers <= 1:
+            for row in tqdm(rows):
+                run(row)
+            return failed
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report') as executor:
+            pending = set()
+            for row in tqdm(rows):
+                if len(pending) >= workers:
+                    finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                pending.add(executor.submit(run, row))
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+    return failed
@@ -0,0 +1,271 @@
+"""
+Pre-flight planner for --dry-run: projects the calls, tokens, cost and wall time of a run without calling the API.
+
+Prompt tokens are counted offline on the prompts the ChatAdapter renders for every signature.
+Calls per report follow the conditional structure of the organ builders in create_csv/: the disease
+classifiers always run, the locator / counter / onset calls run with the positive rates of the
+ground-truth CSVs. Completion tokens are estimates (see the constants below).
+"""
+import os
+
+import dspy
+import litellm
+import pandas as pd
+
+from .llm_client import MODEL
+from .llm_batch import BATCH_DISCOUNT
+from .negative_sections import fast_path_applies
+from .prefilter import prefilter_allows
+from .formatting import formatting_prompt
+from .prompt import lung_prompt, large_airway_prompt, mediastinum_prompt, heart_and_vessel_prompt, abdomen_prompt, osseous_structure_prompt
+
+# Completion token estimates: ChainOfThought reasoning, one [[ ## field ## ]] block, an extracted lesion sentence
+REASONING_TOKENS = 120
+FIELD_TOKENS = 10
+LESION_SENTENCE_TOKENS = 40
+
+FORMAT_SIGNATURES = [
+    formatting_prompt.Extract_LungParenchyma,
+    formatting_prompt.Extract_Airways,
+    formatting_prompt.Extract_Mediastinum,
+    formatting_prompt.Extract_HeartAndGreatVessels,
+    formatting_prompt.Extract_Abdomen,
+    formatting_prompt.Extract_OsseousStructures,
+]
+
+# Locators that --rule_locator answers from a parser when it is confident (see rule_locator.py)
+RULE_LOCATED = {
+    lung_prompt.Locator_RL, lung_prompt.Locator_Left_Lobes, lung_prompt.Locator_Right_Lobes,
+    large_airway_prompt.Locator_Endobronchial_Mass, abdomen_prompt.Locator_Kidney_RL, abdomen_prompt.Locator_adrenal_RL,
+    osseous_structure_prompt.Locator_Rib_Fracture, osseous_structure_prompt.Locator_Vertebrae_Fracture,
+}
+
+LUNG_DISEASES = ['Nodule', 'Mass', 'Pleural Effusion', 'Consolidation', 'Atelectasis', 'Pneumothorax', 'Ground Glass Opacity', 'Emphysema', 'Mosaic Attenuation', 'Bronchiectasis', 'Interlobular Septal Thickening']
+RIBS = [f'{side}_{n}' for side in ['right', 'left'] for n in range(1, 13)]
+RIB_COLUMNS = [f'Rib_Fracture_{rib}_presence' for rib in RIBS + ['unspecified']]
+
+
+def _lung_steps(lung_locator='chain'):
+    presence = [f'{disease}_presence' for disease in LUNG_DISEASES]
+    if lung_locator == 'fused':
+        return [(lung_prompt.Locator_Lung_Finding, [f'{disease}_presence']) for disease in LUNG_DISEASES]
+    if lung_locator == 'fused_all':
+        # One call per report: per disease for a single positive disease, fused for several
+        return [(lung_prompt.Locator_Lung_Finding, presence, (1, 1)), (lung_prompt.Locator_Lung_Findings, presence, (2, None))]
+    steps = []
+    for disease in LUNG_DISEASES:
+        steps.append((lung_prompt.Locator_RL, [f'{disease}_presence']))
+        steps.append((lung_prompt.Locator_Left_Lobes, [f'{disease}_lul', f'{disease}_lll', f'{disease}_left_unspecified']))
+        steps.append((lung_prompt.Locator_Right_Lobes, [f'{disease}_rul', f'{disease}_rml', f'{disease}_rll', f'{disease}_right_unspecified']))
+        if disease in ['Nodule', 'Mass']:
+            steps.append((lung_prompt.Counter, [f'{disease}_presence']))
+    return steps
+
+
+# organ -> (disease classifier module, [(conditional signature, ground-truth columns of which any being 1 triggers the call[, (min, max) positive columns])])
+ORGAN_PLAN = {
+    'lung': (lung_prompt.Lung_Disease_Classifier, _lung_steps()),
+    'large_airway': (large_airway_prompt.Large_Airway_Disease_Classifier, [
+        (large_airway_prompt.Locator_Endobronchial_Mass, ['Endobronchial_Mass_presence']),
+    ]),
+    'mediastinum': (mediastinum_prompt.Mediastinum_Disease_Classifier, [
+        (mediastinum_prompt.Locator_Mediastinal_Mass, ['Mediastinal_Mass_presence']),
+        (mediastinum_prompt.Locator_Lymphadenopathy, ['Lymphadenopathy_presence']),
+        (mediastinum_prompt.Counter_Esophageal_Mass, ['Esophageal_Mass_presence']),
+    ]),
+    'heart_and_vessel': (heart_and_vessel_prompt.Heart_and_Vessel_Disease_Classifier, [
+        (heart_and_vessel_prompt.Locator_Pulmonary_Embolism, ['Pulmonary_Embolism_presence']),
+    ]),
+    'abdomen': (abdomen_prompt.Abdomen_Disease_Classifier, [
+        (abdomen_prompt.Locator_Kidney_RL, ['Kidney_Cyst_presence']),
+        (abdomen_prompt.Counter_Kidneycyst, ['Kidney_Cyst_presence']),
+        (abdomen_prompt.Locator_adrenal_RL, ['Adrenal_Mass_presence']),
+        (abdomen_prompt.Counter_Livercyst, ['Liver_Cyst_presence']),
+    ]),
+    'osseous_structure': (osseous_structure_prompt.Osseous_Structure_Disease_Classifier, [
+        (osseous_structure_prompt.Locator_Rib_Fracture, ['Rib_Fracture_presence']),
+        (osseous_structure_prompt.Locator_Vertebrae_Fracture, ['Vertebrae_Fracture_presence']),
+        # One onset call per report: per rib for a single located rib, batched for several
+        (osseous_structure_prompt.Onset_Rib_Fracture, RIB_COLUMNS, (1, 1)),
+        (osseous_structure_prompt.Onset_Rib_Fractures, RIB_COLUMNS, (2, None)),
+    ]),
+}
+
+
+def count_tokens(text):
+    try:
+        return litellm.token_counter(model=MODEL, text=text)
+    except Exception:
+        # No tokenizer available offline: ~4 characters per token
+        return len(text) // 4 + 1
+
+
+def template_tokens(signature):
+    """Prompt tokens of a signature with empty inputs: instructions, field descriptions and markers"""
+    messages = dspy.ChatAdapter().format(signature, demos=[], inputs={name: '' for name in signature.input_fields})
+    try:
+        return litellm.token_counter(model=MODEL, messages=messages)
+    except Exception:
+        return sum(count_tokens(message['content']) for message in messages)
+
+
+def completion_tokens(signature, text_tokens):
+    """Estimated completion tokens: text outputs are text_tokens long, the others a single token"""
+    tokens = 0
+    for name, field in signature.output_fields.items():
+        if name == 'reasoning':
+            tokens += FIELD_TOKENS + REASONING_TOKENS
+        elif field.annotation is str:
+            tokens += FIELD_TOKENS + text_tokens
+        else:
+            tokens += FIELD_TOKENS + 1
+    return tokens
+
+
+def call_tokens(signature, text_tokens, output_tokens):
+    """(prompt tokens, completion tokens) of one ChainOfThought call whose text inputs are text_tokens long"""
+    signature = dspy.ChainOfThought(signature).predict.signature
+    n_text_inputs = sum(1 for field in signature.input_fields.values() if field.annotation is str)
+    return template_tokens(signature) + n_text_inputs * text_tokens, completion_tokens(signature, output_tokens)
+
+
+def positive_rate(gt_df, columns, positives=(1, None)):
+    """Fraction of ground-truth reports with min..max (default: any) of columns positive (None without ground truth)"""
+    if gt_df is None or len(gt_df) == 0:
+        return None
+    columns = [column for column in columns if column in gt_df.columns]
+    if not columns:
+        return 0.0
+    count = (gt_df[columns].fillna(0).astype(int) == 1).sum(axis=1)
+    low, high = positives
+    return float(((count >= low) & (count <= (high if high is not None else len(columns)))).mean())
+
+
+def load_gt(gt_dir, organ):
+    gt_file = os.path.join(gt_dir, f"{organ}_gt.csv")
+    if not os.path.exists(gt_file):
+        return None
+    return pd.read_csv(gt_file)
+
+
+def plan_run(report_df, gt_dir, fused=False, lung_locator='chain', rule_locator=False):
+    """
+    Project the calls and tokens of a run over report_df.
+
+    Returns a list of rows {'stage', 'signature', 'calls', 'worst_calls', 'prompt_tokens', 'completion_tokens', 'upper_bound'}.
+    'calls' uses the ground-truth positive rates; 'worst_calls' assumes every conditional call happens
+    (also used for 'calls' when an organ has no ground truth). With rule_locator, the calls of the
+    RULE_LOCATED locators are an upper bound ('upper_bound'): their parsers answer an unknown share of them.
+    """
+    n_reports = len(report_df)
+    report_tokens = [count_tokens(str(report)) for report in report_df['report']]
+    total_report_tokens = sum(report_tokens)
+    rows = []
+
+    def add(stage, signature, calls, worst_calls, prompt_tokens, output_tokens, upper_bound=False):
+        rows.append({'stage': stage, 'signature': signature, 'calls': calls, 'worst_calls': worst_calls,
+                     'prompt_tokens': prompt_tokens, 'completion_tokens': output_tokens, 'upper_bound': upper_bound})
+
+    # Formatting: every report is sent in full, each extractor returns roughly its sixth of it
+    if fused:
+        prompt, completion = call_tokens(formatting_prompt.Extract_AllSections, 0, 0)
+        add('format', 'Extract_AllSections', n_reports, n_reports,
+            n_reports * prompt + total_report_tokens, n_reports * completion + total_report_tokens)
+    else:
+        for signature in FORMAT_SIGNATURES:
+            prompt, completion = call_tokens(signature, 0, 0)
+            add('format', signature.__name__, n_reports, n_reports,
+                n_reports * prompt + total_report_tokens, n_reports * completion + total_report_tokens // len(FORMAT_SIGNATURES))
+
+    mean_section_tokens = total_report_tokens / max(n_reports, 1) / len(FORMAT_SIGNATURES)
+    for organ, (classifier, steps) in ORGAN_PLAN.items():
+        if organ == 'lung':
+            steps = _lung_steps(lung_locator)
+        gt_df = load_gt(gt_dir, organ)
+        section_tokens = mean_section_tokens
+        sections = None
+        if gt_df is not None and len(gt_df) > 0:
+            section_tokens = sum(count_tokens(str(text)) for text in gt_df[f'{organ}_report'].fillna('')) / len(gt_df)
+            # Negative sections skip the classifiers (negative_sections fast path)
+            sections = gt_df[f'{organ}_report'][~gt_df[f'{organ}_report'].map(fast_path_applies).astype(bool)]
+
+        # Disease classifiers: one call per classifier per non-negative report the prefilter lets through
+        predictors = [predictor for _, predictor in classifier().named_predictors()]
+        calls = prompt = completion = 0
+        for predictor in predictors:
+            rate = 1.0 if sections is None else sum(prefilter_allows(predictor.signature, text) for text in sections) / len(gt_df)
+            calls += n_reports * rate
+            prompt += n_reports * rate * (template_tokens(predictor.signature) + section_tokens)
+            completion += n_reports * rate * completion_tokens(predictor.signature, LESION_SENTENCE_TOKENS)
+        add(organ, classifier.__name__, calls, n_reports * len(predictors), prompt, completion)
+
+        # Locator / counter / onset fan-out of positive findings
+        for signature, columns, *positives in steps:
+            rate = positive_rate(gt_df, columns, *positives)
+            calls = n_reports * (1.0 if rate is None else rate)
+            text_tokens = section_tokens if 'report' in signature.input_fields else LESION_SENTENCE_TOKENS
+            prompt, completion = call_tokens(signature, text_tokens, LESION_SENTENCE_TOKENS)
+            add(organ, signature.__name__, calls, n_reports, calls * prompt, calls * completion, rule_locator and signature in RULE_LOCATED)
+
+    # Same signature called for several findings (e.g. Locator_RL per lung disease) -> one row
+    merged = {}
+    for row in rows:
+        key = (row['stage'], row['signature'])
+        if key in merged:
+            for field in ['calls', 'worst_calls', 'prompt_tokens', 'completion_tokens']:
+                merged[key][field] += row[field]
+        else:
+            merged[key] = dict(row)
+    return list(merged.values())
+
+
+def project_cost(prompt_tokens, completion_tokens, batch_mode=False):
+    prompt_cost, completion_cost = litellm.cost_per_token(model=MODEL, prompt_tokens=int(prompt_tokens), completion_tokens=int(completion_tokens))
+    cost = prompt_cost + completion_cost
+    return cost * BATCH_DISCOUNT if batch_mode else cost
+
+
+def project_wall_time(calls, tokens, concurrency, latency, rpm=None, tpm=None):
+    """Seconds needed for calls at the given concurrency and per-call latency, bounded by the RPM / TPM limits"""
+    seconds = calls * latency / max(concurrency, 1)
+    if rpm:
+        seconds = max(seconds, calls / rpm * 60)
+    if tpm:
+        seconds = max(seconds, tokens / tpm * 60)
+    return seconds
+
+
+def print_plan(rows, n_reports, concurrency, latency, rpm=None, tpm=None, batch_mode=False):
+    """Print the projection and return its total cost"""
+    print(f"\nDry run: {n_reports} reports, model {MODEL}")
+    print(f"{'stage':<18} {'signature':<40} {'calls':>12} {'worst calls':>12} {'prompt tok':>14} {'compl tok':>12} {'cost':>10}")
+    for row in rows:
+        cost = project_cost(row['prompt_tokens'], row['completion_tokens'], batch_mode)
+        signature = row['signature'] + (' *' if row.get('upper_bound') else '')
+        print(f"{row['stage']:<18} {signature:<40} {row['calls']:>12.0f} {row['worst_calls']:>12.0f} "
+              f"{row['prompt_tokens']:>14.0f} {row['completion_tokens']:>12.0f} {cost:>10.2f}")
+
+    calls = sum(row['calls'] for row in rows)
+    worst_calls = sum(row['worst_calls'] for row in rows)
+    prompt_tokens = sum(row['prompt_tokens'] for row in rows)
+    completion_tokens = sum(row['completion_tokens'] for row in rows)
+    cost = project_cost(prompt_tokens, completion_tokens, batch_mode)
+
+    print(f"\nProjected calls: {calls:.0f} ({calls / max(n_reports, 1):.1f} per report, at most {worst_calls:.0f})")
+    print(f"Projected tokens: {prompt_tokens:.0f} prompt + {completion_tokens:.0f} completion")
+    print(f"Projected cost: ${cost:.2f}" + (" (Batch API discount)" if batch_mode else ""))
+    if batch_mode:
+        print("Wall time depends on Batch API completion (up to 24h per round).")
+    else:
+        seconds = project_wall_time(calls, prompt_tokens + completion_tokens, concurrency, latency, rpm, tpm)
+        print(f"Projected wall time: {seconds / 60:.1f} min at {concurrency} concurrent calls, {latency:.1f}s per call"
+              + (f", {rpm} RPM" if rpm else "") + (f", {tpm} TPM" if tpm else ""))
+        if rpm:
+            # Concurrency beyond this only queues behind the RPM limit
+            print(f"Concurrency that saturates {rpm} RPM: {rpm * latency / 60:.0f}")
+    upper_bound = sum(row['calls'] for row in rows if row.get('upper_bound'))
+    if upper_bound:
+        print(f"* --rule_locator answers part of these {upper_bound:.0f} locator calls without the API: "
+              f"calls, tokens, cost and wall time are upper bounds.")
+    print("No API calls were made, the response cache is not taken into account.")
+    return cost
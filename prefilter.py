@@ -0,0 +1,284 @@
+"""
+--prefilter: negation-aware keyword gate in front of the disease classifiers.
+
+Trigger terms are read from each Disease_Classifier signature (the [Disease] / 'disease' names and the
+"Relevant terms: ..." lists of its Task section), plus the broader stems of EXTRA_TERMS. They are compiled into
+one regex per signature. A classifier is only called when its section mentions a trigger term outside a
+negation scope (NegEx-style: "no", "without", "negative for", ... up to NEGATION_WINDOW words before the term,
+or "not seen", "absent", ... after it, within the same clause). Otherwise the disease is labeled 0 without a call.
+
+--prefilter-audit measures on the ground-truth CSVs how many positive findings the gate would have skipped.
+"""
+import collections
+import os
+import re
+import threading
+
+import dspy
+import pandas as pd
+
+from .call_context import current_call
+from .signature_names import SignatureNames, _instructions_key
+
+# Broader stems ('*' matches the rest of the word) for recall: the prompt term lists are examples, not vocabularies
+EXTRA_TERMS = {
+    'Disease_Classifier_KidneyCyst': ['cyst*', 'renal lesion*', 'hypodens*', 'hypoattenuat*'],
+    'Disease_Classifier_LiverCyst': ['cyst*', 'hepatic lesion*', 'liver lesion*', 'hypodens*', 'hypoattenuat*'],
+    'Disease_Classifier_AdrenalMass': ['adrenal*'],
+    'Disease_Classifier_Gallstone': ['gallstone*', 'cholelith*', 'calculus', 'calculi', 'stone*', 'gallbladder'],
+    'Disease_Classifier_HiatalHernia': ['hernia*'],
+    'Disease_Classifier_Pneumoperitoneum': ['pneumoperitoneum', 'free air', 'free gas', 'extraluminal air', 'extraluminal gas'],
+    'Disease_Classifier_Aortic_Aneurysm': ['aneurysm*'],
+    'Disease_Classifier_Aortic_Dilatation': ['dilat*', 'ectasia', 'ectatic', 'enlarge*', 'aort*'],
+    'Disease_Classifier_Aortic_Dissection': ['dissect*', 'intimal flap'],
+    'Disease_Classifier_Pulmonary_Artery_Enlargement': ['pulmonary arter*', 'pulmonary trunk', 'pulmonary hypertension'],
+    'Disease_Classifier_Pulmonary_Embolism': ['embol*', 'thromb*', 'filling defect*'],
+    'Disease_Classifier_Cardiomegaly': ['cardiomegaly', 'heart size', 'cardiac size', 'cardiac enlargement', 'enlarged heart'],
+    'Disease_Classifier_Pericardial_Effusion': ['pericardial*', 'pericardium'],
+    'Disease_Classifier_Cardiac_Mass': ['mass*', 'tumor*', 'thromb*', 'myxoma'],
+    'Disease_Classifier_Coronary_Artery_Wall_Calcification': ['coronary', 'calcif*', 'atheroscler*'],
+    'Disease_Classifier_Arterial_Calcification': ['calcif*', 'atheroscler*', 'atheromat*', 'plaque*'],
+    'Disease_Classifier_Tracheal_Stenosis': ['stenos*', 'narrow*', 'stricture*'],
+    'Disease_Classifier_Endotracheal_Mass': ['trachea*', 'mass*'],
+    'Disease_Classifier_Endobronchial_Mass': ['bronch*', 'mass*'],
+    'Disease_Classifier_Nodule': ['nodul*', 'micronodul*'],
+    'Disease_Classifier_Mass': ['mass*', 'tumor*', 'neoplasm*', 'malignan*', 'carcinoma*'],
+    'Disease_Classifier_Consolidation': ['consolidat*', 'airspace disease', 'air space disease', 'pneumonia'],
+    'Disease_Classifier_Opacity': ['opaci*', 'density', 'densities'],
+    'Disease_Classifier_Pleural_Effusion': ['effusion*', 'pleural fluid', 'hydrothorax'],
+    'Disease_Classifier_Atelectasis': ['atelecta*', 'collapse*'],
+    'Disease_Classifier_Pneumothorax': ['pneumothora*'],
+    'Disease_Classifier_Ground_Glass_Opacity': ['ground glass', 'GGO*'],
+    'Disease_Classifier_Emphysema': ['emphysem*', 'bulla*', 'bullous', 'blebs'],
+    'Disease_Classifier_Mosaic_Attenuation': ['mosaic*', 'air trapping'],
+    'Disease_Classifier_Bronchiectasis': ['bronchiecta*', 'bronchiolecta*'],
+    'Disease_Classifier_InterlobularSeptalThickening': ['septal', 'interstitial*', 'reticula*'],
+    'Disease_Classifier_Mediastinal_Mass': ['mass*', 'tumor*', 'thymoma*', 'lesion*'],
+    'Disease_Classifier_Lymphadenopathy': ['lymph*', 'adenopath*', 'node*'],
+    'Disease_Classifier_Esophageal_Mass': ['esophag*', 'oesophag*'],
+    'Disease_Classifier_Pneumomediastinum': ['pneumomediastinum', 'mediastinal air', 'mediastinal gas', 'free air'],
+    'Disease_Classifier_Rib_Fracture': ['fractur*', 'rib*'],
+    'Disease_Classifier_Vertebrae_Fracture': ['fractur*', 'compress*', 'height loss', 'wedg*', 'collapse*'],
+}
+
+# (signature, organ, ground-truth presence column) audited by --prefilter-audit
+GT_COLUMNS = {
+    'Disease_Classifier_KidneyCyst': ('abdomen', 'Kidney_Cyst_presence'),
+    'Disease_Classifier_LiverCyst': ('abdomen', 'Liver_Cyst_presence'),
+    'Disease_Classifier_AdrenalMass': ('abdomen', 'Adrenal_Mass_presence'),
+    'Disease_Classifier_Gallstone': ('abdomen', 'Gallstone_presence'),
+    'Disease_Classifier_HiatalHernia': ('abdomen', 'Hiatal_Hernia_presence'),
+    'Disease_Classifier_Pneumoperitoneum': ('abdomen', 'Pneumoperitoneum_presence'),
+    'Disease_Classifier_Aortic_Aneurysm': ('heart_and_vessel', 'Aortic_Aneurysm_presence'),
+    'Disease_Classifier_Aortic_Dilatation': ('heart_and_vessel', 'Aortic_Dilatation_presence'),
+    'Disease_Classifier_Aortic_Dissection': ('heart_and_vessel', 'Aortic_Dissection_presence'),
+    'Disease_Classifier_Pulmonary_Artery_Enlargement': ('heart_and_vessel', 'Pulmonary_Artery_Enlargement_presence'),
+    'Disease_Classifier_Pulmonary_Embolism': ('heart_and_vessel', 'Pulmonary_Embolism_presence'),
+    'Disease_Classifier_Cardiomegaly': ('heart_and_vessel', 'Cardiomegaly_presence'),
+    'Disease_Classifier_Pericardial_Effusion': ('heart_and_vessel', 'Pericardial_Effusion_presence'),
+    'Disease_Classifier_Cardiac_Mass': ('heart_and_vessel', 'Cardiac_Mass_presence'),
+    'Disease_Classifier_Coronary_Artery_Wall_Calcification': ('heart_and_vessel', 'Coronary_Artery_Wall_Calcification_presence'),
+    'Disease_Classifier_Arterial_Calcification': ('heart_and_vessel', 'Arterial_Calcification_presence'),
+    'Disease_Classifier_Tracheal_Stenosis': ('large_airway', 'Tracheal_Stenosis_presence'),
+    'Disease_Classifier_Endotracheal_Mass': ('large_airway', 'Endotracheal_Mass_presence'),
+    'Disease_Classifier_Endobronchial_Mass': ('large_airway', 'Endobronchial_Mass_presence'),
+    'Disease_Classifier_Nodule': ('lung', 'Nodule_presence'),
+    'Disease_Classifier_Mass': ('lung', 'Mass_presence'),
+    'Disease_Classifier_Consolidation': ('lung', 'Consolidation_presence'),
+    'Disease_Classifier_Pleural_Effusion': ('lung', 'Pleural Effusion_presence'),
+    'Disease_Classifier_Atelectasis': ('lung', 'Atelectasis_presence'),
+    'Disease_Classifier_Pneumothorax': ('lung', 'Pneumothorax_presence'),
+    'Disease_Classifier_Ground_Glass_Opacity': ('lung', 'Ground Glass Opacity_presence'),
+    'Disease_Classifier_Emphysema': ('lung', 'Emphysema_presence'),
+    'Disease_Classifier_Mosaic_Attenuation': ('lung', 'Mosaic Attenuation_presence'),
+    'Disease_Classifier_Bronchiectasis': ('lung', 'Bronchiectasis_presence'),
+    'Disease_Classifier_InterlobularSeptalThickening': ('lung', 'Interlobular Septal Thickening_presence'),
+    'Disease_Classifier_Mediastinal_Mass': ('mediastinum', 'Mediastinal_Mass_presence'),
+    'Disease_Classifier_Lymphadenopathy': ('mediastinum', 'Lymphadenopathy_presence'),
+    'Disease_Classifier_Esophageal_Mass': ('mediastinum', 'Esophageal_Mass_presence'),
+    'Disease_Classifier_Pneumomediastinum': ('mediastinum', 'Pneumomediastinum_presence'),
+    'Disease_Classifier_Rib_Fracture': ('osseous_structure', 'Rib_Fracture_presence'),
+    'Disease_Classifier_Vertebrae_Fracture': ('osseous_structure', 'Vertebrae_Fracture_presence'),
+}
+
+PRE_NEGATIONS = ['no', 'not', 'without', 'negative for', 'absence of', 'free of', 'resolution of', 'rather than']
+POST_NEGATIONS = ['not seen', 'not identified', 'not present', 'not demonstrated', 'not visualized', 'not evident',
+                  'is absent', 'are absent', 'has resolved', 'have resolved', 'ruled out', 'excluded']
+# Look like negations but negate something else ("no change in the nodule")
+PSEUDO_NEGATIONS = ['no change', 'no interval change', 'no significant change', 'no significant interval change',
+                    'no increase', 'no new', 'not only', 'not significantly changed', 'without change',
+                    'without interval change', 'without contrast', 'without iv contrast', 'without intravenous contrast']
+# Words that end a negation scope inside a sentence
+TERMINATIONS = ['but', 'however', 'although', 'though', 'except', 'aside from', 'apart from', 'which', 'while', 'whereas']
+NEGATION_WINDOW = 8  # words between a pre-negation and the term it negates
+
+
+def _phrase_pattern(phrases):
+    return re.compile(r'\b(?:' + '|'.join(re.escape(phrase).replace(r'\ ', r'\s+') for phrase in sorted(phrases, key=len, reverse=True)) + r')\b', re.IGNORECASE)
+
+
+_PRE = _phrase_pattern(PRE_NEGATIONS)
+_POST = _phrase_pattern(POST_NEGATIONS)
+_PSEUDO = _phrase_pattern(PSEUDO_NEGATIONS)
+_CLAUSES = re.compile(r'(?<=[.!?])\s+|\n+|[;:]|\b(?:' + '|'.join(re.escape(term).replace(r'\ ', r'\s+') for term in TERMINATIONS) + r')\b', re.IGNORECASE)
+
+
+def signature_terms(signature):
+    """Trigger terms of a disease classifier, from the Task section of its instructions"""
+    instructions = signature.instructions
+    task = instructions.split('Task:', 1)[-1].split('Instructions:', 1)[0]
+    terms = re.findall(r'\[([^\]]+)\]', task) + re.findall(r"'([^']+)'", task)
+    for line in task.splitlines():
+        if 'terms' in line.lower() and ':' in line:
+            listed = re.sub(r'\([^)]*\)', '', line.split(':', 1)[1])
+            for term in re.split(r',|\bor\b', listed):
+                term = term.strip(" .'\"")
+                if term:
+                    terms.append(term)
+    return terms
+
+
+def _term_pattern(term):
+    # Words may be joined by spaces or hyphens and carry a plural suffix; '*' ends a stem
+    words = re.split(r'[\s-]+', term.strip())
+    parts = []
+    for word in words:
+        if word.endswith('*'):
+            parts.append(re.escape(word[:-1]) + r'\w*')
+        elif word.endswith('y'):
+            parts.append(re.escape(word[:-1]) + r'(?:y|ies)')
+        else:
+            parts.append(re.escape(word) + r'(?:e?s)?')
+    return r'[\s-]+'.join(parts)
+
+
+class KeywordGate:
+    """Compiled trigger terms of one disease classifier"""
+    def __init__(self, terms):
+        self.terms = sorted(set(terms))
+        # All-caps abbreviations (AA, PE, GGO) only match in capitals
+        abbreviations = [term for term in self.terms if term.rstrip('*s').isupper()]
+        words = [term for term in self.terms if term not in abbreviations]
+        self._words = re.compile(r'\b(?:' + '|'.join(_term_pattern(term) for term in words) + r')\b', re.IGNORECASE) if words else None
+        self._abbreviations = re.compile(r'\b(?:' + '|'.join(_term_pattern(term) for term in abbreviations) + r')\b') if abbreviations else None
+
+    def _matches(self, text):
+        for pattern in [self._words, self._abbreviations]:
+            if pattern is not None:
+                yield from pattern.finditer(text)
+
+    def mentions(self, report):
+        """True if the report mentions a trigger term that is not negated"""
+        if report is None or (isinstance(report, float) and pd.isna(report)):
+            return False
+        for clause in _CLAUSES.split(str(report)):
+            if clause and any(not negated(clause, match) for match in self._matches(clause)):
+                return True
+        return False
+
+
+def negated(clause, match):
+    """NegEx-style scope check of one term match inside its clause"""
+    pseudo = [(m.start(), m.end()) for m in _PSEUDO.finditer(clause)]
+    for cue in _PRE.finditer(clause[:match.start()]):
+        if any(start <= cue.start() < end for start, end in pseudo):
+            continue
+        if len(clause[cue.end():match.start()].split()) <= NEGATION_WINDOW:
+            return True
+    return _POST.search(clause, match.end()) is not None
+
+
+_enabled = False
+_gates = {}
+_names = SignatureNames()
+_skipped = collections.Counter()
+_lock = threading.Lock()
+
+
+def configure_prefilter(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def gate_for(signature):
+    """KeywordGate of a disease classifier signature (compiled once), or None if it is not gated"""
+    key = _instructions_key(signature)
+    with _lock:
+        if key in _gates:
+            return _gates[key]
+    name = _names.lookup(signature)
+    # Only disease classifiers are gated (run_classifiers also runs the formatting extractors)
+    terms = signature_terms(signature) + EXTRA_TERMS.get(name, []) if name.startswith('Disease_Classifier') else []
+    gate = KeywordGate(terms) if terms else None
+    with _lock:
+        _gates[key] = gate
+    return gate
+
+
+def prefilter_allows(signature, report):
+    """False if --prefilter is on and the report has no (non-negated) trigger term of the signature"""
+    if not _enabled:
+        return True
+    gate = gate_for(signature)
+    return gate is None or gate.mentions(report)
+
+
+def skip_classifier(classifier, report):
+    """True if the prefilter gates the classifier's call off; counts the skipped call"""
+    if prefilter_allows(classifier.predictors()[0].signature, report):
+        return False
+    with _lock:
+        _skipped[current_call().get('organ')] += 1
+    return True
+
+
+def negative_prediction():
+    """Prediction of a classifier skipped by the prefilter"""
+    return dspy.Prediction(reasoning='', lesion_sentence='', abnormality_presence=0)
+
+
+def skipped_stats():
+    """{organ: classifier calls skipped by the prefilter}"""
+    with _lock:
+        return dict(_skipped)
+
+
+def audit(gt_dir, classifiers):
+    """
+    Recall of the gate on the ground-truth CSVs: per disease classifier (of the given classifier modules), the positive
+    reports and how many of them the gate would have skipped, plus the fraction of all reports it skips.
+    """
+    rows = []
+    for classifier in classifiers:
+        for predictor in classifier().predictors():
+            name = _names.lookup(predictor.signature)
+            if name not in GT_COLUMNS:
+                continue
+            organ, column = GT_COLUMNS[name]
+            gt_file = os.path.join(gt_dir, f"{organ}_gt.csv")
+            if not os.path.exists(gt_file):
+                continue
+            gt_df = pd.read_csv(gt_file)
+            if column not in gt_df.columns:
+                continue
+            gate = gate_for(predictor.signature)
+            called = gt_df[f'{organ}_report'].map(gate.mentions) if gate is not None else pd.Series(True, index=gt_df.index)
+            positive = gt_df[column].fillna(0).astype(int) == 1
+            rows.append({
+                'signature': name,
+                'organ': organ,
+                'positives': int(positive.sum()),
+                'missed': int((positive & ~called.astype(bool)).sum()),
+                'skipped_rate': float((~called.astype(bool)).mean()) if len(gt_df) else 0.0,
+            })
+    return rows
+
+
+def print_audit(rows):
+    print(f"{'signature':<56} {'positives':>9} {'missed':>7} {'recall':>7} {'skipped':>8}")
+    for row in rows:
+        recall = 1 - row['missed'] / row['positives'] if row['positives'] else 1.0
+        print(f"{row['signature']:<56} {row['positives']:>9} {row['missed']:>7} {recall:>7.1%} {row['skipped_rate']:>8.1%}")
+    positives = sum(row['positives'] for row in rows)
+    missed = sum(row['missed'] for row in rows)
+    print(f"Total: {missed} of {positives} positive findings would be skipped (recall {1 - missed / positives if positives else 1.0:.2%})")
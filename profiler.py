@@ -0,0 +1,155 @@
+"""
+--profile: spans of stages, organs, reports and LLM calls, exported as a Chrome trace (chrome://tracing, ui.perfetto.dev)
+and summarized as p50/p95/p99 per signature.
+
+Spans are no-ops until start_profiling() is called, so the instrumented code paths cost nothing in normal runs.
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+import dspy
+from dspy.utils.callback import BaseCallback
+
+from .call_context import current_call
+from .signature_names import SignatureNames
+
+# Signature of the Predict running in the current context, attached to the LLM spans below it
+_signature = contextvars.ContextVar('profiled_signature', default=None)
+
+_profiler = None
+
+
+class Profiler:
+    """Streams complete ('X') trace events to a JSON array file and keeps the durations per (signature, span) for percentiles"""
+    def __init__(self, path):
+        self.path = path
+        self._start = time.perf_counter()
+        self._pid = os.getpid()
+        self._durations = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write('[\n')
+        self._first = True
+
+    def emit(self, name, cat, start, end, args=None):
+        event = {
+            'name': name, 'cat': cat, 'ph': 'X', 'pid': self._pid, 'tid': threading.get_ident(),
+            'ts': round((start - self._start) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+        }
+        if args:
+            event['args'] = args
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line if self._first else ',\n' + line)
+            self._first = False
+            signature = (args or {}).get('signature')
+            if signature is not None:
+                self._durations[(signature, name)].append(end - start)
+
+    def percentiles(self):
+        """Rows (signature, span, count, p50, p95, p99, total) in seconds, slowest total first"""
+        with self._lock:
+            durations = {key: sorted(values) for key, values in self._durations.items()}
+        rows = []
+        for (signature, name), values in durations.items():
+            def at(q):
+                return values[min(len(values) - 1, int(len(values) * q / 100))]
+            rows.append((signature, name, len(values), at(50), at(95), at(99), sum(values)))
+        return sorted(rows, key=lambda row: -row[6])
+
+    def close(self):
+        with self._lock:
+            self._file.write('\n]\n')
+            self._file.close()
+
+
+@contextlib.contextmanager
+def span(name, cat, **args):
+    """Record the block as a trace event (no-op unless profiling)"""
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    signature = _signature.get()
+    if signature is not None:
+        args['signature'] = signature
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.emit(name, cat, start, time.perf_counter(), args)
+
+
+class ProfileCallback(BaseCallback):
+    """dspy callback that records every Predict call (named by its signature) and the adapter's format / parse time"""
+    def __init__(self):
+        self.signature_names = SignatureNames()
+        self._started = {}
+
+    def on_module_start(self, call_id, instance, inputs):
+        if isinstance(instance, dspy.Predict):
+            name = self.signature_names.lookup(instance.signature)
+            self._started[call_id] = (name, time.perf_counter(), _signature.set(name))
+
+    def on_module_end(self, call_id, outputs, exception=None):
+        started = self._started.pop(call_id, None)
+        if started is None:
+            return
+        name, start, token = started
+        _signature.reset(token)
+        if _profiler is None:
+            return
+        call = current_call()
+        _profiler.emit('call', 'predict', start, time.perf_counter(),
+                       {'signature': name, 'organ': call.get('organ'), 'report_id': call.get('report_id'), 'failed': exception is not None})
+
+    def _start(self, call_id):
+        self._started[call_id] = (None, time.perf_counter(), None)
+
+    def _end(self, call_id, name):
+        started = self._started.pop(call_id, None)
+        if started is None or _profiler is None:
+            return
+        _profiler.emit(name, 'serialization', started[1], time.perf_counter(), {'signature': _signature.get()})
+
+    def on_adapter_format_start(self, call_id, instance, inputs):
+        self._start(call_id)
+
+    def on_adapter_format_end(self, call_id, outputs, exception=None):
+        self._end(call_id, 'adapter.format')
+
+    def on_adapter_parse_start(self, call_id, instance, inputs):
+        self._start(call_id)
+
+    def on_adapter_parse_end(self, call_id, outputs, exception=None):
+        self._end(call_id, 'adapter.parse')
+
+
+def start_profiling(path):
+    """Start recording spans to the Chrome trace file at path and return the dspy callback to configure"""
+    global _profiler
+    _profiler = Profiler(path)
+    return ProfileCallback()
+
+
+def stop_profiling(table_path=None):
+    """Finish the trace and print (and write to table_path) the latency percentiles per signature"""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return
+    profiler.close()
+
+    lines = [f"{'signature':<48} {'span':<16} {'count':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'total':>10}"]
+    for signature, name, count, p50, p95, p99, total in profiler.percentiles():
+        lines.append(f"{signature:<48} {name:<16} {count:>8} {p50:>8.3f} {p95:>8.3f} {p99:>8.3f} {total:>10.1f}")
+    table = '\n'.join(lines)
+    print(f"\nProfile (seconds), trace written to {profiler.path}\n{table}")
+    if table_path is not None:
+        with open(table_path, 'w', encoding='utf-8') as f:
+            f.write(table + '\n')
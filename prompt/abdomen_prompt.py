@@ -1,5 +1,7 @@
 import dspy
 
+from .parallel import run_classifiers
+
 class Abdomen_Disease_Classifier(dspy.Module):
     def __init__(self):
         # 여기서 안보고 싶은 병변만 주석처리
@@ -13,11 +15,8 @@ class Abdomen_Disease_Classifier(dspy.Module):
         }
 
     def forward(self, report):
-        # Use dictionary comprehension to classify diseases
-        return {
-            disease: self.classifiers[disease](report=report)
-            for disease in self.classifiers
-        }
+        # 모든 병변 classifier를 동시에 호출
+        return run_classifiers(self.classifiers, report=report)
 
 class Disease_Classifier_KidneyCyst(dspy.Signature):
     """
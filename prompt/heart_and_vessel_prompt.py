@@ -1,5 +1,7 @@
 import dspy
 
+from .parallel import run_classifiers
+
 class Heart_and_Vessel_Disease_Classifier(dspy.Module):
     def __init__(self):
         self.classifiers = {
@@ -16,10 +18,7 @@ class Heart_and_Vessel_Disease_Classifier(dspy.Module):
         }
 
     def forward(self, report):
-        return {
-            disease: self.classifiers[disease](report=report)
-            for disease in self.classifiers
-        }
+        return run_classifiers(self.classifiers, report=report)
         
 class Disease_Classifier_Aortic_Aneurysm(dspy.Signature):
     """
@@ -1,8 +1,12 @@
 # Locator prompt 수정
 # Counter 밖으로 빼면서 prompt 수정
 
+from typing import Literal
+
 import dspy
 
+from .parallel import run_classifiers
+
 class Lung_Disease_Classifier(dspy.Module):
     def __init__(self):
         # 여기서 안보고 싶은 병변만 주석처리
@@ -22,14 +26,16 @@ class Lung_Disease_Classifier(dspy.Module):
         }
 
     def forward(self, report):
+        # 각 classifier는 report당 한 번만 호출 (lesion_sentence, abnormality_presence 모두 같은 결과에서)
+        results = run_classifiers(self.classifiers, report=report)
         return {
             'lesion_sentence': {
-                disease: self.classifiers[disease](report=report)['lesion_sentence']
-                for disease in self.classifiers
+                disease: results[disease]['lesion_sentence']
+                for disease in results
             },
             'abnormality_presence': {
-                disease: self.classifiers[disease](report=report)['abnormality_presence']
-                for disease in self.classifiers
+                disease: results[disease]['abnormality_presence']
+                for disease in results
             }
         }
 
@@ -534,4 +540,73 @@ class Counter(dspy.Signature):
     abnormality_class: str = dspy.InputField(desc="Type of abnormality to count")
     
     single: int = dspy.OutputField(desc="1 if the abnormality count is single, else 0")
-    multiple: int = dspy.OutputField(desc="1 if the abnormality count is multiple, else 0")
\ No newline at end of file
+    multiple: int = dspy.OutputField(desc="1 if the abnormality count is multiple, else 0")
+
+# Side, lobe and count of a finding in one call (--lung_locator fused / fused_all)
+LUNG_LOCATIONS = ['right_lung', 'left_lung', 'unspecified',
+                  'left_upper_lobe', 'left_lower_lobe', 'left_unspecified',
+                  'right_upper_lobe', 'right_middle_lobe', 'right_lower_lobe', 'right_unspecified',
+                  'single', 'multiple']
+
+LUNG_LOCATION_RULES = """
+    Laterality (from the report):
+    - right_lung / left_lung = 1 if the abnormality is in the right / left lung. If it is present in both lungs, both are 1.
+    - unspecified = 1 if the abnormality is in the lung, but the laterality is not specified in the report.
+    - Do not infer or guess laterality if not clearly mentioned.
+
+    Lobes (from the lesion sentence, only for a lung marked above):
+    - left_upper_lobe, left_lower_lobe, right_upper_lobe, right_middle_lobe, right_lower_lobe = 1 if the abnormality is specifically mentioned in that lobe.
+    - left_unspecified / right_unspecified = 1 if the abnormality is in the left / right lung without specifying which lobe.
+    - If the abnormality is present in the lingular segment, it is located in the left upper lobe.
+    - If the abnormality is present in the apical region or apex of the lung, it is located in the upper lobe.
+    - "lower lobes of both lungs" → right_lung=1, left_lung=1, right_lower_lobe=1, left_lower_lobe=1.
+    - When both a broader location and a specific lobe are mentioned ("in both lungs, especially in LLL"), include the broader region as well: right_lung=1, left_lung=1, left_lower_lobe=1, left_unspecified=1, right_unspecified=1.
+    - When a secondary finding (e.g., GGO) is described in relation to another primary lesion ("Consolidation in LLL, with adjacent GGO"), assign it the location of the primary lesion unless clearly stated otherwise.
+
+    Count (only for Nodule and Mass, otherwise 0):
+    - single = 1 for exactly ONE abnormality ("a nodule", "nodule"), multiple = 1 for MORE THAN ONE ("nodules", "several", "multiple", "numerous").
+    - single and multiple are mutually exclusive.
+"""
+
+
+class Locator_Lung_Finding(dspy.Signature):
+    __doc__ = """
+    You are a radiologist reviewing a chest radiology report.
+
+    Task:
+    Determine the laterality, the lobes and the count of the given abnormality in one answer.
+    """ + LUNG_LOCATION_RULES + """
+    If the abnormality is not found set all fields to 0.
+    """
+    report: str = dspy.InputField(desc="Lung section of the radiology report")
+    lesion_sentence: str = dspy.InputField(desc="sentence that including lesions of the report")
+    abnormality_class: str = dspy.InputField(desc="specific abnormality to find a location")
+
+    right_lung: int = dspy.OutputField(desc="1 if the abnormality is in the right lung, else 0")
+    left_lung: int = dspy.OutputField(desc="1 if the abnormality is in the left lung, else 0")
+    unspecified: int = dspy.OutputField(desc="1 if the abnormality is in the lung but laterality is not specified, else 0")
+    left_upper_lobe: int = dspy.OutputField(desc="1 if abnormality is in left upper lobe, else 0")
+    left_lower_lobe: int = dspy.OutputField(desc="1 if abnormality is in left lower lobe, else 0")
+    left_unspecified: int = dspy.OutputField(desc="1 if abnormality is in left lung but lobe not specified, else 0")
+    right_upper_lobe: int = dspy.OutputField(desc="1 if abnormality is in right upper lobe, else 0")
+    right_middle_lobe: int = dspy.OutputField(desc="1 if abnormality is in right middle lobe, else 0")
+    right_lower_lobe: int = dspy.OutputField(desc="1 if abnormality is in right lower lobe, else 0")
+    right_unspecified: int = dspy.OutputField(desc="1 if abnormality is in right lung but lobe not specified, else 0")
+    single: int = dspy.OutputField(desc="1 if the abnormality count is single (Nodule, Mass only), else 0")
+    multiple: int = dspy.OutputField(desc="1 if the abnormality count is multiple (Nodule, Mass only), else 0")
+
+
+class Locator_Lung_Findings(dspy.Signature):
+    __doc__ = """
+    You are a radiologist reviewing a chest radiology report.
+
+    Task:
+    For every given abnormality, determine its laterality, lobes and count, and return the labels that apply.
+    Evaluate each abnormality separately, using the report and its own lesion sentence.
+    """ + LUNG_LOCATION_RULES + """
+    Return an entry for every given abnormality, keyed by its name, listing the labels that are 1 (an empty list if none).
+    """
+    report: str = dspy.InputField(desc="Lung section of the radiology report")
+    findings: dict[str, str] = dspy.InputField(desc="abnormality -> sentence that including its lesions")
+
+    locations: dict[str, list[Literal[tuple(LUNG_LOCATIONS)]]] = dspy.OutputField(desc="abnormality -> labels that are 1")
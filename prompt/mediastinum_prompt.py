@@ -1,5 +1,7 @@
 import dspy
 
+from .parallel import run_classifiers
+
 class Mediastinum_Disease_Classifier(dspy.Module):
     def __init__(self):
         self.mediastinal_mass = dspy.ChainOfThought(Disease_Classifier_Mediastinal_Mass)
@@ -8,12 +10,12 @@ class Mediastinum_Disease_Classifier(dspy.Module):
         self.pneumomediastinum = dspy.ChainOfThought(Disease_Classifier_Pneumomediastinum)
 
     def forward(self, report):
-        return {
-            "Mediastinal_Mass": self.mediastinal_mass(report=report), 
-            "Lymphadenopathy": self.lymphadenopathy(report=report),
-            "Esophageal_Mass": self.esophageal_mass(report=report),
-            "Pneumomediastinum" : self.pneumomediastinum(report=report)
-        }
+        return run_classifiers({
+            "Mediastinal_Mass": self.mediastinal_mass,
+            "Lymphadenopathy": self.lymphadenopathy,
+            "Esophageal_Mass": self.esophageal_mass,
+            "Pneumomediastinum": self.pneumomediastinum
+        }, report=report)
         
 class Disease_Classifier_Mediastinal_Mass(dspy.Signature):
     """
@@ -1,5 +1,9 @@
+from typing import Literal
+
 import dspy
 
+from .parallel import run_classifiers
+
 class Osseous_Structure_Disease_Classifier(dspy.Module):
     def __init__(self):
         self.classifiers = {
@@ -8,14 +12,16 @@ class Osseous_Structure_Disease_Classifier(dspy.Module):
         }
 
     def forward(self, report):
+        # 각 classifier는 report당 한 번만 호출 (lesion_sentence, abnormality_presence 모두 같은 결과에서)
+        results = run_classifiers(self.classifiers, report=report)
         return {
             'lesion_sentence': {
-                disease: self.classifiers[disease](report=report)['lesion_sentence']
-                for disease in self.classifiers
+                disease: results[disease]['lesion_sentence']
+                for disease in results
             },
             'abnormality_presence': {
-                disease: self.classifiers[disease](report=report)['abnormality_presence']
-                for disease in self.classifiers
+                disease: results[disease]['abnormality_presence']
+                for disease in results
             }
         }
         
@@ -207,4 +213,25 @@ class Onset_Rib_Fracture(dspy.Signature):
     
     new = dspy.OutputField(desc="Return 1 if the onset of rib fracture is new, else return 0.")
     old_healed = dspy.OutputField(desc="Return 1 if the onset of rib fracture is old_healed, else return 0.")
-    unspecified = dspy.OutputField(desc="Return 1 if the onset of rib fracture is unspecified, else return 0.")
\ No newline at end of file
+    unspecified = dspy.OutputField(desc="Return 1 if the onset of rib fracture is unspecified, else return 0.")
+
+
+class Onset_Rib_Fractures(dspy.Signature):
+    """
+    You are a radiologist reviewing a radiology report.
+    Task: You are given a sentence describing rib fractures and the list of fractured ribs. Determine the onset of the fracture at each location: 'new', 'old_healed' or 'unspecified'.
+
+    Instructions:
+    1. Evaluate every given location separately, using only the part of the sentence that describes that rib.
+    2. For each location, return:
+       - new: Terms like " new", "just emerged" or similar descriptors are used
+       - old_healed: Terms like "old", "healed", "previous" or similar descriptors are used
+       - unspecified: The onset of the fracture at this location is not described
+    Notes:
+    1. Return exactly one onset for every given location, using the location text as the key.
+    """
+
+    lesion_sentence: str = dspy.InputField(desc="Sentence describing the rib fractures from the radiology report.")
+    locations: list[str] = dspy.InputField(desc="Locations of the rib fractures, e.g. 'right 5th rib'. 'rib' means a rib fracture without a specified location.")
+
+    onsets: dict[str, Literal['new', 'old_healed', 'unspecified']] = dspy.OutputField(desc="Onset of the rib fracture at each given location.")
\ No newline at end of file
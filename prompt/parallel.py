@@ -0,0 +1,55 @@
+import concurrent.futures
+import contextvars
+import threading
+
+from ..call_context import advance_chain
+from ..prefilter import skip_classifier, negative_prediction
+
+# Classifier calls of all organs and reports share one bounded pool, so concurrent
+# organ builders cannot multiply the number of open LLM requests without limit
+DEFAULT_MAX_WORKERS = 32
+
+_executor = None
+_max_workers = DEFAULT_MAX_WORKERS
+_lock = threading.Lock()
+
+
+def configure_executor(max_workers):
+    """Set the size of the shared classifier pool (replaces the running pool)"""
+    global _executor, _max_workers
+    with _lock:
+        old, _executor = _executor, None
+        _max_workers = max_workers
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix='classifier')
+        return _executor
+
+
+def run_classifiers(classifiers, **inputs):
+    """
+    Call every classifier exactly once with the same inputs, concurrently on the shared pool.
+
+    Returns {name: prediction} in the order of classifiers.
+    With --prefilter, a classifier whose report has no trigger term is not called and gets a negative prediction.
+    Classifiers must not submit to the pool themselves (leaf LLM calls only), otherwise a full pool could deadlock.
+    """
+    executor = get_executor()
+    skipped = {name for name, classifier in classifiers.items() if skip_classifier(classifier, inputs.get('report'))}
+    # Each call runs in a copy of the caller's context, so the scheduler sees its organ and report
+    futures = {
+        name: executor.submit(contextvars.copy_context().run, classifier, **inputs)
+        for name, classifier in classifiers.items() if name not in skipped
+    }
+    # Let every call finish before an error is raised, so none is still running afterwards (e.g. being queued for a batch)
+    concurrent.futures.wait(futures.values())
+    results = {name: negative_prediction() if name in skipped else futures[name].result() for name in classifiers}
+    # Locators / counters called after the classifiers are the next link of the chain
+    advance_chain()
+    return results
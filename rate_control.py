@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+
+import dspy
+
+from .profiler import span
+
+logger = logging.getLogger(__name__)
+
+
+def log_to(path):
+    """Write the controller's decisions to path (one line per decision)"""
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+def status_code(exc):
+    return getattr(exc, 'status_code', None)
+
+
+def retry_after(exc):
+    """Seconds from the Retry-After header of an API error, or None"""
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def is_overload(exc):
+    """429 and 5xx mean the API wants less traffic, other errors do not"""
+    code = status_code(exc)
+    return code is not None and (code == 429 or code >= 500)
+
+
+def estimate_tokens(prompt, messages):
+    # ~4 characters per token, good enough for pacing; corrected with the real usage afterwards
+    text = prompt or ''
+    for message in messages or []:
+        text += str(message.get('content', ''))
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """Refills per_minute units per minute, holding at most one minute's worth"""
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, amount=1):
+        """Block until amount units are available, then consume them"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def charge(self, amount):
+        """Correct a previous take by amount (may go negative, later requests then wait longer)"""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class RateController:
+    """
+    AIMD concurrency controller for the OpenAI backend.
+
+    Adjusts the limit of the InflightGate shared by formatting and the organ stages:
+    +1 after a full window of successful requests while latency stays near its baseline,
+    halved on 429 / 5xx (at most once per cooldown). Requests are additionally paced by
+    requests/min and tokens/min buckets, and paused for the Retry-After the API asks for.
+    """
+    LATENCY_TOLERANCE = 2.0  # latency above this multiple of the baseline holds the limit
+    MIN_SAMPLES = 20  # successes before the latency baseline is trusted
+
+    def __init__(self, gate, max_limit, min_limit=1, rpm=None, tpm=None, adaptive=True, cooldown=5.0):
+        self.gate = gate
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.adaptive = adaptive
+        self.cooldown = cooldown
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+        self._lock = threading.Lock()
+        self._window = 0
+        self._samples = 0
+        self._latency = None
+        self._baseline = None
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+
+        logger.info(f"start limit={gate.limit} max={max_limit} rpm={rpm} tpm={tpm} adaptive={adaptive}")
+
+    def before_request(self, estimated_tokens):
+        wait = self._paused_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(estimated_tokens)
+
+    def on_success(self, latency, used_tokens, estimated_tokens):
+        if self.tokens:
+            self.tokens.charge(used_tokens - estimated_tokens)
+
+        with self._lock:
+            self._samples += 1
+            self._latency = latency if self._latency is None else 0.9 * self._latency + 0.1 * latency
+            if self._samples >= self.MIN_SAMPLES:
+                self._baseline = self._latency if self._baseline is None else min(self._baseline, self._latency)
+
+            if not self.adaptive:
+                return
+            self._window += 1
+            if self._window < self.gate.limit or self.gate.limit >= self.max_limit:
+                return
+            self._window = 0
+            if self._baseline is not None and self._latency > self.LATENCY_TOLERANCE * self._baseline:
+                logger.info(f"hold limit={self.gate.limit} latency={self._latency:.2f}s baseline={self._baseline:.2f}s")
+                return
+            self.gate.set_limit(self.gate.limit + 1)
+            logger.info(f"increase limit={self.gate.limit} latency={self._latency:.2f}s")
+
+    def on_error(self, exc):
+        if not is_overload(exc):
+            return
+
+        pause = retry_after(exc)
+        with self._lock:
+            now = time.monotonic()
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+            if not self.adaptive or now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._window = 0
+            self.gate.set_limit(max(self.min_limit, self.gate.limit // 2))
+            logger.warning(f"decrease limit={self.gate.limit} status={status_code(exc)} retry_after={pause}")
+
+
+class RatePacedLM(dspy.BaseLM):
+    """
+    dspy LM that waits for the RPM / TPM buckets and any Retry-After pause of a RateController.
+    Sits outside the InflightGate, so a throttled call does not hold a slot while it waits.
+    """
+    def __init__(self, lm, controller):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.controller = controller
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        with span('rate_wait', 'llm'):
+            self.controller.before_request(estimate_tokens(prompt, messages))
+        return self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+
+
+class RateControlledLM(dspy.BaseLM):
+    """
+    dspy LM that reports the outcome of every request to a RateController.
+    Sits inside the InflightGate, so the latency it measures excludes the queue wait.
+    """
+    def __init__(self, lm, controller):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.controller = controller
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        estimated = estimate_tokens(prompt, messages)
+        start = time.monotonic()
+        try:
+            response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        except Exception as e:
+            self.controller.on_error(e)
+            raise
+
+        usage = getattr(response, 'usage', None)
+        used = getattr(usage, 'total_tokens', None) or estimated
+        self.controller.on_success(time.monotonic() - start, used, estimated)
+        return response
@@ -0,0 +1,439 @@
+"""
+--rule_locator: deterministic parsing of the locator inputs.
+
+Most lesion sentences name their location plainly ("right 5th and 6th ribs", "T7-T9 compression fractures",
+"RUL nodule", "left adrenal"). A parser per locator turns such text into the output fields the create_csv modules
+read, with a confidence in [0, 1]. Below CONFIDENCE_THRESHOLD (no location, a location the fields cannot hold,
+another finding in the same sentence, ...) the LLM locator answers as before.
+"""
+import collections
+import re
+import threading
+
+import dspy
+import pandas as pd
+
+from .prefilter import _CLAUSES, negated
+from .signature_names import SignatureNames
+
+CONFIDENCE_THRESHOLD = 0.8
+
+ORDINAL_WORDS = {
+    'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5, 'sixth': 6,
+    'seventh': 7, 'eighth': 8, 'ninth': 9, 'tenth': 10, 'eleventh': 11, 'twelfth': 12,
+}
+VERTEBRAE = [f'C{n}' for n in range(1, 8)] + [f'T{n}' for n in range(1, 13)] + [f'L{n}' for n in range(1, 6)] + ['S1']
+# Abnormality class -> terms that mention it in a sentence
+FINDING_TERMS = {
+    'Nodule': r'nodul\w*',
+    'Mass': r'mass(?:es)?',
+    'Pleural Effusion': r'effusions?',
+    'Consolidation': r'consolidat\w*',
+    'Atelectasis': r'atelecta\w*',
+    'Pneumothorax': r'pneumothora\w*',
+    'Ground Glass Opacity': r'ground[\s-]glass\w*|GGOs?',
+    'Emphysema': r'emphysem\w*',
+    'Mosaic Attenuation': r'mosaic\w*',
+    'Bronchiectasis': r'bronchiecta\w*',
+    'Interlobular Septal Thickening': r'septal\s+thicken\w*|interlobular\s+septa\w*',
+    'kidney_cyst': r'(?:renal|kidneys?)\b.*\bcysts?|cysts?\b.*\b(?:renal|kidneys?)',
+    'adrenal_mass': r'adrenal\w*',
+    'Endobronchial_Mass': r'endobronch\w*|intraluminal|mass(?:es)?|lesions?|tumou?rs?|polyp\w*|nodul\w*',
+}
+# Other organs a kidney / adrenal sentence must not mention to be read by rule
+ABDOMEN_OTHERS = {
+    'kidney_cyst': r'adrenal\w*|liver|hepatic|spleen|splenic|pancrea\w*',
+    'adrenal_mass': r'renal|kidneys?|liver|hepatic|spleen|splenic|pancrea\w*',
+}
+
+_RIGHT = r'\b(?:right|rt)\b|\bright-sided\b|\bR[UML]L\b'
+_LEFT = r'\b(?:left|lt)\b|\bleft-sided\b|\bL[UL]L\b|\blingula\w*'
+_BOTH = r'\bbilateral\w*|\bboth\s+(?:lungs?|sides|hemithora\w*|kidneys|adrenal\w*|main|upper|lower)\b'
+_SIDES = re.compile(rf'(?P<right>{_RIGHT})|(?P<left>{_LEFT})|(?P<both>{_BOTH})', re.IGNORECASE)
+
+
+def _text(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ''
+    return str(value)
+
+
+def _sentences(text):
+    return [sentence for sentence in re.split(r'(?<=[.!?])\s+|\n+|;', _text(text)) if sentence.strip()]
+
+
+def sides(text):
+    """Sides named in the text: subset of {'right', 'left'}"""
+    found = set()
+    for match in _SIDES.finditer(text):
+        if match.group('both'):
+            found |= {'right', 'left'}
+        else:
+            found.add(match.lastgroup)
+    return found
+
+
+def _fields(names, ones):
+    return {name: int(name in ones) for name in names}
+
+
+# --- Ribs ---
+
+_ORDINAL = r'(?:\d{1,2}(?:st|nd|rd|th)|' + '|'.join(ORDINAL_WORDS) + r')'
+_RIB_TOKENS = re.compile(
+    rf'(?P<side>\b(?:right|rt|left|lt|bilateral\w*|both)\b)'
+    rf'|(?P<compact>\b(?-i:[RL])\d{{1,2}}(?:\s*[-–]\s*(?-i:[RL])?\d{{1,2}})?(?=\s*ribs?\b))'
+    rf'|(?P<range>\b{_ORDINAL}\s*(?:-|–|to|through|thru)\s*{_ORDINAL}\b)'
+    rf'|(?P<number>\b{_ORDINAL}\b)',
+    re.IGNORECASE)
+# "ribs 4-6 and 8" -> "4th-6th and 8th ribs"
+_RIB_NUMBERS = re.compile(r'\bribs?\s+((?:\d{1,2}\s*(?:-|–|to|through|and|,|&)\s*)*\d{1,2})\b(?!\s*(?:mm|cm|%))', re.IGNORECASE)
+
+
+def _ordinal_value(token):
+    token = token.lower()
+    return ORDINAL_WORDS.get(token) or int(re.match(r'\d+', token).group())
+
+
+def _rib_numbers(token):
+    values = [_ordinal_value(part) for part in re.findall(_ORDINAL, token, re.IGNORECASE)]
+    return list(range(values[0], values[-1] + 1)) if len(values) == 2 else values
+
+
+def _token_sides(token):
+    token = token.lower()
+    if token.startswith(('bilateral', 'both')):
+        return {'right', 'left'}
+    return {'right'} if token.startswith('r') else {'left'}
+
+
+# Words that may stand between a rib number and its "rib(s)": "right 4th, left 5th and 6th posterior ribs"
+_RIB_BINDING = re.compile(
+    rf'(?:\s|[,&/\-–]|\b(?:and|or|to|through|thru|right|rt|left|lt|bilateral\w*|both|'
+    rf'anterior|posterior|lateral|anterolateral|posterolateral|{_ORDINAL})\b)*ribs?\b',
+    re.IGNORECASE)
+# "right and left 5th ribs": both sides share the numbers after them
+_SIDE_JOIN = re.compile(r'\s*(?:and|&|,|/)?\s*', re.IGNORECASE)
+# "right 4, 5": numbers that are neither ordinals nor measurements
+_BARE_NUMBER = re.compile(r'\s*#?\d{1,2}(?![\d.]|\s*(?:st|nd|rd|th|mm|cm|%))', re.IGNORECASE)
+
+
+def _rib_sentence(sentence):
+    """
+    Rib fields of one sentence, or None if its side wording is ambiguous: each rib number takes the side
+    before it, so a number before any side ("4th right rib") or a side after the last number
+    ("5th rib fractures on the right") is left to the LLM
+    """
+    ones, side, used, previous = set(), None, False, None
+    for token in _RIB_TOKENS.finditer(sentence):
+        if token.lastgroup == 'side':
+            if previous is not None and previous.lastgroup == 'side' and \
+                    _SIDE_JOIN.fullmatch(sentence, previous.end(), token.start()):
+                side |= _token_sides(token.group())
+            else:
+                if side is not None and not used:
+                    return None
+                side, used = _token_sides(token.group()), False
+            if _BARE_NUMBER.match(sentence, token.end()):
+                return None
+        elif token.lastgroup == 'compact':
+            numbers = [int(n) for n in re.findall(r'\d{1,2}', token.group())]
+            ones |= {f'{s}{n}' for s in _token_sides(token.group()) for n in range(numbers[0], numbers[-1] + 1)}
+        elif _RIB_BINDING.match(sentence, token.end()):
+            # Ordinals that do not number a rib ("measuring 2nd attempt") are not rib numbers
+            if side is None:
+                return None
+            ones |= {f'{s}{n}' for s in side for n in _rib_numbers(token.group())}
+            used = True
+        previous = token
+    if side is not None and not used and ones:
+        return None
+    return ones
+
+
+def parse_ribs(lesion_sentence, **_):
+    """Locator_Rib_Fracture fields: rib numbers followed by "rib(s)", each with the side named before it"""
+    names = [f'{side}{n}' for side in ['right', 'left'] for n in range(1, 13)] + ['unspecified']
+    sentences = [sentence for sentence in _sentences(lesion_sentence) if re.search(r'\bribs?\b', sentence, re.IGNORECASE)]
+    if not sentences:
+        return _fields(names, set()), 0.0
+
+    ones = set()
+    for sentence in sentences:
+        sentence = _RIB_NUMBERS.sub(
+            lambda m: re.sub(r'\d{1,2}', lambda n: f'{n.group()}th', m.group(1)) + ' ribs', sentence)
+        found = _rib_sentence(sentence)
+        if found is None:
+            return _fields(names, set()), 0.5
+        ones |= found
+    if ones - set(names):
+        # Rib numbers above 12
+        return _fields(names, set()), 0.0
+    return _fields(names, ones or {'unspecified'}), 1.0
+
+
+# --- Vertebrae ---
+
+_LEVEL = r'[CTLS]\s?-?\s?\d{1,2}'
+_VERTEBRA_TOKENS = re.compile(rf'\b(?P<start>{_LEVEL})(?:\s*(?:-|–|to|through|thru)\s*(?P<end>[CTLS]?\s?\d{{1,2}}))?\b')
+_SPINE_REGIONS = re.compile(r'\b(?:cervical|thoracic|lumbar|sacral|sacrum|coccy\w*|odontoid|thoracolumbar|upper|mid|lower)\b', re.IGNORECASE)
+_FRACTURE = re.compile(r'\b(?:fractur\w*|compress\w*|collaps\w*|wedg\w*)', re.IGNORECASE)
+# "Wedge fracture of T6 and Schmorl nodes at T10-12": the levels of another finding are not fractures
+_PHRASE_BREAKS = re.compile(r',|\b(?:and|with|while|as\s+well\s+as)\b', re.IGNORECASE)
+_LEVEL_WORDS = re.compile(r'(?:[\s.()]|\b(?:the|of|at|or|levels?|vertebra\w*|bod(?:y|ies))\b)*', re.IGNORECASE)
+
+
+def _level(token, region=None):
+    token = re.sub(r'[\s-]', '', token).upper()
+    if token[0].isdigit():
+        token = region + token
+    return token
+
+
+def _fracture_levels(clause):
+    """
+    Level matches of the phrases (split at ',' and 'and') of a clause that mention a fracture.
+    A phrase of bare levels ("T7, T8 and T9 fractures") belongs to the phrase before it, or at the start to the one after it.
+    """
+    phrases = []
+    for phrase in _PHRASE_BREAKS.split(clause):
+        levels = list(_VERTEBRA_TOKENS.finditer(phrase))
+        bare = bool(levels) and _LEVEL_WORDS.fullmatch(_VERTEBRA_TOKENS.sub(' ', phrase)) is not None
+        phrases.append((levels, None if bare else bool(_FRACTURE.search(phrase))))
+    levels, before = [], None
+    for index, (matches, fracture) in enumerate(phrases):
+        if fracture is None:
+            after = next((owner for _, owner in phrases[index + 1:] if owner is not None), None)
+            fracture = before if before is not None else after
+        else:
+            before = fracture
+        if fracture:
+            levels += matches
+    return levels
+
+
+def parse_vertebrae(lesion_sentence, **_):
+    """Locator_Vertebrae_Fracture fields: levels and level ranges (T7-T9, T11-L1, T7-9) named with a fracture"""
+    names = ['C7'] + [f'T{n}' for n in range(1, 13)] + ['L1', 'L2', 'L3', 'unspecified']
+    text = _text(lesion_sentence)
+    if not _FRACTURE.search(text):
+        return _fields(names, set()), 0.0
+    ones = set()
+    for clause in _CLAUSES.split(text):
+        if not clause or not _FRACTURE.search(clause):
+            continue
+        for match in _fracture_levels(clause):
+            start = _level(match.group('start'))
+            end = _level(match.group('end'), start[0]) if match.group('end') else start
+            if start not in VERTEBRAE or end not in VERTEBRAE or VERTEBRAE.index(end) < VERTEBRAE.index(start):
+                return _fields(names, set()), 0.0
+            ones |= set(VERTEBRAE[VERTEBRAE.index(start):VERTEBRAE.index(end) + 1])
+    if not ones:
+        # "mid thoracic compression fracture" needs the LLM, a bare "compression fracture" does not
+        return _fields(names, {'unspecified'}), 0.5 if _SPINE_REGIONS.search(text) else 1.0
+    if ones - set(names):
+        # Levels without a column (S1, L4, C5, ...)
+        return _fields(names, set()), 0.0
+    return _fields(names, ones), 1.0
+
+
+# --- Lung ---
+
+_LOBE_ABBREVIATIONS = {'RUL': 'right_upper_lobe', 'RML': 'right_middle_lobe', 'RLL': 'right_lower_lobe',
+                       'LUL': 'left_upper_lobe', 'LLL': 'left_lower_lobe'}
+_LEVELS = r'(?:upper|middle|lower)'
+_LOBES = re.compile(
+    rf'\b(?P<side>right|left|bilateral|both)?\s*(?P<levels>{_LEVELS}(?:\s*(?:and|,|&|/)\s*{_LEVELS})*)\s+(?P<noun>lobes?)\b'
+    r'|\b(?P<abbreviation>RUL|RML|RLL|LUL|LLL)\b'
+    r'|\b(?P<lingula>lingula\w*)',
+    re.IGNORECASE)
+
+
+def lobes(text):
+    """(lobe fields named in the text, True if one of them was ambiguous)"""
+    found, ambiguous = set(), False
+    for match in _LOBES.finditer(text):
+        if match.group('abbreviation'):
+            if match.group('abbreviation') in _LOBE_ABBREVIATIONS:
+                found.add(_LOBE_ABBREVIATIONS[match.group('abbreviation')])
+            continue
+        if match.group('lingula'):
+            found.add('left_upper_lobe')
+            ambiguous = True
+            continue
+        side = (match.group('side') or '').lower()
+        levels = re.findall(_LEVELS, match.group('levels'), re.IGNORECASE)
+        if side in ['right', 'left']:
+            lobe_sides = [side]
+        elif side or match.group('noun').lower() == 'lobes' and len(levels) == 1:
+            # "bilateral lower lobes", "lower lobes"
+            lobe_sides = ['right', 'left']
+        elif [level.lower() for level in levels] == ['middle']:
+            lobe_sides = ['right']
+        else:
+            lobe_sides = []
+            ambiguous = True
+        for lobe_side in lobe_sides:
+            for level in levels:
+                if lobe_side == 'left' and level.lower() == 'middle':
+                    ambiguous = True
+                    continue
+                found.add(f'{lobe_side}_{level.lower()}_lobe')
+    return found, ambiguous
+
+
+def _finding(abnormality_class):
+    terms = FINDING_TERMS.get(abnormality_class)
+    return re.compile(rf'\b(?:{terms})\b', re.IGNORECASE) if terms else None
+
+
+def _other_findings(sentence, abnormality_class, others):
+    return any(re.search(rf'\b(?:{terms})\b', sentence, re.IGNORECASE) for name, terms in others.items() if name != abnormality_class)
+
+
+_LUNG_FINDINGS = {name: FINDING_TERMS[name] for name in [
+    'Nodule', 'Mass', 'Pleural Effusion', 'Consolidation', 'Atelectasis', 'Pneumothorax', 'Ground Glass Opacity',
+    'Emphysema', 'Mosaic Attenuation', 'Bronchiectasis', 'Interlobular Septal Thickening']}
+
+
+def _mentioning(report, abnormality_class):
+    """Clauses of the report that mention the abnormality without negating it, or None if it has no terms"""
+    finding = _finding(abnormality_class)
+    if finding is None:
+        return None
+    clauses = []
+    for clause in _CLAUSES.split(_text(report)):
+        if clause and any(not negated(clause, match) for match in finding.finditer(clause)):
+            clauses.append(clause)
+    return clauses
+
+
+def _laterality(report, abnormality_class, others):
+    names = ['right', 'left', 'unspecified']
+    clauses = _mentioning(report, abnormality_class)
+    if not clauses:
+        return _fields(names, set()), 0.0
+    if any(_other_findings(clause, abnormality_class, others) for clause in clauses):
+        # "Consolidation in left lung, with adjacent GGO": the side of the other finding may apply
+        return _fields(names, set()), 0.5
+    if any(_negated_side(clause, side) for clause in clauses for side in ['right', 'left']):
+        # "Left adrenal nodule, no right adrenal mass"
+        return _fields(names, set()), 0.5
+    found = set().union(*(sides(clause) for clause in clauses))
+    if not found and any(lobes(clause)[0] or lobes(clause)[1] for clause in clauses):
+        return _fields(names, set()), 0.5
+    return _fields(names, found or {'unspecified'}), 1.0
+
+
+def parse_lung_sides(report, abnormality_class, **_):
+    """Locator_RL fields from the clauses of the lung section that mention the abnormality"""
+    return _laterality(report, abnormality_class, _LUNG_FINDINGS)
+
+
+def _negated_side(text, side):
+    """True if a mention of the side or one of its lobes is negated ("no left nodules")"""
+    for clause in _CLAUSES.split(text):
+        for match in _SIDES.finditer(clause or ''):
+            if match.lastgroup in [side, 'both'] and negated(clause, match):
+                return True
+    return False
+
+
+def _parse_lobes(side, sentence, abnormality_class):
+    lobe_names = [name for name in _LOBE_ABBREVIATIONS.values() if name.startswith(side)]
+    names = lobe_names + ['unspecified']
+    text = _text(sentence)
+    if not text.strip() or any(_other_findings(clause, abnormality_class, _LUNG_FINDINGS) for clause in _sentences(text)):
+        return _fields(names, set()), 0.0
+    if _negated_side(text, side):
+        return _fields(names, set()), 0.5
+    found, ambiguous = lobes(text)
+    if ambiguous:
+        return _fields(names, set()), 0.5
+    ones = found & set(lobe_names)
+    if not ones:
+        # The side is named but none of its lobes ("left lung", "left-sided")
+        if side not in sides(text):
+            return _fields(names, set()), 0.0
+        ones = {'unspecified'}
+    return _fields(names, ones), 1.0
+
+
+def parse_left_lobes(sentence, abnormality_class=None, **_):
+    """Locator_Left_Lobes fields"""
+    return _parse_lobes('left', sentence, abnormality_class)
+
+
+def parse_right_lobes(sentence, abnormality_class=None, **_):
+    """Locator_Right_Lobes fields"""
+    return _parse_lobes('right', sentence, abnormality_class)
+
+
+# --- Abdomen, large airway ---
+
+def parse_abdomen_sides(report, abnormality_class, **_):
+    """Locator_Kidney_RL / Locator_adrenal_RL fields from the clauses that mention the kidney cyst / adrenal"""
+    others = {'other organ': ABDOMEN_OTHERS[abnormality_class]} if abnormality_class in ABDOMEN_OTHERS else {}
+    return _laterality(report, abnormality_class, others)
+
+
+def parse_endobronchial(lesion_sentence, **_):
+    """
+    Locator_Endobronchial_Mass fields: the side of the bronchus (lobar bronchi count for their side), from the clauses
+    that mention the lesion. Negated sides ("the right bronchi are not obstructed") do not count; both sides are left to the LLM.
+    """
+    names = ['left_main', 'right_main', 'unspecified']
+    clauses = _mentioning(lesion_sentence, 'Endobronchial_Mass')
+    if not clauses:
+        return _fields(names, set()), 0.0
+    found = set().union(*(sides(clause) for clause in clauses))
+    found -= {side for side in ['right', 'left'] if any(_negated_side(clause, side) for clause in clauses)}
+    if len(found) > 1:
+        return _fields(names, set()), 0.5
+    return _fields(names, {f'{side}_main' for side in found} or {'unspecified'}), 1.0
+
+
+class RuleLocator:
+    """A locator that answers from its parser when it is confident and asks the LLM locator otherwise"""
+    def __init__(self, locator, parse):
+        self.locator = locator
+        self.parse = parse
+        self.name = _names.lookup(locator.predict.signature)
+
+    def predictors(self):
+        return self.locator.predictors()
+
+    def __call__(self, **inputs):
+        fields, confidence = self.parse(**inputs)
+        if confidence < CONFIDENCE_THRESHOLD:
+            _count(self.name, 'llm')
+            return self.locator(**inputs)
+        _count(self.name, 'rule')
+        return dspy.Prediction(reasoning='', **fields)
+
+
+_enabled = False
+_names = SignatureNames()
+_stats = collections.defaultdict(lambda: {'rule': 0, 'llm': 0})
+_lock = threading.Lock()
+
+
+def configure_rule_locator(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def _count(name, key):
+    with _lock:
+        _stats[name][key] += 1
+
+
+def rule_locator(locator, parse):
+    """The locator behind its parser when --rule_locator is on, the locator itself otherwise"""
+    return RuleLocator(locator, parse) if _enabled else locator
+
+
+def rule_locator_stats():
+    """{locator signature: {'rule', 'llm'}} answered so far"""
+    with _lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
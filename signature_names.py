@@ -0,0 +1,57 @@
+import threading
+
+import dspy
+
+
+def _instructions_key(signature):
+    # Extended signatures may differ from their class in surrounding whitespace
+    return ' '.join(signature.instructions.split())
+
+
+def _signature_classes(cls=dspy.Signature):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _signature_classes(subclass)
+
+
+class SignatureNames:
+    """
+    Name of the Signature class a Predict was built from.
+    ChainOfThought renames its extended signature to StringSignature, so classes are matched by their instructions.
+    """
+    def __init__(self):
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        names = {}
+        for cls in _signature_classes():
+            if cls.__name__ != 'StringSignature':
+                names.setdefault(_instructions_key(cls), cls.__name__)
+        self._names = names
+
+    def lookup(self, signature):
+        key = _instructions_key(signature)
+        with self._lock:
+            if key not in self._names:
+                self._refresh()
+            return self._names.get(key, 'unknown')
+
+    def find(self, text):
+        """Name of the signature whose instructions appear in text (e.g. a rendered system message)"""
+        with self._lock:
+            if not self._names:
+                self._refresh()
+            names = sorted(self._names.items(), key=lambda item: -len(item[0]))
+        for key, name in names:
+            if key and key in text:
+                return name
+        return 'unknown'
+
+
+def current_signature(names):
+    """Name of the signature whose Predict is making the current LM call (dspy tracks the calling modules per thread)"""
+    for module in reversed(dspy.settings.caller_modules or []):
+        if isinstance(module, dspy.Predict):
+            return names.lookup(module.signature)
+    return 'unknown'
@@ -0,0 +1,89 @@
+"""
+LLM calls per report against FakeLM. The counts are exact: a change that adds calls fails here, and so does one
+that drops calls (and leaves labels at 0); a change that saves calls on purpose updates its count.
+"""
+import dspy
+import pytest
+
+from ..benchmark.call_count import EXPECTED_CALLS, count_calls
+from ..benchmark.fake_lm import FakeLM
+from ..benchmark.synthetic_reports import generate
+from ..create_csv.lung import configure_lung_locator
+from ..formatting.formatting_report import format_csv
+from ..main import ORGAN_CSV
+from ..negative_sections import configure_negative_sections
+from ..prefilter import configure_prefilter
+from ..rule_locator import configure_rule_locator, rule_locator_stats
+
+# Organ builder calls (formatting excluded) over 30 synthetic reports at a 15% positive rate
+BUILDER_CALLS = {
+    'default': 950,
+    'no_negative_fast_path': 1280,
+    'prefilter': 392,
+    'rule_locator': 829,
+    'lung_fused': 883,
+    'lung_fused_all': 857,
+}
+OPTIONS = {
+    'default': {},
+    'no_negative_fast_path': {'negative_fast_path': False},
+    'prefilter': {'prefilter': True},
+    'rule_locator': {'rule_locator': True},
+    'lung_fused': {'lung_locator': 'fused'},
+    'lung_fused_all': {'lung_locator': 'fused_all'},
+}
+
+
+def configure(negative_fast_path=True, prefilter=False, rule_locator=False, lung_locator='chain'):
+    configure_negative_sections(enabled=negative_fast_path)
+    configure_prefilter(prefilter)
+    configure_rule_locator(rule_locator)
+    configure_lung_locator(lung_locator)
+
+
+@pytest.fixture(autouse=True)
+def default_options():
+    configure()
+    yield
+    configure()
+
+
+@pytest.mark.parametrize('organ', EXPECTED_CALLS)
+def test_classifier_calls(organ):
+    lm = FakeLM()
+    dspy.configure(lm=lm)
+    classifier, expected = EXPECTED_CALLS[organ]
+    assert count_calls(classifier, lm) == expected
+
+
+@pytest.fixture(scope='module')
+def format_df(tmp_path_factory):
+    report_df, _ = generate(30, rate=0.15, seed=1)
+    lm = FakeLM(signature_aware=True)
+    dspy.configure(lm=lm)
+    return format_csv(str(tmp_path_factory.mktemp('format') / 'format.csv'), report_df, max_workers=4, lm=lm)
+
+
+def builder_calls(format_df, output_dir):
+    lm = FakeLM(signature_aware=True)
+    dspy.configure(lm=lm)
+    for organ, build in ORGAN_CSV.items():
+        build(str(output_dir / f'{organ}.csv'), format_df, workers=4)
+    return lm
+
+
+@pytest.mark.parametrize('option', OPTIONS)
+def test_builder_calls(option, format_df, tmp_path):
+    configure(**OPTIONS[option])
+    lm = builder_calls(format_df, tmp_path)
+    assert lm.calls == BUILDER_CALLS[option]
+
+
+def test_rule_locator_answers_plain_locations(format_df, tmp_path):
+    configure(rule_locator=True)
+    before = rule_locator_stats()
+    builder_calls(format_df, tmp_path)
+    # The synthetic reports name their locations plainly: no locator but the lung sides needs the LLM
+    for name, stats in rule_locator_stats().items():
+        if name != 'Locator_RL':
+            assert stats['llm'] == before.get(name, {}).get('llm', 0), name
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from ..journal import start_journal, open_dead_letter
+from ..pipeline import process_reports
+
+REPORTS = pd.DataFrame({'id': [1, 2, 3], 'report': ['a', 'b', 'c']})
+
+
+def run(path, resume, failing):
+    journal, done = start_journal(str(path), resume)
+    dead_letter = open_dead_letter(journal, resume, done)
+
+    def process(row):
+        if row['id'] in failing:
+            raise ValueError(f"report {row['id']}")
+        journal.append({'id': row['id']})
+
+    process_reports(process, REPORTS, done=done, dead_letter=dead_letter, organ='test')
+    return dead_letter
+
+
+def test_resume_keeps_one_dead_letter_per_report(tmp_path):
+    run(tmp_path / 'test.jsonl', resume=False, failing={2, 3})
+    run(tmp_path / 'test.jsonl', resume=True, failing={2, 3})
+    dead_letter = run(tmp_path / 'test.jsonl', resume=True, failing={2})
+
+    with open(dead_letter.path, encoding='utf-8') as f:
+        lines = f.readlines()
+    # Report 3 finished on the last resume, report 2 failed three times
+    assert len(lines) == 1
+    assert list(dead_letter.load()) == [2]
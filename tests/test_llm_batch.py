@@ -0,0 +1,81 @@
+from http.server import ThreadingHTTPServer
+import threading
+
+import dspy
+import pytest
+from litellm import ModelResponse, completion_cost
+
+from ..benchmark.fake_batch_server import FakeBatchAPI, make_handler
+from ..benchmark.fake_lm import FakeLM
+from ..llm_batch import BATCH_DISCOUNT, BatchAdapter, BatchCollectorLM, BatchPending, BatchRunner
+from ..llm_cache import LLMCache
+from ..llm_client import create_batch_lm, find_layer
+from ..usage_ledger import UsageLedger
+
+MESSAGES = [{'role': 'user', 'content': 'Respond with the corresponding output fields, starting with the field `[[ ## answer ## ]]`'}]
+
+
+def test_batch_cost_is_booked_once(tmp_path):
+    collector = BatchCollectorLM(FakeLM(), LLMCache(str(tmp_path)))
+    key = collector.response_cache.key(collector.model, None, MESSAGES, dict(collector.kwargs))
+    response = ModelResponse(choices=[{'message': {'role': 'assistant', 'content': '[[ ## answer ## ]]\n0'}}])
+    collector.store(key, response, 0.25)
+
+    # The call the batch answered is charged the batch cost, a repeat of it is a free cache hit
+    first = collector.forward(messages=MESSAGES)
+    assert first._hidden_params['response_cost'] == 0.25
+    assert not first.cache_hit
+    second = collector.forward(messages=MESSAGES)
+    assert second._hidden_params['response_cost'] == 0.0
+    assert second.cache_hit
+
+
+@pytest.fixture
+def batch_api():
+    api = FakeBatchAPI(value='1')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield api, f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def test_batch_rounds_book_the_discounted_cost(batch_api, tmp_path, monkeypatch):
+    api, base_url = batch_api
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    ledger = UsageLedger(str(tmp_path / 'usage.jsonl'))
+    lm = create_batch_lm(str(tmp_path / 'cache'), ledger=ledger)
+    collector = find_layer(lm, BatchCollectorLM)
+    runner = BatchRunner(collector, str(tmp_path / 'batch'), base_url=base_url, poll_interval=0.01)
+
+    # Two dependent links per report, as a classifier and its locator
+    count = dspy.Predict('report -> count: int')
+    label = dspy.Predict('report, count: int -> label: int')
+    reports = ['report one', 'report two', 'report three']
+    rows = {}
+    with dspy.context(lm=lm, adapter=BatchAdapter()):
+        while True:
+            for report in reports:
+                if report in rows:
+                    continue
+                try:
+                    rows[report] = label(report=report, count=count(report=report).count).label
+                except BatchPending:
+                    pass
+            requests = collector.take_pending()
+            if not requests:
+                break
+            runner.run(requests)
+    ledger.close()
+
+    assert runner.rounds == 2
+    assert rows == {report: 1 for report in reports}
+    # Each batch response is paid once, at the discounted price
+    responses = [ModelResponse(**api.answer(line)['response']['body'])
+                 for file_id, content in api.files.items() if file_id in {b['input_file_id'] for b in api.batches.values()}
+                 for line in content.decode('utf-8').splitlines()]
+    expected = sum(completion_cost(completion_response=response) for response in responses) * BATCH_DISCOUNT
+    assert len(responses) == 2 * len(reports)
+    assert expected > 0
+    assert ledger.cost() == pytest.approx(expected)
+    assert runner.cost == pytest.approx(expected)
@@ -0,0 +1,25 @@
+import threading
+import time
+
+from ..benchmark.fake_lm import FakeLM
+from ..llm_client import create_lm, find_layer
+from ..llm_gate import GatedLM
+from ..rate_control import RatePacedLM
+
+MESSAGES = [{'role': 'user', 'content': 'Respond with the corresponding output fields, starting with the field `[[ ## answer ## ]]`'}]
+
+
+def test_rate_wait_does_not_hold_a_gate_slot():
+    lm = create_lm(max_inflight=1, rpm=600, backend=FakeLM())
+    gate = find_layer(lm, GatedLM).gate
+    controller = find_layer(lm, RatePacedLM).controller
+    # A Retry-After pause, as after a 429
+    controller._paused_until = time.monotonic() + 0.5
+
+    call = threading.Thread(target=lm.forward, kwargs={'messages': MESSAGES})
+    call.start()
+    time.sleep(0.2)
+    assert call.is_alive()
+    assert gate.inflight == 0
+    call.join()
+    assert gate.inflight == 0
@@ -0,0 +1,25 @@
+import threading
+
+from ..benchmark.fake_lm import FakeLM, constant_latency
+from ..llm_client import create_lm, find_layer
+from ..llm_hedge import HedgedLM, signature_key
+
+MESSAGES = [{'role': 'user', 'content': 'Respond with the corresponding output fields, starting with the field `[[ ## answer ## ]]`'}]
+
+
+def test_queue_wait_is_not_hedged():
+    lm = create_lm(max_inflight=1, hedge_percentile=95, hedge_max_ratio=1.0, backend=FakeLM(latency=constant_latency(0.05)))
+    hedger = find_layer(lm, HedgedLM)
+    for _ in range(hedger.latencies.min_samples):
+        lm.forward(messages=MESSAGES)
+
+    # Four calls on a single slot: the last ones queue for several request times
+    calls = [threading.Thread(target=lm.forward, kwargs={'messages': MESSAGES}) for _ in range(4)]
+    for call in calls:
+        call.start()
+    for call in calls:
+        call.join()
+
+    assert hedger.hedged == 0
+    # Queue time is not in the recorded latencies
+    assert hedger.latencies.percentile(signature_key(None, MESSAGES), 100) < 0.1
@@ -0,0 +1,79 @@
+import pytest
+
+from ..rule_locator import (CONFIDENCE_THRESHOLD, parse_abdomen_sides, parse_endobronchial, parse_left_lobes, parse_lung_sides,
+                            parse_ribs, parse_right_lobes, parse_vertebrae)
+
+
+def ones(fields):
+    return {name for name, value in fields.items() if value}
+
+
+@pytest.mark.parametrize('sentence, expected', [
+    ("Fractures of the right and left 5th ribs.", {'right5', 'left5'}),
+    ("Right 4th and left 5th rib fractures.", {'right4', 'left5'}),
+    ("Left 5th rib fracture, measuring 2nd attempt", {'left5'}),
+    ("Fractures of right ribs 4-6.", {'right4', 'right5', 'right6'}),
+    ("Multiple right rib fractures.", {'unspecified'}),
+])
+def test_ribs(sentence, expected):
+    fields, confidence = parse_ribs(sentence)
+    assert confidence >= CONFIDENCE_THRESHOLD
+    assert ones(fields) == expected
+
+
+@pytest.mark.parametrize('sentence', [
+    "Fractures of the 4th right and 5th left ribs.",
+    "left 4th rib and 5th rib fractures on the right",
+    "5th rib fracture.",
+    "Rib fractures: right 4, 5; left 6",
+])
+def test_ribs_left_to_the_llm(sentence):
+    assert parse_ribs(sentence)[1] < CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize('sentence, expected', [
+    ("Wedge fracture of T6 and multiple Schmorl nodes at T10-12", {'T6'}),
+    ("Compression fractures of T7, T8 and T9.", {'T7', 'T8', 'T9'}),
+    ("T11-L1 compression fractures", {'T11', 'T12', 'L1'}),
+])
+def test_vertebrae(sentence, expected):
+    fields, confidence = parse_vertebrae(sentence)
+    assert confidence >= CONFIDENCE_THRESHOLD
+    assert ones(fields) == expected
+
+
+@pytest.mark.parametrize('sentence', ["S1 fracture", "L4 compression fracture", "C5 fracture", "Mid thoracic compression fracture"])
+def test_vertebrae_left_to_the_llm(sentence):
+    assert parse_vertebrae(sentence)[1] < CONFIDENCE_THRESHOLD
+
+
+def test_negated_side_is_left_to_the_llm():
+    sentence = "Right lower lobe nodule; no left nodules."
+    assert parse_left_lobes(sentence, abnormality_class='Nodule')[1] < CONFIDENCE_THRESHOLD
+    fields, confidence = parse_right_lobes(sentence, abnormality_class='Nodule')
+    assert confidence >= CONFIDENCE_THRESHOLD
+    assert ones(fields) == {'right_lower_lobe'}
+
+
+@pytest.mark.parametrize('sentence, expected', [
+    ("Endobronchial mass in the left main bronchus; the right bronchi are patent.", {'left_main'}),
+    ("Endobronchial lesion in the right lower lobe bronchus.", {'right_main'}),
+    ("Endobronchial mass in the left main bronchus without right bronchial involvement.", {'left_main'}),
+])
+def test_endobronchial(sentence, expected):
+    fields, confidence = parse_endobronchial(sentence)
+    assert confidence >= CONFIDENCE_THRESHOLD
+    assert ones(fields) == expected
+
+
+def test_endobronchial_sides_of_other_findings_are_left_to_the_llm():
+    assert parse_endobronchial("Endobronchial mass in the left main bronchus, the right bronchi are patent.")[1] < CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize('parse, report, abnormality_class', [
+    (parse_abdomen_sides, "Left adrenal nodule, no right adrenal mass.", 'adrenal_mass'),
+    (parse_abdomen_sides, "Left adrenal nodule, no right adrenal mass.", 'Nodule'),
+    (parse_lung_sides, "Left lower lobe nodule, no right nodules.", 'Nodule'),
+])
+def test_negated_side_in_a_clause_is_left_to_the_llm(parse, report, abnormality_class):
+    assert parse(report, abnormality_class)[1] < CONFIDENCE_THRESHOLD
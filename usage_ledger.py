@@ -0,0 +1,139 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import dspy
+
+from .call_context import current_call, current_stage
+from .journal import _to_builtin
+from .signature_names import SignatureNames, current_signature
+
+
+class Totals:
+    """Running usage aggregates of one group of calls"""
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, entry):
+        self.calls += 1
+        self.cache_hits += int(entry['cache_hit'])
+        self.prompt_tokens += entry['prompt_tokens']
+        self.completion_tokens += entry['completion_tokens']
+        self.cached_tokens += entry['cached_tokens']
+        self.cost += entry['cost']
+        self.latency += entry['latency']
+        self.max_latency = max(self.max_latency, entry['latency'])
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'cache_hits': self.cache_hits,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cached_tokens': self.cached_tokens,
+            'cost': self.cost,
+            'mean_latency': self.latency / self.calls if self.calls else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+
+class UsageLedger:
+    """
+    Per-call usage (model, signature, stage, organ, report id, tokens, latency, cost) streamed to a JSONL file.
+
+    Only running totals per stage, organ and signature are kept in memory, so it stays small on any run size.
+    Without resume the previous ledger is discarded.
+    """
+    GROUPS = ['stage', 'organ', 'signature']
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        self.total = Totals()
+        self._groups = {group: collections.defaultdict(Totals) for group in self.GROUPS}
+        self._lock = threading.Lock()
+
+    def record(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, default=_to_builtin)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            self.total.add(entry)
+            for group, totals in self._groups.items():
+                totals[str(entry.get(group))].add(entry)
+
+    def cost(self, group=None, key=None):
+        """Cost of the whole run, or of one stage / organ / signature"""
+        with self._lock:
+            if group is None:
+                return self.total.cost
+            totals = self._groups[group].get(key)
+            return totals.cost if totals else 0.0
+
+    def summary(self):
+        with self._lock:
+            summary = {'total': self.total.summary()}
+            for group, totals in self._groups.items():
+                summary[f'by_{group}'] = {key: value.summary() for key, value in sorted(totals.items())}
+        return summary
+
+    def write_summary(self, path):
+        summary = self.summary()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=4, ensure_ascii=False)
+        return summary
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def usage_entry(response, latency):
+    usage = getattr(response, 'usage', None)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', None) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', None) or 0,
+        # Prompt tokens served from OpenAI's prompt cache (billed at a discount)
+        'cached_tokens': getattr(details, 'cached_tokens', None) or 0,
+        'cache_hit': bool(getattr(response, 'cache_hit', False)),
+        'cost': getattr(response, '_hidden_params', {}).get('response_cost') or 0.0,
+        'latency': latency,
+    }
+
+
+class LedgerLM(dspy.BaseLM):
+    """dspy LM that records the usage of every call answered by the wrapped LM (cache hits included, at cost 0) in a UsageLedger"""
+    def __init__(self, lm, ledger):
+        super().__init__(model=lm.model, model_type=lm.model_type, cache=False)
+        self.kwargs = lm.kwargs
+        self.lm = lm
+        self.ledger = ledger
+        self.signature_names = SignatureNames()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        start = time.monotonic()
+        response = self.lm.forward(prompt=prompt, messages=messages, **kwargs)
+        latency = time.monotonic() - start
+
+        call = current_call()
+        entry = {
+            'model': getattr(response, 'model', None) or self.model,
+            'signature': current_signature(self.signature_names),
+            'stage': current_stage(),
+            'organ': call.get('organ'),
+            'report_id': call.get('report_id'),
+        }
+        entry.update(usage_entry(response, latency))
+        self.ledger.record(entry)
+        return response